@@ -2,7 +2,7 @@
 
 import { useEffect, useState } from 'react';
 import { useTranslations } from 'next-intl';
-import { appointmentsAPI, doctorsAPI, servicesAPI, shiftsAPI } from '@/lib/api';
+import { statsAPI } from '@/lib/api';
 
 interface DashboardStats {
   totalAppointments: number;
@@ -26,18 +26,13 @@ export default function DashboardPage() {
     const fetchStats = async () => {
       try {
         setLoading(true);
-        const [appointments, doctors, services, shifts] = await Promise.all([
-          appointmentsAPI.getAll(),
-          doctorsAPI.getAll(),
-          servicesAPI.getAll(),
-          shiftsAPI.getAll(),
-        ]);
+        const totals = await statsAPI.getTotals();
 
         setStats({
-          totalAppointments: appointments.data.length,
-          totalDoctors: doctors.data.length,
-          totalServices: services.data.length,
-          totalShifts: shifts.data.length,
+          totalAppointments: totals.data.appointments,
+          totalDoctors: totals.data.doctors,
+          totalServices: totals.data.services,
+          totalShifts: totals.data.shifts,
         });
         setError(null);
       } catch (err) {
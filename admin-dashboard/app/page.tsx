@@ -1,7 +1,7 @@
 'use client';
 
 import { useEffect, useState } from 'react';
-import { appointmentsAPI, doctorsAPI, servicesAPI, shiftsAPI, calendarAPI } from '@/lib/api';
+import { statsAPI, calendarAPI } from '@/lib/api';
 import type { Appointment, CalendarData } from '@/lib/types';
 import { format, startOfWeek, addDays, getWeek } from 'date-fns';
 
@@ -28,19 +28,16 @@ export default function DashboardPage() {
     const fetchDashboardData = async () => {
       try {
         setLoading(true);
-        const [appointments, doctors, services, shifts, calendar] = await Promise.all([
-          appointmentsAPI.getAll(),
-          doctorsAPI.getAll(),
-          servicesAPI.getAll(),
-          shiftsAPI.getAll({ week: currentWeek }),
+        const [totals, calendar] = await Promise.all([
+          statsAPI.getTotals(),
           calendarAPI.getWeek(currentWeek),
         ]);
 
         setStats({
-          totalAppointments: appointments.data.length,
-          totalDoctors: doctors.data.length,
-          totalServices: services.data.length,
-          totalShifts: shifts.data.length,
+          totalAppointments: totals.data.appointments,
+          totalDoctors: totals.data.doctors,
+          totalServices: totals.data.services,
+          totalShifts: totals.data.shifts,
         });
         setCalendarData(calendar.data);
         setError(null);
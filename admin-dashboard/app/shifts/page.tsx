@@ -1,7 +1,7 @@
 'use client'
 
 import { useState, useEffect } from 'react'
-import { shiftsAPI } from '@/lib/api'
+import { shiftsAPI, cursorFrom } from '@/lib/api'
 import { Shift } from '@/lib/types'
 
 interface ShiftFormData {
@@ -16,6 +16,8 @@ export default function ShiftsPage() {
   const [shifts, setShifts] = useState<Shift[]>([])
   const [isLoading, setIsLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
+  const [nextCursor, setNextCursor] = useState<string | undefined>()
+  const [isLoadingMore, setIsLoadingMore] = useState(false)
   const [showForm, setShowForm] = useState(false)
   const [selectedShift, setSelectedShift] = useState<Shift | null>(null)
   const [formData, setFormData] = useState<ShiftFormData>({
@@ -30,7 +32,8 @@ export default function ShiftsPage() {
     try {
       setIsLoading(true)
       const response = await shiftsAPI.getAll()
-      setShifts(response.data)
+      setShifts(response.data.results)
+      setNextCursor(cursorFrom(response.data.next))
       setError(null)
     } catch (err) {
       setError('Неуспешно вчитување на смените')
@@ -40,6 +43,20 @@ export default function ShiftsPage() {
     }
   }
 
+  const loadMoreShifts = async () => {
+    try {
+      setIsLoadingMore(true)
+      const response = await shiftsAPI.getAll({ cursor: nextCursor })
+      setShifts(previous => [...previous, ...response.data.results])
+      setNextCursor(cursorFrom(response.data.next))
+    } catch (err) {
+      setError('Неуспешно вчитување на смените')
+      console.error('Error fetching shifts:', err)
+    } finally {
+      setIsLoadingMore(false)
+    }
+  }
+
   useEffect(() => {
     fetchShifts()
   }, [])
@@ -310,6 +327,17 @@ export default function ShiftsPage() {
             </li>
           ))}
         </ul>
+        {nextCursor && (
+          <div className="flex justify-center border-t border-gray-200 py-4">
+            <button
+              onClick={loadMoreShifts}
+              disabled={isLoadingMore}
+              className="rounded-md px-4 py-2 text-sm font-medium text-[#44B0B6] ring-1 ring-inset ring-[#44B0B6] hover:bg-gray-50 disabled:opacity-50"
+            >
+              {isLoadingMore ? 'Се вчитуваат смените...' : 'Вчитај повеќе'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   )
@@ -2,7 +2,7 @@
 
 import { useState, useEffect } from 'react'
 import { format } from 'date-fns'
-import { appointmentsAPI } from '@/lib/api'
+import { appointmentsAPI, cursorFrom } from '@/lib/api'
 import type { Appointment } from '@/lib/types'
 
 interface AppointmentListProps {
@@ -14,6 +14,8 @@ export default function AppointmentList({ onEdit, patientNameFilter }: Appointme
   const [appointments, setAppointments] = useState<Appointment[]>([])
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
+  const [nextCursor, setNextCursor] = useState<string | undefined>()
+  const [loadingMore, setLoadingMore] = useState(false)
 
   useEffect(() => {
     fetchAppointments()
@@ -25,7 +27,8 @@ export default function AppointmentList({ onEdit, patientNameFilter }: Appointme
       const response = await appointmentsAPI.getAll({ 
         patient_name: patientNameFilter 
       })
-      setAppointments(response.data)
+      setAppointments(response.data.results)
+      setNextCursor(cursorFrom(response.data.next))
       setError(null)
     } catch (err) {
       setError('Неуспешно вчитување на термини')
@@ -35,6 +38,23 @@ export default function AppointmentList({ onEdit, patientNameFilter }: Appointme
     }
   }
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true)
+      const response = await appointmentsAPI.getAll({ 
+        patient_name: patientNameFilter,
+        cursor: nextCursor,
+      })
+      setAppointments(previous => [...previous, ...response.data.results])
+      setNextCursor(cursorFrom(response.data.next))
+    } catch (err) {
+      console.error('Error fetching appointments:', err)
+      alert('Неуспешно вчитување на термини')
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handleDelete = async (id: number) => {
     if (window.confirm('Дали сте сигурни дека сакате да го избришете овој термин?')) {
       try {
@@ -170,6 +190,17 @@ export default function AppointmentList({ onEdit, patientNameFilter }: Appointme
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <div className="flex justify-center py-4">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-4 py-2 text-sm text-indigo-600 border border-indigo-600 rounded-md hover:bg-indigo-50 disabled:opacity-50"
+          >
+            {loadingMore ? 'Се вчитуваат термини...' : 'Вчитај повеќе'}
+          </button>
+        </div>
+      )}
     </div>
   )
 } 
\ No newline at end of file
@@ -3,7 +3,7 @@
 import { useState, useEffect } from 'react'
 import { format } from 'date-fns'
 import { PencilIcon, TrashIcon } from '@heroicons/react/24/outline'
-import { shiftsAPI } from '@/lib/api'
+import { shiftsAPI, cursorFrom } from '@/lib/api'
 
 type Shift = {
   id: number
@@ -22,6 +22,8 @@ export default function ShiftList() {
   const [shifts, setShifts] = useState<Shift[]>([])
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
+  const [nextCursor, setNextCursor] = useState<string | undefined>()
+  const [loadingMore, setLoadingMore] = useState(false)
 
   useEffect(() => {
     fetchShifts()
@@ -31,7 +33,8 @@ export default function ShiftList() {
     try {
       setLoading(true)
       const response = await shiftsAPI.getAll()
-      setShifts(response.data)
+      setShifts(response.data.results)
+      setNextCursor(cursorFrom(response.data.next))
       setError(null)
     } catch (err) {
       setError('Failed to fetch shifts')
@@ -41,6 +44,20 @@ export default function ShiftList() {
     }
   }
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true)
+      const response = await shiftsAPI.getAll({ cursor: nextCursor })
+      setShifts(previous => [...previous, ...response.data.results])
+      setNextCursor(cursorFrom(response.data.next))
+    } catch (err) {
+      console.error('Error fetching shifts:', err)
+      alert('Failed to fetch shifts')
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handleDelete = async (id: number) => {
     if (window.confirm('Are you sure you want to delete this shift?')) {
       try {
@@ -123,6 +140,17 @@ export default function ShiftList() {
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <div className="flex justify-center py-4">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="px-4 py-2 text-sm text-blue-600 border border-blue-600 rounded-md hover:bg-blue-50 disabled:opacity-50"
+          >
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   )
 } 
\ No newline at end of file
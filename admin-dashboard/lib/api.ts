@@ -6,6 +6,9 @@ import type {
   Shift, 
   CalendarData, 
   FutureAppointmentsData,
+  Paginated,
+  Totals,
+  BulkAppointmentResponse,
   LoginCredentials,
   AuthResponse
 } from './types'
@@ -67,6 +70,10 @@ api.interceptors.response.use(
   }
 )
 
+// The cursor of a paginated response's next or previous link, to pass back to getAll
+export const cursorFrom = (url: string | null) =>
+  url ? new URL(url).searchParams.get('cursor') ?? undefined : undefined
+
 // Auth API
 export const authAPI = {
   login: (credentials: LoginCredentials) =>
@@ -77,14 +84,18 @@ export const authAPI = {
 
 // Appointments API
 export const appointmentsAPI = {
-  getAll: (params?: { patient_name?: string }) => 
-    api.get<Appointment[]>('/appointments/', { params }),
+  getAll: (params?: { patient_name?: string; cursor?: string; page_size?: number }) => 
+    api.get<Paginated<Appointment>>('/appointments/', { params }),
+  getRange: (startDate: string, endDate: string) => 
+    api.get<Appointment[]>('/appointments/', { params: { start_date: startDate, end_date: endDate } }),
   getById: (id: number) => 
     api.get<Appointment>(`/appointments/${id}/`),
   create: (data: Partial<Appointment>) => 
     api.post<Appointment>('/appointments/', data),
   update: (id: number, data: Partial<Appointment>) => 
     api.put<Appointment>(`/appointments/${id}/`, data),
+  bulk: (appointments: Partial<Appointment>[], mode: 'atomic' | 'best_effort' = 'atomic') => 
+    api.post<BulkAppointmentResponse>('/appointments/bulk/', { appointments, mode }),
   delete: (id: number) => 
     api.delete(`/appointments/${id}/`),
   getFuture: (week: number) => 
@@ -121,8 +132,10 @@ export const servicesAPI = {
 
 // Shifts API
 export const shiftsAPI = {
-  getAll: (params?: { week?: number }) => 
-    api.get<Shift[]>('/shifts/', { params }),
+  getAll: (params?: { cursor?: string; page_size?: number }) => 
+    api.get<Paginated<Shift>>('/shifts/', { params }),
+  getWeek: (week: number, year?: number) => 
+    api.get<Shift[]>('/shifts/', { params: { week, year } }),
   getById: (id: number) => 
     api.get<Shift>(`/shifts/${id}/`),
   create: (data: Partial<Shift>) => 
@@ -137,6 +150,19 @@ export const shiftsAPI = {
     api.delete(`/shifts/${id}/doctors/${doctorId}/`),
   generateWeek: (week: number, year?: number) => 
     api.post('/shifts/generate_week/', { week, year }),
+  generateRange: (startWeek: number, startYear: number, endWeek: number, endYear: number) => 
+    api.post('/shifts/generate_range/', {
+      start_week: startWeek,
+      start_year: startYear,
+      end_week: endWeek,
+      end_year: endYear,
+    }),
+}
+
+// Stats API
+export const statsAPI = {
+  getTotals: () => 
+    api.get<Totals>('/stats/totals/'),
 }
 
 // Calendar API
@@ -32,6 +32,7 @@ export interface Service {
 
 export interface Shift {
   id: number;
+  year: number;
   week_of_year: number;
   day_of_week: number;
   day_name: string;
@@ -42,6 +43,34 @@ export interface Shift {
   doctor_ids?: number[];
 }
 
+export interface Paginated<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}
+
+export interface Totals {
+  appointments: number;
+  doctors: number;
+  services: number;
+  shifts: number;
+}
+
+export interface BulkAppointmentResult {
+  index: number;
+  status: 'created' | 'updated' | 'error' | 'skipped';
+  id: number | null;
+  errors: Record<string, string[]> | null;
+}
+
+export interface BulkAppointmentResponse {
+  mode: 'atomic' | 'best_effort';
+  created: number;
+  updated: number;
+  failed: number;
+  results: BulkAppointmentResult[];
+}
+
 export interface CalendarDay {
   date: string;
   day_name: string;
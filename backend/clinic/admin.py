@@ -15,8 +15,8 @@ class ServiceAdmin(admin.ModelAdmin):
 
 @admin.register(Shift)
 class ShiftAdmin(admin.ModelAdmin):
-    list_display = ['week_of_year', 'get_day_name', 'shift_type', 'start_time', 'end_time', 'get_doctor_names']
-    list_filter = ['week_of_year', 'day_of_week', 'shift_type']
+    list_display = ['year', 'week_of_year', 'get_day_name', 'shift_type', 'start_time', 'end_time', 'get_doctor_names']
+    list_filter = ['year', 'week_of_year', 'day_of_week', 'shift_type']
     search_fields = ['week_of_year']
     filter_horizontal = ['doctors']
     
@@ -24,8 +24,11 @@ class ShiftAdmin(admin.ModelAdmin):
         return dict(Shift.DAYS_OF_WEEK)[obj.day_of_week]
     get_day_name.short_description = 'Day'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('doctors')
+
     def get_doctor_names(self, obj):
-        return ", ".join([doctor.full_name for doctor in obj.doctors.all()])
+        return obj.get_doctor_names()
     get_doctor_names.short_description = 'Doctors'
 
 @admin.register(Appointment)
@@ -9,3 +9,22 @@ class ClinicConfig(AppConfig):
         from .models import create_default_superuser
         from django.db.models.signals import post_migrate
         post_migrate.connect(create_default_superuser, sender=self)
+        
+        from .utils import calendar_cache
+        calendar_cache.connect_signals()
+        
+        from .utils import daily_stats
+        daily_stats.connect_signals()
+        
+        from .utils import changes
+        changes.connect_signals()
+        
+        from .utils import events
+        events.connect_signals()
+        
+        from django.db.backends.signals import connection_created
+        from .middleware import install_query_wrappers
+        connection_created.connect(install_query_wrappers, dispatch_uid='clinic_query_timer')
+        
+        from .utils.database import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='clinic_sqlite_pragmas')
@@ -0,0 +1,176 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from .authentication import AsyncEventStreamAuthentication, AsyncJWTAuthentication
+from .serializers import ShiftSerializer
+from .utils.calendar_cache import aget_cached_week
+from .utils.changes import ChangesExpired, achanges_since, latest_seq, parse_feed_params
+from .utils.events import get_broker, hub, stream_events
+from .utils.query_budget import query_budget
+from .utils.shift_rotation import ShiftRotationManager
+
+# Native async versions of the read-heavy endpoints, served under
+# /api/async/ next to the DRF API. DRF views are sync, so under ASGI each of
+# their requests holds a worker thread; these run in the event loop and only
+# hop to a thread for their queries. Responses match the sync endpoints.
+
+authentication = AsyncJWTAuthentication()
+event_stream_authentication = AsyncEventStreamAuthentication()
+renderer = JSONRenderer()
+
+
+def render(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(
+        renderer.render(data), status=status_code, content_type='application/json', headers=headers
+    )
+
+
+def render_exception(exception):
+    """Render an APIException the way DRF's exception handler does"""
+    detail = exception.detail
+    data = detail if isinstance(detail, (dict, list)) else {'detail': detail}
+    if isinstance(exception, (NotAuthenticated, AuthenticationFailed)):
+        headers = {'WWW-Authenticate': authentication.authenticate_header(None)}
+        return render(data, status.HTTP_401_UNAUTHORIZED, headers)
+    return render(data, exception.status_code)
+
+
+def async_api_view(view=None, authenticator=None):
+    """Allow GET from users authenticated by a JWT, like IsAuthenticated viewsets"""
+    if view is None:
+        return lambda view: async_api_view(view, authenticator)
+    authenticator = authenticator or authentication
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return render(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status.HTTP_405_METHOD_NOT_ALLOWED,
+                {'Allow': 'GET'},
+            )
+        try:
+            authenticated = await authenticator.aauthenticate(request)
+        except APIException as error:
+            return render_exception(error)
+        if authenticated is None:
+            return render_exception(NotAuthenticated())
+        request.user, request.auth = authenticated
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def cached_week_response(request, kind, error):
+    week = request.GET.get('week')
+
+    if not week:
+        return render({"error": "week parameter is required"}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        week = int(week)
+        year = int(request.GET.get('year') or timezone.now().year)
+
+        return render(await aget_cached_week(kind, week, year))
+    except ValueError:
+        return render({"error": "Invalid week parameter"}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return render({"error": f"{error}: {str(e)}"}, status.HTTP_400_BAD_REQUEST)
+
+
+@async_api_view
+@query_budget(4)
+async def calendar_week(request):
+    """Async CalendarViewSet.list: calendar data for a specific week"""
+    return await cached_week_response(request, 'week', 'Error fetching calendar data')
+
+
+@async_api_view
+@query_budget(2)
+async def future_week(request):
+    """Async AppointmentViewSet.future: future appointments of a week"""
+    return await cached_week_response(request, 'future', 'Error fetching appointments')
+
+
+@async_api_view
+@query_budget(3)
+async def shift_week(request):
+    """Async ShiftViewSet.list filtered by week (and optionally year)"""
+    week = request.GET.get('week')
+
+    if not week:
+        return render({"error": "week parameter is required"}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        week = int(week)
+        year = int(request.GET.get('year') or timezone.now().year)
+    except ValueError:
+        return render({"error": "Invalid week parameter"}, status.HTTP_400_BAD_REQUEST)
+
+    # Non-staff users have no shifts until doctor accounts are implemented
+    if not request.user.is_staff:
+        return render([])
+
+    shifts = [shift async for shift in ShiftRotationManager.get_week_shifts(week, year)]
+    return render(ShiftSerializer(shifts, many=True).data)
+
+
+@async_api_view
+@query_budget(7)
+async def changes(request):
+    """Async ChangeFeedViewSet.list, long polls wait in the event loop instead of a thread"""
+    if not request.user.is_staff:
+        return render({"error": "Only administrators can view changes"}, status.HTTP_403_FORBIDDEN)
+
+    try:
+        since, limit, wait = parse_feed_params(request.GET)
+    except ValueError as e:
+        return render({"error": f"Invalid parameter: {str(e)}"}, status.HTTP_400_BAD_REQUEST)
+
+    if since is None:
+        return render({'cursor': await sync_to_async(latest_seq)()})
+    try:
+        return render(await achanges_since(since, limit, wait))
+    except ChangesExpired as e:
+        return render({"error": str(e), "oldest": e.oldest}, status.HTTP_410_GONE)
+
+
+@async_api_view(authenticator=event_stream_authentication)
+@query_budget(1)
+async def events(request):
+    """
+    Server-Sent Events stream of committed appointment and shift changes,
+    optionally only those touching the given weeks (week=10,11&year=2025) or
+    doctors (doctor=1,2). Each event names the changed ids, weeks and doctors,
+    the change feed has their data. The token may be passed as access_token.
+    """
+    if not request.user.is_staff:
+        return render({"error": "Only administrators can follow live updates"}, status.HTTP_403_FORBIDDEN)
+
+    # Under WSGI the stream would hold a worker for as long as it is open
+    if not isinstance(request, ASGIRequest):
+        return render(
+            {"error": "Live updates need the ASGI server (backend.asgi)"}, status.HTTP_501_NOT_IMPLEMENTED
+        )
+
+    try:
+        year = int(request.GET.get('year') or timezone.now().year)
+        week = request.GET.get('week')
+        weeks = [(int(week_of_year), year) for week_of_year in week.split(',')] if week else None
+        doctor = request.GET.get('doctor')
+        doctors = [int(doctor_id) for doctor_id in doctor.split(',')] if doctor else None
+    except ValueError as e:
+        return render({"error": f"Invalid parameter: {str(e)}"}, status.HTTP_400_BAD_REQUEST)
+
+    await get_broker().start()
+    subscription = hub.subscribe(weeks, doctors)
+    return StreamingHttpResponse(
+        stream_events(subscription),
+        content_type='text/event-stream',
+        # No caching or proxy buffering of the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
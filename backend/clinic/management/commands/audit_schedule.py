@@ -0,0 +1,67 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.audit import FINDING_KINDS, format_finding, iter_findings
+from ...utils.fast_serializers import datetime_formatter
+from .rebuild_stats import parse_date
+
+class Command(BaseCommand):
+    help = 'Find appointments outside their doctor\'s shifts, overlapping appointments and understaffed shifts'
+
+    # Findings listed before the rest are only counted
+    MAX_LISTED = 20
+
+    def add_arguments(self, parser):
+        parser.add_argument('start_date', help='First clinic-local date to audit (YYYY-MM-DD)')
+        parser.add_argument('end_date', help='Last clinic-local date to audit (YYYY-MM-DD)')
+        parser.add_argument('--doctor', type=int, action='append', dest='doctors', help='Only audit this doctor id, can be repeated')
+        parser.add_argument('--min-doctors', type=int, help='Doctors a shift needs (default: CLINIC_MIN_SHIFT_DOCTORS)')
+        parser.add_argument('--output', '-o', help='Write every finding to this file as NDJSON')
+
+    def handle(self, *args, **options):
+        start_date, end_date = parse_date(options['start_date']), parse_date(options['end_date'])
+        if end_date < start_date:
+            raise CommandError('end_date must not be before start_date')
+        if options['min_doctors'] is not None and options['min_doctors'] < 0:
+            raise CommandError('--min-doctors must not be negative')
+
+        counts = dict.fromkeys(FINDING_KINDS, 0)
+        format_datetime = datetime_formatter()
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else None
+        try:
+            for finding in iter_findings(start_date, end_date, options['doctors'], options['min_doctors']):
+                finding = format_finding(finding, format_datetime)
+                counts[finding['kind']] += 1
+                if output:
+                    output.write(json.dumps(finding) + '\n')
+                if sum(counts.values()) <= self.MAX_LISTED:
+                    self.stdout.write(f'  {self.describe(finding)}')
+        finally:
+            if output:
+                output.close()
+
+        total = sum(counts.values())
+        if total > self.MAX_LISTED:
+            self.stdout.write(f'  ... and {total - self.MAX_LISTED} more')
+        if options['output']:
+            self.stdout.write(f"Findings saved to {options['output']}")
+        if not total:
+            self.stdout.write(self.style.SUCCESS(f'No findings from {start_date} to {end_date}'))
+            return
+        summary = ', '.join(f"{count} {kind.replace('_', ' ')}" for kind, count in counts.items())
+        raise CommandError(f'{total} findings from {start_date} to {end_date}: {summary}')
+
+    def describe(self, finding):
+        if finding['kind'] == 'understaffed':
+            return (
+                f"shift {finding['shift_id']} on {finding['date']} ({finding['shift_type']}): "
+                f"{finding['doctors']} of {finding['required']} doctors"
+            )
+        if finding['kind'] == 'overlap':
+            return (
+                f"doctor {finding['doctor_id']}: appointment {finding['appointment_id']} overlaps "
+                f"{finding['other_appointment_id']} from {finding['start_datetime']} to {finding['end_datetime']}"
+            )
+        return (
+            f"doctor {finding['doctor_id']}: appointment {finding['appointment_id']} from "
+            f"{finding['start_datetime']} to {finding['end_datetime']} is outside their shifts"
+        )
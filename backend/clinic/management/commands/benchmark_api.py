@@ -0,0 +1,95 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.benchmark import (
+    DEFAULT_ITERATIONS, DEFAULT_THRESHOLD, DEFAULT_WARMUP, PERCENTILES, ApiBenchmark, compare
+)
+
+class Command(BaseCommand):
+    help = 'Time the key API paths against the current database and compare with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help=f'Timed requests per scenario (default: {DEFAULT_ITERATIONS})')
+        parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help=f'Untimed requests per scenario first (default: {DEFAULT_WARMUP})')
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            dest='scenarios',
+            choices=ApiBenchmark.SCENARIOS,
+            help='Scenario to run, can be repeated (default: all)',
+        )
+        parser.add_argument('--output', '-o', help='Save the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=DEFAULT_THRESHOLD * 100,
+            help=f'Percent a percentile may slow down before it counts as a regression (default: {DEFAULT_THRESHOLD * 100:.0f})',
+        )
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error when a scenario regressed')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['warmup'] < 0:
+            raise CommandError('--iterations must be at least 1 and --warmup not negative')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Cannot read {options['baseline']}: {error}")
+
+        benchmark = ApiBenchmark(
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            scenarios=options['scenarios'],
+            progress=self.write_scenario if options['verbosity'] >= 1 else None,
+        )
+        try:
+            results = benchmark.run()
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        environment = results['environment']
+        self.stdout.write(
+            f"{environment['appointments']} appointments, {environment['doctors']} doctors and "
+            f"{environment['shifts']} shifts on {environment['database']}"
+        )
+        for scenario, summary in results['scenarios'].items():
+            if summary['unexpected']:
+                self.stdout.write(self.style.WARNING(
+                    f"  {scenario}: {summary['unexpected']} requests returned an unexpected status {summary['statuses']}"
+                ))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+                file.write('\n')
+            self.stdout.write(f"Results saved to {options['output']}")
+
+        if baseline is not None:
+            self.write_comparison(results, baseline, options['threshold'] / 100, options['fail_on_regression'])
+
+    def write_scenario(self, scenario, summary):
+        percentiles = '  '.join(f"p{percent} {summary[f'p{percent}_ms']:8.2f} ms" for percent in PERCENTILES)
+        self.stdout.write(f"  {scenario:<22} {percentiles}  {summary['queries']:3} queries")
+
+    def write_comparison(self, results, baseline, threshold, fail_on_regression):
+        if baseline.get('environment', {}).get('appointments') != results['environment']['appointments']:
+            self.stdout.write(self.style.WARNING('The baseline was measured on a different dataset'))
+        rows = compare(results, baseline, threshold)
+        for row in rows:
+            ratios = '  '.join(
+                f"{key[:-3]} {ratio:5.2f}x" if ratio is not None else f'{key[:-3]}    -'
+                for key, ratio in row['ratios'].items()
+            )
+            before, after = row['queries']
+            line = f"  {row['scenario']:<22} {ratios}  queries {before} -> {after}"
+            self.stdout.write(self.style.ERROR(line) if row['regressed'] else line)
+
+        regressed = [row['scenario'] for row in rows if row['regressed']]
+        if not regressed:
+            self.stdout.write(self.style.SUCCESS(f'No regressions against the baseline ({threshold:.0%} threshold)'))
+        elif fail_on_regression:
+            raise CommandError(f"Regressed: {', '.join(regressed)}")
+        else:
+            self.stdout.write(self.style.WARNING(f"Regressed: {', '.join(regressed)}"))
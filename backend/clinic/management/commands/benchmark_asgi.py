@@ -0,0 +1,61 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.benchmark import PERCENTILES
+from ...utils.load_test import ASGI_SCENARIOS, DEFAULT_ASGI_DURATION, DEFAULT_CLIENTS, AsgiBenchmark
+
+class Command(BaseCommand):
+    help = 'Compare the sync API under ASGI with its native async endpoints under many concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            dest='scenarios',
+            choices=list(ASGI_SCENARIOS),
+            help='Scenario to run, can be repeated (default: all)',
+        )
+        parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS, help=f'Concurrent clients (default: {DEFAULT_CLIENTS})')
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=DEFAULT_ASGI_DURATION,
+            help=f'Seconds per scenario and endpoint (default: {DEFAULT_ASGI_DURATION:g})',
+        )
+        parser.add_argument('--cached', action='store_true', help='Serve calendar weeks from the cache instead of building them')
+        parser.add_argument('--output', '-o', help='Save the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['duration'] <= 0:
+            raise CommandError('--clients and --duration must be positive')
+
+        self.stdout.write(
+            f"{options['clients']} concurrent clients for {options['duration']:g}s per endpoint, "
+            f"calendar cache {'on' if options['cached'] else 'off'}"
+        )
+        benchmark = AsgiBenchmark(
+            scenarios=options['scenarios'],
+            clients=options['clients'],
+            duration=options['duration'],
+            cached=options['cached'],
+            progress=self.write_scenario if options['verbosity'] >= 1 else None,
+        )
+        try:
+            results = benchmark.run()
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+                file.write('\n')
+            self.stdout.write(f"Results saved to {options['output']}")
+
+    def write_scenario(self, scenario, results):
+        self.stdout.write(scenario)
+        for mode, data in results.items():
+            percentiles = '  '.join(
+                f"p{percent} {data[f'p{percent}_ms']:7.1f} ms" if data[f'p{percent}_ms'] is not None else f'p{percent}       -'
+                for percent in PERCENTILES
+            )
+            line = f"  {mode:<6} {data['per_second']:7.1f}/s  {percentiles}  {data['errors']} errors"
+            self.stdout.write(self.style.WARNING(line) if data['errors'] else line)
@@ -0,0 +1,76 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.benchmark import PERCENTILES
+from ...utils.load_test import (
+    DATABASE_PROFILES, DEFAULT_DURATION, DEFAULT_PROCESSES, DEFAULT_THREADS, DEFAULT_WRITE_SHARE,
+    ConcurrencyBenchmark
+)
+
+class Command(BaseCommand):
+    help = 'Compare API throughput of SQLite setups under concurrent readers and writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile',
+            action='append',
+            dest='profiles',
+            choices=list(DATABASE_PROFILES),
+            help='Database profile to run, can be repeated (default: all)',
+        )
+        parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES, help=f'Worker processes (default: {DEFAULT_PROCESSES})')
+        parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help=f'Threads per process (default: {DEFAULT_THREADS})')
+        parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help=f'Seconds per profile (default: {DEFAULT_DURATION:g})')
+        parser.add_argument(
+            '--write-share',
+            type=float,
+            default=DEFAULT_WRITE_SHARE,
+            help=f'Share of requests that book an appointment, the rest list a day (default: {DEFAULT_WRITE_SHARE:g})',
+        )
+        parser.add_argument('--in-place', action='store_true', help='Run against the configured database instead of a copy')
+        parser.add_argument('--output', '-o', help='Save the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['threads'] < 1 or options['duration'] <= 0:
+            raise CommandError('--processes, --threads and --duration must be positive')
+        if not 0 <= options['write_share'] <= 1:
+            raise CommandError('--write-share must be between 0 and 1')
+
+        self.stdout.write(
+            f"{options['processes']} processes x {options['threads']} threads for {options['duration']:g}s "
+            f"per profile, {options['write_share']:.0%} writes"
+        )
+        benchmark = ConcurrencyBenchmark(
+            profiles=options['profiles'],
+            processes=options['processes'],
+            threads=options['threads'],
+            duration=options['duration'],
+            write_share=options['write_share'],
+            in_place=options['in_place'],
+            progress=self.write_profile if options['verbosity'] >= 1 else None,
+        )
+        try:
+            results = benchmark.run()
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+                file.write('\n')
+            self.stdout.write(f"Results saved to {options['output']}")
+
+    def write_profile(self, profile, summary):
+        self.stdout.write(
+            f"{profile} (journal {summary['journal_mode']}, {summary['transaction_mode'] or 'DEFERRED'} transactions)"
+        )
+        for kind in ('read', 'write'):
+            data = summary[kind]
+            percentiles = '  '.join(
+                f"p{percent} {data[f'p{percent}_ms']:7.1f} ms" if data[f'p{percent}_ms'] is not None else f'p{percent}       -'
+                for percent in PERCENTILES
+            )
+            line = (
+                f"  {kind + 's':<7} {data['per_second']:7.1f}/s  {percentiles}  "
+                f"{data['conflicts']} conflicts, {data['locked']} locked, {data['errors']} errors"
+            )
+            self.stdout.write(self.style.WARNING(line) if data['locked'] or data['errors'] else line)
@@ -0,0 +1,68 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.benchmark import PERCENTILES
+from ...utils.load_test import (
+    DEFAULT_ACTIVE_STREAMS,
+    DEFAULT_EVENT_RATE,
+    DEFAULT_IDLE_STREAMS,
+    DEFAULT_SLOW_STREAMS,
+    DEFAULT_STREAM_EVENTS,
+    SseBenchmark,
+)
+
+class Command(BaseCommand):
+    help = 'Hold many Server-Sent Events streams open and measure connecting, memory and event fan-out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle', type=int, default=DEFAULT_IDLE_STREAMS, help=f'Streams that get no events (default: {DEFAULT_IDLE_STREAMS})')
+        parser.add_argument('--active', type=int, default=DEFAULT_ACTIVE_STREAMS, help=f'Streams that get every event (default: {DEFAULT_ACTIVE_STREAMS})')
+        parser.add_argument('--slow', type=int, default=DEFAULT_SLOW_STREAMS, help=f'Streams that read one chunk a second (default: {DEFAULT_SLOW_STREAMS})')
+        parser.add_argument('--events', type=int, default=DEFAULT_STREAM_EVENTS, help=f'Events to publish (default: {DEFAULT_STREAM_EVENTS})')
+        parser.add_argument('--rate', type=float, default=DEFAULT_EVENT_RATE, help=f'Events per second (default: {DEFAULT_EVENT_RATE:g})')
+        parser.add_argument('--output', '-o', help='Save the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if min(options['idle'], options['active'], options['slow']) < 0:
+            raise CommandError('--idle, --active and --slow must not be negative')
+        if options['events'] < 1 or options['rate'] <= 0:
+            raise CommandError('--events and --rate must be positive')
+
+        self.stdout.write(
+            f"{options['idle']} idle, {options['active']} active and {options['slow']} slow streams, "
+            f"{options['events']} events at {options['rate']:g}/s"
+        )
+        benchmark = SseBenchmark(
+            idle=options['idle'],
+            active=options['active'],
+            slow=options['slow'],
+            events=options['events'],
+            rate=options['rate'],
+            progress=self.stdout.write if options['verbosity'] >= 1 else None,
+        )
+        results = benchmark.run()
+
+        if options['verbosity'] >= 1:
+            self.write_results(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+                file.write('\n')
+            self.stdout.write(f"Results saved to {options['output']}")
+
+    def write_results(self, results):
+        def percentiles(name):
+            return '  '.join(
+                f"p{percent} {results[f'{name}_p{percent}_ms']:7.1f} ms" if results[f'{name}_p{percent}_ms'] is not None
+                else f'p{percent}       -'
+                for percent in PERCENTILES
+            )
+
+        self.stdout.write(f"  connect   {percentiles('connect')}  {results['connects_per_second']}/s")
+        self.stdout.write(f"  latency   {percentiles('latency')}")
+        self.stdout.write(f"  memory    {results['memory_per_stream_kb']} KiB per stream")
+        line = f"  delivered {results['delivered']} of {results['expected_deliveries']}, {results['idle_delivered']} to idle streams"
+        complete = results['delivered'] == results['expected_deliveries'] and not results['idle_delivered']
+        self.stdout.write(line if complete else self.style.WARNING(line))
+        self.stdout.write(f"  dropped   {results['slow_dropped']} of {results['streams']['slow']} slow streams")
+        if results['errors']:
+            self.stdout.write(self.style.WARNING(f"  {results['errors']} streams failed to open"))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.daily_stats import find_inconsistencies, rebuild_keys
+from .rebuild_stats import parse_date
+
+class Command(BaseCommand):
+    help = 'Compare the daily doctor statistics with the appointments table'
+
+    # Mismatches listed before the rest are only counted
+    MAX_LISTED = 20
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First date to check (default: the earliest appointment)')
+        parser.add_argument('--end-date', help='Last date to check (default: the latest appointment)')
+        parser.add_argument('--fix', action='store_true', help='Rebuild the days that differ')
+
+    def handle(self, *args, **options):
+        start_date, end_date = parse_date(options['start_date']), parse_date(options['end_date'])
+        if start_date and end_date and end_date < start_date:
+            raise CommandError('--end-date must not be before --start-date')
+
+        mismatches = find_inconsistencies(start_date, end_date)
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('The daily doctor statistics match the appointments'))
+            return
+
+        for mismatch in mismatches[:self.MAX_LISTED]:
+            service = f", service {mismatch['service_id'] or 'custom'}" if 'service_id' in mismatch else ''
+            self.stdout.write(
+                f"  doctor {mismatch['doctor_id']} on {mismatch['date']}{service}: "
+                f"expected {self.format_measures(mismatch['expected'])}, stored {self.format_measures(mismatch['stored'])}"
+            )
+        if len(mismatches) > self.MAX_LISTED:
+            self.stdout.write(f'  ... and {len(mismatches) - self.MAX_LISTED} more')
+
+        if options['fix']:
+            rebuild_keys({(mismatch['doctor_id'], mismatch['date']) for mismatch in mismatches})
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the days of {len(mismatches)} mismatched rows'))
+        else:
+            raise CommandError(f'{len(mismatches)} daily doctor statistics differ from the appointments, run with --fix to rebuild them')
+
+    def format_measures(self, measures):
+        if measures is None:
+            return 'nothing'
+        return f"{measures['appointment_count']} appointments, {measures['booked_minutes']} min, {measures['revenue']}"
@@ -0,0 +1,25 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from ...models import ChangeLog
+from ...utils.changes import compact, get_retention
+
+class Command(BaseCommand):
+    help = 'Drop superseded and expired entries from the appointment and shift change log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help=f'Keep entries this many days (default: CLINIC_CHANGE_LOG_RETENTION_DAYS, {get_retention().days})',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days must not be negative')
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+
+        deleted = compact(retention)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted['superseded']} superseded and {deleted['expired']} expired changes, "
+            f"{ChangeLog.objects.count()} left"
+        ))
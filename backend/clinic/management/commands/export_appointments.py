@@ -0,0 +1,34 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.export import EXPORT_FORMATS, export_queryset, iter_export
+
+class Command(BaseCommand):
+    help = 'Stream the appointments of a date range as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start_date', help='First clinic-local date to export (YYYY-MM-DD)')
+        parser.add_argument('end_date', help='Last clinic-local date to export (YYYY-MM-DD)')
+        parser.add_argument('--export-format', choices=list(EXPORT_FORMATS), default='csv', help='Output format (default: csv)')
+        parser.add_argument('--doctor', type=int, help='Only export appointments of this doctor id')
+        parser.add_argument('--service', type=int, help='Only export appointments of this service id')
+        parser.add_argument('--output', '-o', help='File to write to (default: standard output)')
+
+    def handle(self, *args, **options):
+        try:
+            start_date = datetime.strptime(options['start_date'], '%Y-%m-%d').date()
+            end_date = datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('Dates must use the YYYY-MM-DD format')
+        if end_date < start_date:
+            raise CommandError('end_date must not be before start_date')
+
+        queryset = export_queryset(start_date, end_date, doctor_id=options['doctor'], service_id=options['service'])
+        chunks = iter_export(queryset, options['export_format'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f"Exported appointments to {options['output']}"))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
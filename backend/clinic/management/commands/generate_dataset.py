@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.dataset import DEFAULT_CHUNK_SIZE, SERVICES, DatasetGenerator
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic dataset of doctors, services, shifts and appointments for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=10, help='Doctors to create (default: 10)')
+        parser.add_argument('--services', type=int, default=len(SERVICES), help=f'Services to create (default: {len(SERVICES)})')
+        parser.add_argument('--weeks', type=int, default=4, help='Weeks of shifts and appointments (default: 4)')
+        parser.add_argument('--appointments', type=int, default=1000, help='Appointments to create, spread over the weeks (default: 1000)')
+        parser.add_argument('--start-week', type=int, help='First generated week (default: centred on the current week)')
+        parser.add_argument('--start-year', type=int, help='Year of the first generated week (default: current year)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed generates the same data (default: 0)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help=f'Appointments written per transaction (default: {DEFAULT_CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        for name in ('doctors', 'services', 'weeks', 'appointments'):
+            if options[name] < 0:
+                raise CommandError(f'--{name} must not be negative')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        start_year = options['start_year']
+        if options['start_week'] is None and start_year is not None:
+            raise CommandError('--start-year needs --start-week')
+
+        self.last_progress = 0.0
+        generator = DatasetGenerator(
+            doctors=options['doctors'],
+            services=options['services'],
+            weeks=options['weeks'],
+            appointments=options['appointments'],
+            start_week=options['start_week'],
+            start_year=start_year,
+            seed=options['seed'],
+            chunk_size=options['chunk_size'],
+            progress=self.write_progress if options['verbosity'] >= 1 else None,
+        )
+        try:
+            report = generator.run()
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        elapsed = report['elapsed']
+        rate = report['appointments'] / elapsed if elapsed else 0
+        first_week, first_year = generator.weeks[0] if generator.weeks else (None, None)
+        self.stdout.write(
+            f"  {report['doctors']} doctors, {report['services']} services, {report['shifts']} new shifts "
+            f"in {report['weeks']} weeks from week {first_week} of {first_year}"
+        )
+        if report['appointments'] < options['appointments']:
+            self.stdout.write(self.style.WARNING(
+                f"  Only {report['appointments']} of {options['appointments']} appointments fit, "
+                f"generate more weeks or doctors"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {report['appointments']} appointments in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        ))
+
+    def write_progress(self, report, elapsed):
+        if elapsed - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = elapsed
+        self.stdout.write(f"  {report['appointments']} appointments in {elapsed:.1f}s ({report['appointments'] / elapsed:.0f} rows/s)")
@@ -0,0 +1,92 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.importer import (
+    DEFAULT_BATCH_SIZE, IMPORT_MODELS, ClinicImporter, iter_records, open_text
+)
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+class Command(BaseCommand):
+    help = 'Import doctors, services and appointments from CSV, JSON or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input')
+        parser.add_argument(
+            '--format',
+            dest='input_format',
+            choices=['csv', 'json', 'ndjson'],
+            help='Input format (default: from the file extension, else json)',
+        )
+        parser.add_argument(
+            '--model',
+            choices=IMPORT_MODELS,
+            help='Model of records that do not name one (default: guessed from their fields)',
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help=f'Rows validated and written together (default: {DEFAULT_BATCH_SIZE})')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and check conflicts without saving anything')
+        parser.add_argument('--atomic', action='store_true', help='Save nothing unless every record imports cleanly')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['input_format']
+        if input_format is None:
+            extension = os.path.splitext(path)[1].lower().lstrip('.')
+            input_format = extension if extension in ('csv', 'json', 'ndjson', 'jsonl') else 'json'
+            input_format = 'ndjson' if input_format == 'jsonl' else input_format
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        self.last_progress = 0.0
+        importer = ClinicImporter(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            atomic=options['atomic'],
+            progress=self.write_progress if options['verbosity'] >= 1 else None,
+        )
+
+        try:
+            stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as error:
+            raise CommandError(f'Cannot open {path}: {error}')
+        try:
+            report = importer.run(iter_records(open_text(stream), input_format, options['model']))
+        except (ValueError, UnicodeDecodeError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        finally:
+            stream.close()
+
+        self.write_report(report)
+        if report['rolled_back'] and not report['dry_run']:
+            raise CommandError('Nothing was imported because some records failed')
+
+    def write_progress(self, report, elapsed):
+        if elapsed - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = elapsed
+        self.stdout.write(f"  {report['rows']} rows in {elapsed:.1f}s ({report['rows'] / elapsed:.0f} rows/s)")
+
+    def write_report(self, report):
+        elapsed = report['elapsed']
+        rate = report['rows'] / elapsed if elapsed else 0
+        for model in IMPORT_MODELS:
+            self.stdout.write(
+                f"  {model.capitalize()}s: {report['created'][model]} created, "
+                f"{report['existing'][model]} already existed"
+            )
+        self.stdout.write(
+            f"  {report['invalid']} invalid, {report['conflicts']} conflicting, "
+            f"{report['ignored']} ignored records"
+        )
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f'  {error}'))
+        hidden = report['invalid'] + report['conflicts'] - len(report['errors'])
+        if hidden > 0:
+            self.stdout.write(self.style.WARNING(f'  ... and {hidden} more errors'))
+
+        summary = f"{report['rows']} rows in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        if report['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Dry run checked {summary}, nothing was saved'))
+        elif not report['rolled_back']:
+            self.stdout.write(self.style.SUCCESS(f'Imported {summary}'))
@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from clinic.models import Doctor, Service, Shift
-from clinic.utils.shift_rotation import ShiftRotationManager
+from ...models import Doctor, Service, Shift
+from ...utils.importer import ClinicImporter
+from ...utils.shift_rotation import ShiftRotationManager
 from datetime import datetime, timedelta
 from decimal import Decimal
 
@@ -14,6 +15,15 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing data before initializing',
         )
+        parser.add_argument(
+            '--shifts-only',
+            action='store_true',
+            help='Only generate shifts, without creating sample doctors and services',
+        )
+        parser.add_argument('--start-week', type=int, help='First week to generate shifts for (default: current week)')
+        parser.add_argument('--start-year', type=int, help='Year of the first week (default: current year)')
+        parser.add_argument('--end-week', type=int, help='Last week to generate shifts for (default: four weeks after the start)')
+        parser.add_argument('--end-year', type=int, help='Year of the last week (default: year of the start week)')
 
     def handle(self, *args, **options):
         if options['clear']:
@@ -22,14 +32,17 @@ class Command(BaseCommand):
             Service.objects.all().delete()
             Shift.objects.all().delete()
 
-        self.stdout.write('Creating sample doctors...')
-        doctors = self.create_sample_doctors()
-        
-        self.stdout.write('Creating sample services...')
-        services = self.create_sample_services()
+        if not options['shifts_only']:
+            self.stdout.write('Creating sample doctors...')
+            self.create_sample_doctors()
+            
+            self.stdout.write('Creating sample services...')
+            self.create_sample_services()
         
         self.stdout.write('Setting up shift rotation...')
-        self.setup_shift_rotation()
+        self.setup_shift_rotation(
+            options['start_week'], options['start_year'], options['end_week'], options['end_year']
+        )
         
         self.stdout.write(
             self.style.SUCCESS('Successfully initialized dental clinic!')
@@ -64,19 +77,7 @@ class Command(BaseCommand):
             }
         ]
         
-        doctors = []
-        for data in doctors_data:
-            doctor, created = Doctor.objects.get_or_create(
-                email=data['email'],
-                defaults=data
-            )
-            if created:
-                self.stdout.write(f'  Created doctor: {doctor.full_name}')
-            else:
-                self.stdout.write(f'  Doctor already exists: {doctor.full_name}')
-            doctors.append(doctor)
-        
-        return doctors
+        self.import_samples('doctor', doctors_data)
 
     def create_sample_services(self):
         """Create sample services"""
@@ -113,33 +114,36 @@ class Command(BaseCommand):
             }
         ]
         
-        services = []
-        for data in services_data:
-            service, created = Service.objects.get_or_create(
-                name=data['name'],
-                defaults=data
-            )
-            if created:
-                self.stdout.write(f'  Created service: {service.name} - ${service.price}')
-            else:
-                self.stdout.write(f'  Service already exists: {service.name}')
-            services.append(service)
-        
-        return services
+        self.import_samples('service', services_data)
 
-    def setup_shift_rotation(self):
-        """Set up shift rotation for the current and next few weeks"""
-        current_week = timezone.now().isocalendar()[1]
-        current_year = timezone.now().year
+    def import_samples(self, model, records):
+        """Bulk create sample records, skipping those that already exist by natural key"""
+        report = ClinicImporter().run(
+            (f'sample {model} {index}', {**record, 'model': model}) for index, record in enumerate(records, 1)
+        )
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f'  {error}'))
+        self.stdout.write(
+            f"  {report['created'][model]} {model}s created, {report['existing'][model]} already existed"
+        )
+
+    def setup_shift_rotation(self, start_week=None, start_year=None, end_week=None, end_year=None):
+        """Set up shift rotation for a range of weeks, by default the current and next four"""
+        current_week, current_year = ShiftRotationManager.get_week_and_year(timezone.localdate())
+        start_week = start_week or current_week
+        start_year = start_year or current_year
         
-        # Generate shifts for current week and next 4 weeks
-        for week_offset in range(5):
-            week = current_week + week_offset
-            if week > 52:
-                week = week - 52
-                year = current_year + 1
-            else:
-                year = current_year
-            
-            shifts = ShiftRotationManager.create_or_update_shifts_for_week(week, year)
-            self.stdout.write(f'  Generated {len(shifts)} shifts for week {week}, year {year}') 
\ No newline at end of file
+        if end_week is None:
+            # Four weeks after the start, rolling over into the next year if needed
+            end_date = ShiftRotationManager.get_week_start_date(start_week, start_year) + timedelta(weeks=4)
+            end_week, end_year = ShiftRotationManager.get_week_and_year(end_date)
+        end_year = end_year or start_year
+        
+        weeks = list(ShiftRotationManager.iter_weeks(start_week, start_year, end_week, end_year))
+        report = ShiftRotationManager.generate_shifts(weeks)
+        
+        self.stdout.write(
+            f'  Generated shifts for {len(weeks)} weeks '
+            f'(week {start_week}, {start_year} to week {end_week}, {end_year}): '
+            f'{report["created"]} created, {report["updated"]} updated, {report["unchanged"]} unchanged'
+        )
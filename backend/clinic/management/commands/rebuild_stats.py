@@ -0,0 +1,33 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from ...utils.daily_stats import REBUILD_CHUNK_DAYS, rebuild_stats
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        raise CommandError('Dates must use the YYYY-MM-DD format')
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily doctor statistics from the appointments table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First date to rebuild (default: the earliest appointment)')
+        parser.add_argument('--end-date', help='Last date to rebuild (default: the latest appointment)')
+        parser.add_argument('--chunk-days', type=int, default=REBUILD_CHUNK_DAYS, help=f'Days rebuilt per transaction (default: {REBUILD_CHUNK_DAYS})')
+
+    def handle(self, *args, **options):
+        start_date, end_date = parse_date(options['start_date']), parse_date(options['end_date'])
+        if start_date and end_date and end_date < start_date:
+            raise CommandError('--end-date must not be before --start-date')
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be positive')
+
+        written = rebuild_stats(
+            start_date, end_date, options['chunk_days'],
+            progress=self.write_progress if options['verbosity'] >= 2 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} daily doctor statistics'))
+
+    def write_progress(self, day, written):
+        self.stdout.write(f'  up to {day}: {written} rows')
@@ -1,27 +1,25 @@
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from clinic.models import Doctor, Service
+from ...utils.importer import ClinicImporter
 
 class Command(BaseCommand):
     help = 'Seed sample doctors and services'
 
     def handle(self, *args, **kwargs):
-        # Create sample services
-        services = [
-            ('Cleaning', 30),
-            ('Filling', 45),
-            ('Root Canal', 90),
-            ('Whitening', 60),
+        records = [
+            # Sample services
+            {'model': 'service', 'name': 'Cleaning', 'price': '60.00', 'duration_minutes': 30},
+            {'model': 'service', 'name': 'Filling', 'price': '120.00', 'duration_minutes': 45},
+            {'model': 'service', 'name': 'Root Canal', 'price': '600.00', 'duration_minutes': 90},
+            {'model': 'service', 'name': 'Whitening', 'price': '250.00', 'duration_minutes': 60},
+            # Sample doctors
+            {'model': 'doctor', 'full_name': 'Dr. John Doe', 'phone_number': '1234567890', 'email': 'doctor1@example.com'},
+            {'model': 'doctor', 'full_name': 'Dr. Jane Smith', 'phone_number': '0987654321', 'email': 'doctor2@example.com'},
         ]
-        for name, duration in services:
-            Service.objects.get_or_create(name=name, duration=duration)
+        report = ClinicImporter().run((f'sample {index}', record) for index, record in enumerate(records, 1))
 
-        # Create sample doctors
-        if not User.objects.filter(username='doctor1').exists():
-            user = User.objects.create_user('doctor1', 'doctor1@example.com', 'doctor123')
-            Doctor.objects.create(user=user, full_name='Dr. John Doe', phone='1234567890')
-        if not User.objects.filter(username='doctor2').exists():
-            user = User.objects.create_user('doctor2', 'doctor2@example.com', 'doctor123')
-            Doctor.objects.create(user=user, full_name='Dr. Jane Smith', phone='0987654321')
-
-        self.stdout.write(self.style.SUCCESS('Sample doctors and services created.')) 
\ No newline at end of file
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f'  {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Sample doctors and services created "
+            f"({report['created']['doctor']} doctors and {report['created']['service']} services new)."
+        ))
@@ -0,0 +1,196 @@
+import logging
+from contextvars import ContextVar
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from .utils.metrics import method_label, registry
+from .utils.query_budget import QueryInspector, get_query_budget
+
+logger = logging.getLogger('backend.clinic.queries')
+
+# Timer of the request being handled in the current context
+current_query_timer = ContextVar('clinic_query_timer', default=None)
+
+# Query inspector of the request being handled in the current context
+current_query_inspector = ContextVar('clinic_query_inspector', default=None)
+
+
+class QueryTimer:
+    """Query count and time of one request"""
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding each query to the current request's
+    timer. It stays installed on every connection, so requests only set a
+    context variable instead of looking up their thread's connection.
+    """
+    timer = current_query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.count += 1
+        timer.duration += perf_counter() - started
+
+
+def inspect_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current request's inspector"""
+    inspector = current_query_inspector.get()
+    if inspector is not None:
+        inspector.record(sql)
+    return execute(sql, params, many, context)
+
+
+def install_query_wrappers(sender=None, connection=None, **kwargs):
+    """connection_created receiver installing time_query and inspect_query on a connection"""
+    for wrapper in (time_query, inspect_query):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, query count and database time of every request per
+    resolved route in the process-local metrics registry.
+
+    Streaming responses are measured until their headers are ready, not
+    until the body has been sent. Runs natively under ASGI too, so async
+    views are not pushed into a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CLINIC_METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened before the receiver was connected
+        for connection in connections.all(initialized_only=True):
+            install_query_wrappers(connection=connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = current_query_timer.set(timer)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_timer.reset(token)
+        self.record(request, response, perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        # Queries run in sync_to_async threads, which copy this context
+        timer = QueryTimer()
+        token = current_query_timer.set(timer)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_timer.reset(token)
+        self.record(request, response, perf_counter() - started, timer)
+        return response
+
+    def record(self, request, response, duration, timer):
+        match = request.resolver_match
+        route = (match.view_name or match.route) if match else 'unresolved'
+        registry.record(route, method_label(request.method), response.status_code, duration, timer.count, timer.duration)
+
+
+class QueryBudgetMiddleware:
+    """
+    Development aid catching N+1 queries. Every request's queries are grouped
+    by fingerprint, and a warning with the call site is logged when one shape
+    repeats CLINIC_QUERY_REPEAT_THRESHOLD times or when the view runs more
+    queries than the budget it declares with query_budget / query_budgets.
+
+    Enabled by CLINIC_QUERY_BUDGETS, which defaults to DEBUG. The violations
+    are also set on the response as query_violations, for tests.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CLINIC_QUERY_BUDGETS', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_wrappers(connection=connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        inspector = QueryInspector()
+        token = current_query_inspector.set(inspector)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_query_inspector.reset(token)
+        return self.check(request, response, inspector)
+
+    async def __acall__(self, request):
+        inspector = QueryInspector()
+        token = current_query_inspector.set(inspector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_query_inspector.reset(token)
+        return self.check(request, response, inspector)
+
+    def check(self, request, response, inspector):
+        if response.streaming and not response.is_async:
+            # The body runs its queries while it is sent, so it is checked
+            # once exhausted and query_violations fills in then
+            response.query_violations = []
+            response.streaming_content = self.inspect_stream(
+                request, response, inspector, response.streaming_content
+            )
+        else:
+            response.query_violations = self.report(request, inspector)
+            response['X-Query-Count'] = str(inspector.count)
+        return response
+
+    def inspect_stream(self, request, response, inspector, content):
+        content = iter(content)
+        while True:
+            token = current_query_inspector.set(inspector)
+            try:
+                chunk = next(content, None)
+            finally:
+                current_query_inspector.reset(token)
+            if chunk is None:
+                break
+            yield chunk
+        response.query_violations.extend(self.report(request, inspector))
+
+    def report(self, request, inspector):
+        violations = inspector.violations()
+        for violation in violations:
+            logger.warning(
+                '%s %s: %s\n%s', request.method, request.path,
+                violation['message'], violation['stack'] or '',
+            )
+        return violations
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        inspector = current_query_inspector.get()
+        if inspector is not None:
+            inspector.budget = get_query_budget(view_func, request.method)
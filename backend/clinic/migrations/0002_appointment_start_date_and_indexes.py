@@ -0,0 +1,48 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_start_date(apps, schema_editor):
+    Appointment = apps.get_model('clinic', 'Appointment')
+    clinic_tz = timezone.get_default_timezone()
+    batch = []
+    for appointment in Appointment.objects.only('id', 'start_datetime').iterator(chunk_size=2000):
+        start = appointment.start_datetime
+        if timezone.is_aware(start):
+            start = timezone.localtime(start, clinic_tz)
+        appointment.start_date = start.date()
+        batch.append(appointment)
+        if len(batch) >= 2000:
+            Appointment.objects.bulk_update(batch, ['start_date'])
+            batch = []
+    if batch:
+        Appointment.objects.bulk_update(batch, ['start_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='start_date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_start_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='start_date',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'start_datetime', 'end_datetime'], name='appointment_doctor_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start_date', 'start_datetime'], name='appointment_start_date_idx'),
+        ),
+    ]
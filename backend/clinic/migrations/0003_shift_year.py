@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:28
+
+import backend.clinic.models
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0002_appointment_start_date_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='shift',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='year',
+            field=models.IntegerField(default=backend.clinic.models.current_year),
+        ),
+        migrations.AlterField(
+            model_name='shift',
+            name='week_of_year',
+            field=models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(53)]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='shift',
+            unique_together={('year', 'week_of_year', 'day_of_week', 'shift_type')},
+        ),
+    ]
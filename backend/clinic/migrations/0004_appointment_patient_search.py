@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:33
+
+import re
+import unicodedata
+from django.db import migrations, models
+
+# Copies of backend.clinic.utils.search as of this migration, so the
+# backfill stays the same when the app's helpers change or move
+def normalize_name(value):
+    """Lowercase, accent-fold and collapse whitespace in a name"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())
+
+
+def normalize_phone(value):
+    """Keep only the digits of a phone number"""
+    return re.sub(r'\D', '', value or '')
+
+
+def backfill_patient_search(apps, schema_editor):
+    Appointment = apps.get_model('clinic', 'Appointment')
+    fields = ['patient_first_name_search', 'patient_last_name_search', 'patient_phone_digits']
+    batch = []
+    for appointment in Appointment.objects.only(
+        'id', 'patient_first_name', 'patient_last_name', 'patient_phone_number'
+    ).iterator(chunk_size=2000):
+        appointment.patient_first_name_search = normalize_name(appointment.patient_first_name)
+        appointment.patient_last_name_search = normalize_name(appointment.patient_last_name)
+        appointment.patient_phone_digits = normalize_phone(appointment.patient_phone_number)
+        batch.append(appointment)
+        if len(batch) >= 2000:
+            Appointment.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Appointment.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0003_shift_year'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='patient_first_name_search',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='patient_last_name_search',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='patient_phone_digits',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(backfill_patient_search, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient_first_name_search'], name='appointment_first_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient_last_name_search'], name='appointment_last_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient_phone_digits'], name='appointment_phone_idx'),
+        ),
+    ]
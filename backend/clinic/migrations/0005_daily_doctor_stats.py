@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_daily_stats(apps, schema_editor):
+    Appointment = apps.get_model('clinic', 'Appointment')
+    DailyDoctorStats = apps.get_model('clinic', 'DailyDoctorStats')
+    DailyDoctorServiceStats = apps.get_model('clinic', 'DailyDoctorServiceStats')
+    rows = Appointment.objects.values('doctor_id', 'start_date', 'service_id').annotate(
+        appointment_count=Count('id'), booked_minutes=Sum('duration_minutes'), revenue=Sum('price')
+    ).order_by()
+    services = []
+    totals = {}
+    for row in rows:
+        services.append(DailyDoctorServiceStats(
+            doctor_id=row['doctor_id'], date=row['start_date'], service_id=row['service_id'],
+            appointment_count=row['appointment_count'], booked_minutes=row['booked_minutes'], revenue=row['revenue'],
+        ))
+        total = totals.setdefault(
+            (row['doctor_id'], row['start_date']),
+            DailyDoctorStats(doctor_id=row['doctor_id'], date=row['start_date'], revenue=Decimal('0')),
+        )
+        total.appointment_count += row['appointment_count']
+        total.booked_minutes += row['booked_minutes']
+        total.revenue += row['revenue']
+    DailyDoctorServiceStats.objects.bulk_create(services, batch_size=2000)
+    DailyDoctorStats.objects.bulk_create(totals.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0004_appointment_patient_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDoctorServiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('appointment_count', models.IntegerField(default=0)),
+                ('booked_minutes', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_service_stats', to='clinic.doctor')),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='clinic.service')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily doctor service stats',
+                'indexes': [models.Index(fields=['date'], name='daily_service_stats_date_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('service__isnull', False)), fields=('doctor', 'date', 'service'), name='daily_service_stats_unique'), models.UniqueConstraint(condition=models.Q(('service__isnull', True)), fields=('doctor', 'date'), name='daily_service_stats_custom_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyDoctorStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('appointment_count', models.IntegerField(default=0)),
+                ('booked_minutes', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='clinic.doctor')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily doctor stats',
+                'indexes': [models.Index(fields=['date'], name='daily_stats_date_idx')],
+                'unique_together': {('doctor', 'date')},
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0005_daily_doctor_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='shift',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('object_type', models.CharField(choices=[('appointment', 'Appointment'), ('shift', 'Shift')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted')], max_length=10)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Change log',
+                'ordering': ['seq'],
+                'indexes': [models.Index(fields=['object_type', 'object_id', 'seq'], name='changelog_object_idx'), models.Index(fields=['changed_at'], name='changelog_changed_at_idx')],
+            },
+        ),
+    ]
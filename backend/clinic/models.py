@@ -1,9 +1,20 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
 import calendar
+from .utils.search import normalize_name, normalize_phone
+
+def local_date(value):
+    """Get the clinic-local date of a datetime"""
+    if timezone.is_naive(value):
+        return value.date()
+    return timezone.localtime(value, timezone.get_default_timezone()).date()
+
+def current_year():
+    return timezone.now().year
 
 class Doctor(models.Model):
     full_name = models.CharField(max_length=255)
@@ -44,23 +55,33 @@ class Shift(models.Model):
         (6, 'Sunday'),
     )
     
-    week_of_year = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(52)])
+    year = models.IntegerField(default=current_year)
+    week_of_year = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(53)])
     day_of_week = models.IntegerField(choices=DAYS_OF_WEEK)
     shift_type = models.CharField(max_length=10, choices=SHIFT_TYPES)
     start_time = models.TimeField()
     end_time = models.TimeField()
     doctors = models.ManyToManyField(Doctor, related_name='shifts')
+    # Also bumped when the shift's doctors change
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         day_name = dict(self.DAYS_OF_WEEK)[self.day_of_week]
-        return f"Week {self.week_of_year}, {day_name} - {self.shift_type} shift"
+        return f"Week {self.week_of_year} of {self.year}, {day_name} - {self.shift_type} shift"
     
     def get_doctor_names(self):
         return ", ".join([doctor.full_name for doctor in self.doctors.all()])
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so signal handlers can see what moved
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     class Meta:
         verbose_name_plural = 'Shifts'
-        unique_together = ['week_of_year', 'day_of_week', 'shift_type']
+        unique_together = ['year', 'week_of_year', 'day_of_week', 'shift_type']
 
 class Appointment(models.Model):
     patient_first_name = models.CharField(max_length=255)
@@ -73,6 +94,29 @@ class Appointment(models.Model):
     duration_minutes = models.IntegerField(validators=[MinValueValidator(1)])
     start_datetime = models.DateTimeField()
     end_datetime = models.DateTimeField()
+    # Clinic-local date of start_datetime, kept in sync on save so date
+    # filters can use an index instead of converting the timestamp column
+    start_date = models.DateField(editable=False)
+    # Normalised copies of the patient fields for indexed prefix search
+    patient_first_name_search = models.CharField(max_length=255, editable=False, default='')
+    patient_last_name_search = models.CharField(max_length=255, editable=False, default='')
+    patient_phone_digits = models.CharField(max_length=20, editable=False, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    # Stored fields computed from other fields, with their sources
+    DERIVED_FIELDS = {
+        'start_date': 'start_datetime',
+        'patient_first_name_search': 'patient_first_name',
+        'patient_last_name_search': 'patient_last_name',
+        'patient_phone_digits': 'patient_phone_number',
+    }
+    
+    def populate_derived_fields(self):
+        """Compute the stored fields derived from other fields"""
+        self.start_date = local_date(self.start_datetime)
+        self.patient_first_name_search = normalize_name(self.patient_first_name)
+        self.patient_last_name_search = normalize_name(self.patient_last_name)
+        self.patient_phone_digits = normalize_phone(self.patient_phone_number)
     
     def save(self, *args, **kwargs):
         # Auto-calculate end_datetime if not set
@@ -84,8 +128,23 @@ class Appointment(models.Model):
             self.price = self.service.price
         if self.service and not self.duration_minutes:
             self.duration_minutes = self.service.duration_minutes
+        
+        self.populate_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                field for field, source in self.DERIVED_FIELDS.items() if source in update_fields
+            }
             
         super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so signal handlers can see what moved
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
     
     def __str__(self):
         return f"{self.patient_first_name} {self.patient_last_name} - {self.start_datetime.strftime('%Y-%m-%d %H:%M')}"
@@ -93,6 +152,108 @@ class Appointment(models.Model):
     class Meta:
         verbose_name_plural = 'Appointments'
         ordering = ['start_datetime']
+        indexes = [
+            # Doctor overlap checks: doctor=?, start_datetime < ?, end_datetime > ?
+            models.Index(fields=['doctor', 'start_datetime', 'end_datetime'], name='appointment_doctor_time_idx'),
+            # Calendar day and week ranges
+            models.Index(fields=['start_date', 'start_datetime'], name='appointment_start_date_idx'),
+            # Patient search box prefixes
+            models.Index(fields=['patient_first_name_search'], name='appointment_first_name_idx'),
+            models.Index(fields=['patient_last_name_search'], name='appointment_last_name_idx'),
+            models.Index(fields=['patient_phone_digits'], name='appointment_phone_idx'),
+        ]
+
+class DailyDoctorStats(models.Model):
+    """
+    Rollup of a doctor's appointments starting on a clinic-local date, kept
+    up to date by backend.clinic.utils.daily_stats
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    appointment_count = models.IntegerField(default=0)
+    booked_minutes = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+
+    def __str__(self):
+        return f"{self.doctor_id} on {self.date}: {self.appointment_count} appointments"
+
+    class Meta:
+        verbose_name_plural = 'Daily doctor stats'
+        unique_together = ['doctor', 'date']
+        indexes = [
+            # Year and date range reports over all doctors
+            models.Index(fields=['date'], name='daily_stats_date_idx'),
+        ]
+
+class DailyDoctorServiceStats(models.Model):
+    """Per-service breakdown of DailyDoctorStats, service None for custom services"""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='daily_service_stats')
+    date = models.DateField()
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_stats')
+    appointment_count = models.IntegerField(default=0)
+    booked_minutes = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+
+    def __str__(self):
+        return f"{self.doctor_id} on {self.date}, service {self.service_id}: {self.appointment_count} appointments"
+
+    class Meta:
+        verbose_name_plural = 'Daily doctor service stats'
+        constraints = [
+            # NULLs never conflict in a plain unique constraint, so the
+            # custom service row gets its own
+            models.UniqueConstraint(
+                fields=['doctor', 'date', 'service'], condition=models.Q(service__isnull=False),
+                name='daily_service_stats_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['doctor', 'date'], condition=models.Q(service__isnull=True),
+                name='daily_service_stats_custom_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='daily_service_stats_date_idx'),
+        ]
+
+class ChangeLog(models.Model):
+    """
+    One change of an appointment or shift, read by the change feed. seq only
+    grows, so clients poll for the changes after the last seq they saw.
+    Deletes are kept as tombstones. Maintained by backend.clinic.utils.changes
+
+    Polling after a seq only misses nothing because SQLite commits one write
+    transaction at a time, so seqs become visible in order. With concurrent
+    writers, as on PostgreSQL, a transaction holding a lower seq can commit
+    after a higher one was already read, and the feed would skip it.
+    """
+    OBJECT_TYPES = (
+        ('appointment', 'Appointment'),
+        ('shift', 'Shift'),
+    )
+    
+    ACTIONS = (
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    )
+    
+    seq = models.BigAutoField(primary_key=True)
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    changed_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.seq}: {self.action} {self.object_type} {self.object_id}"
+
+    class Meta:
+        verbose_name_plural = 'Change log'
+        ordering = ['seq']
+        indexes = [
+            # Compaction: the newest entry of each object
+            models.Index(fields=['object_type', 'object_id', 'seq'], name='changelog_object_idx'),
+            # Retention
+            models.Index(fields=['changed_at'], name='changelog_changed_at_idx'),
+        ]
 
 def create_default_superuser(sender, **kwargs):
     from django.contrib.auth import get_user_model
@@ -0,0 +1,136 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering tuple.
+
+    The cursor holds the ordering values of the last (or first) row of the
+    page, and the next page is fetched with a lexicographic comparison on
+    them instead of an OFFSET, so deep pages cost the same as the first one and
+    rows inserted meanwhile never shift or repeat results.
+    """
+    # Fields ending in a unique one, '-' marks descending fields
+    ordering = ('id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        page_size = getattr(settings, 'CLINIC_API_PAGE_SIZE', 50)
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+            except ValueError:
+                pass
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, view):
+        """The view may override the ordering per request, e.g. for search ranking"""
+        return getattr(view, 'keyset_ordering', None) or self.ordering
+
+    def encode_cursor(self, instance, reverse):
+        fields = [self.model._meta.get_field(field_name.lstrip('-')) for field_name in self.ordering]
+        if isinstance(instance, dict):
+            # A .values() row from a fast read path
+            instance = self.model(**{field.attname: instance[field.attname] for field in fields})
+        values = [field.value_to_string(instance) for field in fields]
+        payload = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        cursor = urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            values = [
+                self.model._meta.get_field(field_name.lstrip('-')).to_python(value)
+                for field_name, value in zip(self.ordering, payload['v'], strict=True)
+            ]
+            return values, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def keyset_filter(self, values, reverse):
+        """Rows strictly after (or before) `values` in the ordering"""
+        query = Q()
+        equal = {}
+        for field_name, value in zip(self.ordering, values):
+            descending = field_name.startswith('-')
+            field_name = field_name.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            query |= Q(**equal, **{f'{field_name}__{lookup}': value})
+            equal[field_name] = value
+        # The bound on the leading field lets the database seek into its index
+        leading = self.ordering[0]
+        lookup = 'lte' if leading.startswith('-') != reverse else 'gte'
+        return Q(**{f'{leading.lstrip("-")}__{lookup}': values[0]}) & query
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.model = queryset.model
+        self.ordering = self.get_ordering(view)
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.cursor_query_param)
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by(*[
+                field_name[1:] if field_name.startswith('-') else f'-{field_name}'
+                for field_name in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_link = None
+        self.previous_link = None
+        if rows:
+            if has_more or reverse:
+                self.next_link = self.encode_cursor(rows[-1], reverse=False)
+            if values is not None and (has_more or not reverse):
+                self.previous_link = self.encode_cursor(rows[0], reverse=True)
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = ('start_datetime', 'id')
+
+
+class ShiftPagination(KeysetPagination):
+    ordering = ('year', 'week_of_year', 'day_of_week', 'start_time', 'id')
@@ -1,5 +1,7 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import Doctor, Service, Shift, Appointment
+from .utils.booking import CONFLICT_MESSAGE, is_doctor_booked, lock_doctors
 from datetime import datetime, timedelta
 
 class DoctorSerializer(serializers.ModelSerializer):
@@ -26,13 +28,34 @@ class ShiftSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shift
         fields = [
-            'id', 'week_of_year', 'day_of_week', 'day_name', 'shift_type', 
-            'start_time', 'end_time', 'doctors', 'doctor_ids'
+            'id', 'year', 'week_of_year', 'day_of_week', 'day_name', 'shift_type', 
+            'start_time', 'end_time', 'doctors', 'doctor_ids', 'updated_at'
         ]
     
     def get_day_name(self, obj):
         return dict(Shift.DAYS_OF_WEEK)[obj.day_of_week]
 
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that resolves values from a {pk: instance} map in the
+    serializer context, so validating many items does not query per item
+    """
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        instance = self.context.get(self.context_key, {}).get(pk)
+        if instance is None:
+            self.fail('does_not_exist', pk_value=data)
+        return instance
+
 class AppointmentSerializer(serializers.ModelSerializer):
     doctor = DoctorSerializer(read_only=True)
     doctor_id = serializers.PrimaryKeyRelatedField(
@@ -55,7 +78,8 @@ class AppointmentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'patient_first_name', 'patient_last_name', 'patient_full_name',
             'patient_phone_number', 'doctor', 'doctor_id', 'service', 'service_id',
-            'custom_service_name', 'price', 'duration_minutes', 'start_datetime', 'end_datetime'
+            'custom_service_name', 'price', 'duration_minutes', 'start_datetime', 'end_datetime',
+            'updated_at'
         ]
         read_only_fields = ['end_datetime']
     
@@ -82,32 +106,18 @@ class AppointmentSerializer(serializers.ModelSerializer):
             if not data.get('duration_minutes'):
                 raise serializers.ValidationError("Duration is required for custom services")
         
-        # Validate appointment time doesn't conflict with existing appointments
-        start_datetime = data.get('start_datetime')
-        doctor = data.get('doctor')
-        duration_minutes = data.get('duration_minutes', 0)
-        
-        if start_datetime and doctor and duration_minutes:
-            end_datetime = start_datetime + timedelta(minutes=duration_minutes)
-            
-            # Check for conflicts with existing appointments
-            conflicting_appointments = Appointment.objects.filter(
-                doctor=doctor,
-                start_datetime__lt=end_datetime,
-                end_datetime__gt=start_datetime
-            )
-            
-            # Exclude current appointment if updating
-            if self.instance:
-                conflicting_appointments = conflicting_appointments.exclude(id=self.instance.id)
-            
-            if conflicting_appointments.exists():
-                raise serializers.ValidationError(
-                    "This appointment conflicts with an existing appointment"
-                )
-        
         return data
     
+    def reserve_slot(self, doctor, start_datetime, end_datetime):
+        """
+        Check the doctor is free for the appointment. Must run in the saving
+        transaction: the doctor stays locked until it ends, so concurrent
+        bookings of the same doctor are checked one after another.
+        """
+        lock_doctors([doctor.pk])
+        if is_doctor_booked(doctor.pk, start_datetime, end_datetime, exclude_id=self.instance and self.instance.pk):
+            raise serializers.ValidationError({'non_field_errors': [CONFLICT_MESSAGE]})
+    
     def create(self, validated_data):
         # Auto-calculate end_datetime
         start_datetime = validated_data.get('start_datetime')
@@ -116,7 +126,9 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if start_datetime and duration_minutes:
             validated_data['end_datetime'] = start_datetime + timedelta(minutes=duration_minutes)
         
-        return super().create(validated_data)
+        with transaction.atomic():
+            self.reserve_slot(validated_data['doctor'], start_datetime, validated_data['end_datetime'])
+            return super().create(validated_data)
     
     def update(self, instance, validated_data):
         # Auto-calculate end_datetime if start_datetime or duration changes
@@ -126,7 +138,35 @@ class AppointmentSerializer(serializers.ModelSerializer):
         if 'start_datetime' in validated_data or 'duration_minutes' in validated_data:
             validated_data['end_datetime'] = start_datetime + timedelta(minutes=duration_minutes)
         
-        return super().update(instance, validated_data)
+        with transaction.atomic():
+            if {'doctor', 'start_datetime', 'duration_minutes'} & validated_data.keys():
+                self.reserve_slot(
+                    validated_data.get('doctor', instance.doctor),
+                    start_datetime,
+                    validated_data.get('end_datetime', instance.end_datetime)
+                )
+            return super().update(instance, validated_data)
+
+class BulkAppointmentSerializer(AppointmentSerializer):
+    """
+    Validates one item of a bulk write. Doctors and services come from the
+    'doctors' and 'services' maps in the context and conflicts are left to
+    the bulk conflict check.
+    """
+    doctor_id = PrefetchedPrimaryKeyRelatedField(
+        'doctors',
+        queryset=Doctor.objects.all(), 
+        source='doctor', 
+        write_only=True
+    )
+    service_id = PrefetchedPrimaryKeyRelatedField(
+        'services',
+        queryset=Service.objects.all(), 
+        source='service', 
+        write_only=True,
+        required=False,
+        allow_null=True
+    )
 
 class CalendarAppointmentSerializer(serializers.ModelSerializer):
     """Serializer for calendar view with additional context"""
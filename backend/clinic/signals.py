@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# Sent by bulk writes that bypass the per-object model signals.
+#
+# shifts_bulk_changed: weeks is a list of (week_of_year, year) pairs whose
+# shifts or shift doctors changed. Senders that know which shifts changed
+# also pass their ids as shift_ids.
+shifts_bulk_changed = Signal()
+
+# appointments_bulk_changed: created and updated are lists of saved
+# Appointment instances, deleted a list of deleted ones. Writers that do not
+# build instances pass the clinic-local dates they touched as dates instead.
+appointments_bulk_changed = Signal()
@@ -1,3 +1,2671 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import threading
+import tracemalloc
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from time import perf_counter
+from tempfile import NamedTemporaryFile
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.db.models import Exists, F, OuterRef, Q
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .middleware import QueryBudgetMiddleware
+from .models import Doctor, Service, Shift, Appointment, ChangeLog, DailyDoctorServiceStats, DailyDoctorStats
+from .serializers import AppointmentSerializer, CalendarAppointmentSerializer, ShiftSerializer
+from .utils.audit import iter_findings
+from .utils.availability import (
+    GRID_CACHE_SIZE, AvailabilityMap, find_gaps, format_minute, grid_mask, interval_mask, iter_bits, merge_intervals,
+    run_starts,
+)
+from .utils import calendar_cache, changes, importer
+from .utils.booking import find_interval_conflicts
+from .utils.calendar import get_week_appointments
+from .utils.daily_stats import find_inconsistencies
+from .utils.events import EventHub, LocalBroker, RedisBroker, get_broker, hub, make_event, stream_events
+from .utils.database import DEFAULT_SQLITE_PRAGMAS, get_sqlite_settings
+from .utils.metrics import MetricsRegistry, registry as metrics_registry
+from .utils.query_budget import fingerprint, get_query_budget
+from .utils.load_test import EventStreamClient
+from .utils.fast_serializers import appointment_values, serialize_appointments, serialize_calendar_appointments
+from .utils.search import normalize_name, normalize_phone, patient_search_filter
+from .utils.shift_rotation import FIRST, SATURDAY, SECOND, ShiftRotationManager
+from .urls import router
+from .views import DoctorViewSet, MetricsView
 
-# Create your tests here.
+
+def overlapping_appointments():
+    """Appointments overlapping a later one of the same doctor"""
+    return Appointment.objects.filter(Exists(Appointment.objects.filter(
+        doctor_id=OuterRef('doctor_id'),
+        id__gt=OuterRef('id'),
+        start_datetime__lt=OuterRef('end_datetime'),
+        end_datetime__gt=OuterRef('start_datetime'),
+    )))
+
+
+class ClinicTestCase(TestCase):
+    """Base test case with an authenticated staff client and data helpers"""
+    week = 10
+
+    def setUp(self):
+        self.user = User.objects.create(username='staff', email='staff@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.year = timezone.now().year
+        self.week_start = ShiftRotationManager.get_week_start_date(self.week, self.year)
+        self.service = Service.objects.create(
+            name='Regular Checkup', price=Decimal('75.00'), duration_minutes=30
+        )
+        calendar_cache.get_cache().clear()
+        calendar_cache.reset_cache_stats()
+
+    def create_doctors(self, count):
+        return [
+            Doctor.objects.create(
+                full_name=f'Dr. Test {i}',
+                phone_number=f'+389-70-{i:06d}',
+                email=f'doctor{i}@example.com',
+            )
+            for i in range(count)
+        ]
+
+    def local_datetime(self, day, hour, minute=0):
+        return timezone.make_aware(
+            datetime.combine(self.week_start + timedelta(days=day), time(hour, minute))
+        )
+
+    def create_appointment(self, doctor, start, duration=30, service=None, **kwargs):
+        service = service or self.service
+        data = {
+            'patient_first_name': 'Ana',
+            'patient_last_name': 'Petrovska',
+            'patient_phone_number': '070 123 456',
+            'price': service.price,
+            'duration_minutes': duration,
+        }
+        data.update(kwargs)
+        return Appointment.objects.create(
+            doctor=doctor, service=service, start_datetime=start, **data
+        )
+
+    def create_week(self, doctor_count, appointments_per_day):
+        doctors = self.create_doctors(doctor_count)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        for day in range(6):
+            for i in range(appointments_per_day):
+                doctor = doctors[i % doctor_count]
+                self.create_appointment(doctor, self.local_datetime(day, 8 + i // doctor_count))
+        return doctors
+
+
+class CalendarQueryCountTests(ClinicTestCase):
+    def assert_calendar_queries(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_week_calendar_query_count_is_constant(self):
+        # Appointments, shifts and shift doctors: one query each
+        self.create_week(doctor_count=1, appointments_per_day=1)
+        small = self.assert_calendar_queries(f'/api/calendar/?week={self.week}', 3)
+
+        self.create_week(doctor_count=6, appointments_per_day=12)
+        large = self.assert_calendar_queries(f'/api/calendar/?week={self.week}', 3)
+
+        self.assertEqual(len(small['Monday']['appointments']), 1)
+        self.assertEqual(len(large['Monday']['appointments']), 13)
+        # The seven doctors split between Monday's two shifts
+        monday = large['Monday']['shifts']
+        self.assertEqual(len(monday['first']['doctors']) + len(monday['second']['doctors']), 7)
+        self.assertEqual(large['Sunday']['appointments'], [])
+
+    def test_future_query_count_is_constant(self):
+        self.create_week(doctor_count=1, appointments_per_day=1)
+        self.assert_calendar_queries(f'/api/appointments/future/?week={self.week}', 1)
+
+        self.create_week(doctor_count=5, appointments_per_day=10)
+        data = self.assert_calendar_queries(f'/api/appointments/future/?week={self.week}', 1)
+        self.assertEqual(len(data[self.week_start.strftime('%Y-%m-%d')]['appointments']), 11)
+
+    def test_appointments_grouped_by_local_date(self):
+        doctor = self.create_doctors(1)[0]
+        # 00:30 local time is still the previous day in UTC
+        self.create_appointment(doctor, self.local_datetime(2, 0, 30))
+        data = self.client.get(f'/api/calendar/?week={self.week}').data
+        self.assertEqual(len(data['Wednesday']['appointments']), 1)
+        self.assertEqual(data['Tuesday']['appointments'], [])
+
+
+class RangeCalendarTests(ClinicTestCase):
+    def get_range(self, start_date, end_date, queries=3, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/calendar/range/', {
+                'start_date': start_date.isoformat(), 'end_date': end_date.isoformat(), **params
+            })
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_matches_week_calendar(self):
+        self.create_week(doctor_count=2, appointments_per_day=3)
+        week = self.client.get(f'/api/calendar/?week={self.week}').data
+        data = self.get_range(self.week_start, self.week_start + timedelta(days=6))
+        self.assertEqual(len(data['days']), 7)
+        for day in week.values():
+            self.assertEqual(data['days'][day['date']], day)
+
+    def test_query_count_is_constant(self):
+        self.create_week(doctor_count=2, appointments_per_day=2)
+        self.get_range(self.week_start, self.week_start)
+        data = self.get_range(self.week_start - timedelta(days=40), self.week_start + timedelta(days=51))
+        self.assertEqual(len(data['days']), 92)
+        self.get_range(self.week_start, self.week_start + timedelta(days=91), compact='true')
+
+    def test_across_year_boundary(self):
+        doctor = self.create_doctors(1)[0]
+        year = self.year + 1
+        last_week = ShiftRotationManager.get_weeks_in_year(year)
+        ShiftRotationManager.generate_shifts([(last_week, year), (1, year + 1)])
+        new_year = ShiftRotationManager.get_week_start_date(1, year + 1)
+        self.create_appointment(doctor, timezone.make_aware(datetime.combine(new_year - timedelta(days=7), time(9))))
+        self.create_appointment(doctor, timezone.make_aware(datetime.combine(new_year, time(9))))
+
+        data = self.get_range(new_year - timedelta(days=7), new_year + timedelta(days=6))
+        days = list(data['days'].values())
+        self.assertEqual(len(days), 14)
+        self.assertEqual([len(day['appointments']) for day in (days[0], days[7])], [1, 1])
+        self.assertEqual(set(days[0]['shifts']), {'first', 'second'})
+        self.assertEqual(set(days[12]['shifts']), {'first'})
+        self.assertEqual(days[13]['shifts'], {})
+
+    def test_compact(self):
+        doctors = self.create_doctors(2)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        self.create_appointment(doctors[0], self.local_datetime(0, 9), duration=30)
+        self.create_appointment(doctors[0], self.local_datetime(0, 10), duration=45)
+        self.create_appointment(doctors[1], self.local_datetime(0, 9), duration=60)
+        self.create_appointment(doctors[1], self.local_datetime(2, 9), duration=15)
+
+        data = self.get_range(self.week_start, self.week_start + timedelta(days=6), compact='true')
+        self.assertTrue(data['compact'])
+        monday = data['days'][self.week_start.isoformat()]
+        self.assertNotIn('appointments', monday)
+        self.assertEqual((monday['appointment_count'], monday['booked_minutes']), (3, 135))
+        self.assertEqual(monday['doctors'], [
+            {'id': doctors[0].id, 'full_name': doctors[0].full_name, 'appointment_count': 2, 'booked_minutes': 75},
+            {'id': doctors[1].id, 'full_name': doctors[1].full_name, 'appointment_count': 1, 'booked_minutes': 60},
+        ])
+        self.assertEqual(data['days'][(self.week_start + timedelta(days=2)).isoformat()]['booked_minutes'], 15)
+        sunday = data['days'][(self.week_start + timedelta(days=6)).isoformat()]
+        self.assertEqual((sunday['appointment_count'], sunday['doctors'], sunday['shifts']), (0, [], {}))
+
+    def test_invalid_ranges(self):
+        start = self.week_start
+        for params, message in [
+            ({'start_date': start.isoformat()}, 'start_date and end_date parameters are required'),
+            ({'start_date': start.isoformat(), 'end_date': 'soon'}, 'Invalid parameter'),
+            ({'start_date': start.isoformat(), 'end_date': (start - timedelta(days=1)).isoformat()}, 'within 92 days'),
+            ({'start_date': start.isoformat(), 'end_date': (start + timedelta(days=92)).isoformat()}, 'within 92 days'),
+        ]:
+            response = self.client.get('/api/calendar/range/', params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(message, response.data['error'])
+
+    def test_week_calendar_of_another_year(self):
+        doctor = self.create_doctors(1)[0]
+        week_start = ShiftRotationManager.get_week_start_date(self.week, self.year + 1)
+        self.create_appointment(doctor, timezone.make_aware(datetime.combine(week_start, time(9))))
+        data = self.client.get(f'/api/calendar/?week={self.week}&year={self.year + 1}').data
+        self.assertEqual(data['Monday']['date'], week_start.isoformat())
+        self.assertEqual(len(data['Monday']['appointments']), 1)
+        data = self.client.get(f'/api/appointments/future/?week={self.week}&year={self.year + 1}').data
+        self.assertEqual(len(data[week_start.isoformat()]['appointments']), 1)
+
+
+class AppointmentIndexTests(ClinicTestCase):
+    def test_start_date_is_clinic_local(self):
+        doctor = self.create_doctors(1)[0]
+        appointment = self.create_appointment(doctor, self.local_datetime(2, 0, 30))
+        self.assertEqual(appointment.start_date, self.week_start + timedelta(days=2))
+
+        appointment.start_datetime = self.local_datetime(3, 23, 45)
+        appointment.save(update_fields=['start_datetime'])
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.start_date, self.week_start + timedelta(days=3))
+
+    def test_conflict_query_uses_doctor_time_index(self):
+        doctor = self.create_doctors(1)[0]
+        start = self.local_datetime(0, 9)
+        plan = Appointment.objects.filter(
+            doctor=doctor,
+            start_datetime__lt=start + timedelta(minutes=30),
+            end_datetime__gt=start
+        ).explain()
+        self.assertIn('appointment_doctor_time_idx', plan)
+
+    def test_week_query_uses_start_date_index(self):
+        plan = get_week_appointments(self.week_start, self.week_start + timedelta(days=6)).explain()
+        self.assertIn('appointment_start_date_idx', plan)
+
+
+class ShiftGenerationTests(ClinicTestCase):
+    # A fixed year, so exact rotations do not depend on when the tests run
+    rotation_year = 2026
+
+    def test_generation_query_count_does_not_grow_with_staff(self):
+        # Doctors, existing shifts, shift insert, existing assignments,
+        # assignment insert, the changed shifts' updated_at and change log
+        # entries, plus the savepoint pair of the transaction
+        self.create_doctors(2)
+        with self.assertNumQueries(9):
+            report = ShiftRotationManager.generate_shifts([(self.week, self.rotation_year)])
+        self.assertEqual(report['created'], 11)
+
+        # The first two keep their turns, so nothing is deleted
+        self.create_doctors(20)
+        with self.assertNumQueries(8):
+            report = ShiftRotationManager.generate_shifts([(self.week, self.rotation_year)])
+        self.assertEqual((report['doctors_added'], report['doctors_removed']), (20 * 5 + 10, 0))
+
+    def test_generation_reports_created_updated_unchanged(self):
+        self.create_doctors(3)
+        week = [(self.week, self.rotation_year)]
+        report = ShiftRotationManager.generate_shifts(week)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (11, 0, 0))
+        # Five weekday shifts each, and two of them on Saturday
+        self.assertEqual(report['doctors_added'], 17)
+
+        report = ShiftRotationManager.generate_shifts(week)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (0, 0, 11))
+
+        shift = Shift.objects.get(year=self.rotation_year, week_of_year=self.week, day_of_week=0, shift_type='first')
+        shift.doctors.clear()
+        report = ShiftRotationManager.generate_shifts(week)
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (0, 1, 10))
+        self.assertEqual(shift.doctors.count(), 2)
+
+    def test_rotation_plan(self):
+        weeks = list(ShiftRotationManager.iter_weeks(1, 2026, 52, 2026))
+        doctor_ids = list(range(1, 51))
+        plan = ShiftRotationManager.plan_rotation(weeks, doctor_ids)
+        self.assertEqual(len(plan.cells), 52 * 50)
+
+        for doctor_index in range(50):
+            codes = [plan.code(week_index, doctor_index) & (FIRST | SECOND) for week_index in range(52)]
+            # First in week N, second in week N+1
+            self.assertTrue(all({codes[i], codes[i + 1]} == {FIRST, SECOND} for i in range(51)))
+        load = plan.load()
+        self.assertEqual({(counts['first'], counts['second']) for counts in load.values()}, {(26, 26)})
+        saturdays = [counts['saturday'] for counts in load.values()]
+        self.assertEqual((sum(saturdays), max(saturdays) - min(saturdays)), (52 * 25, 0))
+
+        staffed = {}
+        for week_of_year, year, day_of_week, shift_type, doctor_id in plan.assignments():
+            staffed[week_of_year, day_of_week, shift_type] = staffed.get((week_of_year, day_of_week, shift_type), 0) + 1
+        self.assertEqual(len(staffed), 52 * 11)
+        self.assertEqual(set(staffed.values()), {25})
+
+        # A week planned alone is planned as in the year around it
+        alone = ShiftRotationManager.plan_rotation([(10, 2026)], doctor_ids)
+        self.assertEqual(alone.cells, plan.cells[9 * 50:10 * 50])
+        # Odd staff, a lone doctor and no doctors
+        saturdays = [counts['saturday'] for counts in ShiftRotationManager.plan_rotation(weeks, range(7)).load().values()]
+        self.assertLessEqual(max(saturdays) - min(saturdays), 1)
+        self.assertEqual(set(ShiftRotationManager.plan_rotation(weeks[:1], [5]).cells), {FIRST | SECOND | SATURDAY})
+        self.assertEqual(list(ShiftRotationManager.plan_rotation(weeks, []).assignments()), [])
+
+    def test_regeneration_writes_only_the_changes(self):
+        doctors = self.create_doctors(4)
+        weeks = list(ShiftRotationManager.iter_weeks(self.week, self.rotation_year, self.week + 3, self.rotation_year))
+        report = ShiftRotationManager.generate_shifts(weeks)
+        self.assertEqual(report['doctors_added'], 4 * (4 * 5 + 2))
+
+        # Nothing to write: doctors, shifts, assignments and the savepoint pair
+        with self.assertNumQueries(5):
+            report = ShiftRotationManager.generate_shifts(weeks)
+        self.assertEqual((report['doctors_added'], report['doctors_removed'], report['updated']), (0, 0, 0))
+
+        # A fifth doctor adds their weekday shifts, a third Saturday doctor
+        # per week, and moves Saturday turns only
+        Assignment = Shift.doctors.through
+        before = set(Assignment.objects.values_list('shift_id', 'doctor_id'))
+        self.create_doctors(1)
+        report = ShiftRotationManager.generate_shifts(weeks)
+        self.assertEqual(report['doctors_added'], 4 * 5 + report['doctors_removed'] + 4)
+        removed = before - set(Assignment.objects.values_list('shift_id', 'doctor_id'))
+        self.assertEqual(len(removed), report['doctors_removed'])
+        self.assertEqual(set(Shift.objects.filter(pk__in=[shift_id for shift_id, _ in removed]).values_list('day_of_week', flat=True)), {5})
+
+    def test_generate_week_endpoint(self):
+        self.create_doctors(2)
+        response = self.client.post('/api/shifts/generate_week/', {'week': self.week, 'year': self.year})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 11)
+        self.assertEqual(len(response.data['shifts']), 11)
+        # One doctor in the morning, the other in the afternoon
+        self.assertEqual([len(shift['doctors']) for shift in response.data['shifts'][:2]], [1, 1])
+
+    def test_iter_weeks_rolls_over_years(self):
+        self.assertEqual(ShiftRotationManager.get_weeks_in_year(2024), 53)
+        self.assertEqual(ShiftRotationManager.get_weeks_in_year(2025), 52)
+        self.assertEqual(
+            list(ShiftRotationManager.iter_weeks(52, 2024, 2, 2025)),
+            [(52, 2024), (53, 2024), (1, 2025), (2, 2025)]
+        )
+        # 2025-01-05 is a Sunday before the first Monday of 2025
+        self.assertEqual(ShiftRotationManager.get_week_and_year(datetime(2025, 1, 5).date()), (53, 2024))
+
+    def test_generate_range_across_year_boundary(self):
+        self.create_doctors(2)
+        response = self.client.post('/api/shifts/generate_range/', {
+            'start_week': 51, 'start_year': 2026, 'end_week': 2, 'end_year': 2027,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['weeks'], 4)
+        self.assertEqual(response.data['created'], 44)
+        self.assertEqual(Shift.objects.filter(year=2027, week_of_year=1).count(), 11)
+        # Week 1 of 2027 does not overwrite week 1 of 2026
+        ShiftRotationManager.create_or_update_shifts_for_week(1, 2026)
+        self.assertEqual(Shift.objects.filter(week_of_year=1).count(), 22)
+
+    def test_generate_range_validation(self):
+        response = self.client.post('/api/shifts/generate_range/', {
+            'start_week': 5, 'start_year': 2027, 'end_week': 2, 'end_year': 2027,
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/shifts/generate_range/', {
+            'start_week': 53, 'start_year': 2026, 'end_week': 2, 'end_year': 2027,
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(os.environ.get('CLINIC_BENCHMARKS'), 'Set CLINIC_BENCHMARKS=1 to run benchmarks')
+class ShiftRotationBenchmark(ClinicTestCase):
+    def test_plan_year_for_fifty_doctors(self):
+        doctors = self.create_doctors(50)
+        weeks = list(ShiftRotationManager.iter_weeks(1, 2026, 1, 2027))
+        began = perf_counter()
+        plan = ShiftRotationManager.plan_rotation(weeks, [doctor.pk for doctor in doctors])
+        assignments = list(plan.assignments())
+        self.assertLess(perf_counter() - began, 1)
+
+        report = ShiftRotationManager.generate_shifts(weeks)
+        self.assertEqual(report['doctors_added'], len(assignments))
+        report = ShiftRotationManager.generate_shifts(weeks)
+        self.assertEqual(report['doctors_added'] + report['doctors_removed'], 0)
+
+
+class DailyStatsTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+        self.filling = Service.objects.create(name='Filling', price=Decimal('40.00'), duration_minutes=45)
+
+    def totals(self, doctor, day):
+        row = DailyDoctorStats.objects.filter(doctor=doctor, date=self.week_start + timedelta(days=day)).first()
+        return (row.appointment_count, row.booked_minutes, row.revenue) if row else None
+
+    def assertConsistent(self):
+        self.assertEqual(find_inconsistencies(), [])
+
+    def test_incremental_updates(self):
+        first = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 10), duration=45, service=self.filling)
+        self.assertEqual(self.totals(self.doctors[0], 0), (2, 75, Decimal('115.00')))
+        self.assertEqual(DailyDoctorServiceStats.objects.filter(doctor=self.doctors[0]).count(), 2)
+        self.assertConsistent()
+
+        # Moving to another day and doctor, and changing the price
+        first.start_datetime = self.local_datetime(1, 9)
+        first.doctor = self.doctors[1]
+        first.price = Decimal('60.00')
+        first.save()
+        self.assertEqual(self.totals(self.doctors[0], 0), (1, 45, Decimal('40.00')))
+        self.assertEqual(self.totals(self.doctors[1], 1), (1, 30, Decimal('60.00')))
+        self.assertConsistent()
+
+        # Changing the service of a saved appointment moves its breakdown row
+        first.service = None
+        first.save()
+        self.assertTrue(DailyDoctorServiceStats.objects.filter(doctor=self.doctors[1], service=None).exists())
+        self.assertConsistent()
+
+        first.delete()
+        self.assertIsNone(self.totals(self.doctors[1], 1))
+        self.assertFalse(DailyDoctorServiceStats.objects.filter(doctor=self.doctors[1]).exists())
+        self.assertConsistent()
+
+    def test_saving_unloaded_instance(self):
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        Appointment(
+            **{field.attname: getattr(appointment, field.attname) for field in Appointment._meta.concrete_fields},
+        ).save()
+        self.assertEqual(self.totals(self.doctors[0], 0), (1, 30, Decimal('75.00')))
+        self.assertConsistent()
+
+    def test_bulk_writes(self):
+        existing = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        item = {
+            'patient_first_name': 'Marko',
+            'patient_last_name': 'Stojanov',
+            'patient_phone_number': '071 222 333',
+            'service_id': self.filling.id,
+            'price': '40.00',
+            'duration_minutes': 45,
+        }
+        items = [
+            {**item, 'doctor_id': self.doctors[i % 2].id, 'start_datetime': self.local_datetime(i // 2, 10).isoformat()}
+            for i in range(6)
+        ]
+        items.append({**item, 'id': existing.id, 'doctor_id': self.doctors[1].id, 'start_datetime': self.local_datetime(4, 9).isoformat()})
+        response = self.client.post('/api/appointments/bulk/', {'appointments': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.totals(self.doctors[0], 4))
+        self.assertEqual(self.totals(self.doctors[1], 4), (1, 45, Decimal('40.00')))
+        self.assertConsistent()
+
+    def test_service_and_doctor_deletion(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9), service=self.filling, duration=45)
+        self.create_appointment(self.doctors[1], self.local_datetime(0, 9), service=self.filling, duration=45)
+        self.create_appointment(self.doctors[1], self.local_datetime(0, 10))
+        filling_id, doctor_id = self.filling.id, self.doctors[1].id
+        self.filling.delete()
+        self.assertFalse(DailyDoctorServiceStats.objects.filter(service_id=filling_id).exists())
+        self.assertTrue(DailyDoctorServiceStats.objects.filter(service=None).exists())
+        self.assertConsistent()
+
+        self.doctors[1].delete()
+        self.assertFalse(DailyDoctorStats.objects.filter(doctor_id=doctor_id).exists())
+        self.assertConsistent()
+
+    def test_rebuild_and_check_commands(self):
+        for day in range(3):
+            self.create_appointment(self.doctors[day % 2], self.local_datetime(day, 9))
+        # Queryset updates send no signals, so the rollup goes stale
+        Appointment.objects.filter(doctor=self.doctors[0]).update(price=Decimal('99.00'))
+        DailyDoctorStats.objects.filter(doctor=self.doctors[1]).delete()
+
+        with self.assertRaisesMessage(CommandError, 'run with --fix'):
+            call_command('check_stats', stdout=StringIO())
+        output = StringIO()
+        call_command('check_stats', fix=True, stdout=output)
+        self.assertIn('Rebuilt', output.getvalue())
+        self.assertConsistent()
+        self.assertEqual(self.totals(self.doctors[0], 0), (1, 30, Decimal('99.00')))
+
+        DailyDoctorStats.objects.all().delete()
+        DailyDoctorServiceStats.objects.all().delete()
+        output = StringIO()
+        call_command('rebuild_stats', chunk_days=1, stdout=output)
+        self.assertIn('Rebuilt 3 daily doctor statistics', output.getvalue())
+        call_command('check_stats', stdout=StringIO())
+
+    def test_daily_endpoint(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 10), service=self.filling, duration=45)
+        self.create_appointment(self.doctors[1], self.local_datetime(2, 9))
+        params = {'start_date': self.week_start.isoformat(), 'end_date': (self.week_start + timedelta(days=6)).isoformat()}
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/stats/', params)
+        self.assertEqual(response.status_code, 200)
+        days = response.data['days']
+        self.assertEqual(len(days), 2)
+        self.assertEqual(days[0], {
+            'date': self.week_start.isoformat(),
+            'doctor': {'id': self.doctors[0].id, 'full_name': self.doctors[0].full_name},
+            'appointment_count': 2,
+            'booked_minutes': 75,
+            'revenue': '115.00',
+            'services': [
+                {'id': self.service.id, 'name': self.service.name, 'appointment_count': 1, 'booked_minutes': 30, 'revenue': '75.00'},
+                {'id': self.filling.id, 'name': self.filling.name, 'appointment_count': 1, 'booked_minutes': 45, 'revenue': '40.00'},
+            ],
+        })
+
+        response = self.client.get('/api/stats/', {**params, 'doctor': self.doctors[1].id})
+        self.assertEqual([day['doctor']['id'] for day in response.data['days']], [self.doctors[1].id])
+        self.assertEqual(self.client.get('/api/stats/', {'start_date': params['start_date']}).status_code, 400)
+
+    def test_revenue_by_month(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        self.create_appointment(self.doctors[0], timezone.make_aware(datetime(self.year, 11, 3, 9)), service=self.filling)
+        self.create_appointment(self.doctors[1], self.local_datetime(1, 9))
+        self.create_appointment(self.doctors[1], timezone.make_aware(datetime(self.year + 1, 1, 5, 9)))
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/stats/revenue/', {'year': self.year})
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['total'], {'appointment_count': 3, 'booked_minutes': 90, 'revenue': '190.00'})
+        self.assertEqual([doctor['id'] for doctor in data['doctors']], [self.doctors[0].id, self.doctors[1].id])
+        months = data['doctors'][0]['months']
+        self.assertEqual(len(months), 12)
+        self.assertEqual(months[self.week_start.month - 1]['revenue'], '75.00')
+        self.assertEqual(months[10], {'month': 11, 'appointment_count': 1, 'booked_minutes': 30, 'revenue': '40.00'})
+        self.assertEqual(months[11]['revenue'], '0.00')
+        self.assertEqual(data['doctors'][0]['total']['revenue'], '115.00')
+
+        self.assertEqual(self.client.get('/api/stats/revenue/', {'year': self.year + 1}).data['total']['appointment_count'], 1)
+        self.assertEqual(self.client.get('/api/stats/revenue/', {'year': 'next'}).status_code, 400)
+
+    def test_totals(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/stats/totals/')
+        self.assertEqual(response.data, {'appointments': 1, 'doctors': 2, 'services': 2, 'shifts': 11})
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create(username='receptionist'))
+        self.assertEqual(self.client.get('/api/stats/revenue/').status_code, 403)
+        self.assertEqual(self.client.get('/api/stats/totals/').status_code, 403)
+        response = self.client.get('/api/stats/', {'start_date': '2025-01-01', 'end_date': '2025-01-31'})
+        self.assertEqual(response.status_code, 403)
+
+
+class ChangeFeedTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+        changes.get_cache().delete(changes.LATEST_KEY)
+        self.cursor = self.client.get('/api/changes/').data['cursor']
+
+    def poll(self, queries=None, **params):
+        params.setdefault('since', self.cursor)
+        if queries is None:
+            response = self.client.get('/api/changes/', params)
+        else:
+            with self.assertNumQueries(queries):
+                response = self.client.get('/api/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        self.cursor = response.data['cursor']
+        return response.data
+
+    def test_returns_only_what_changed(self):
+        kept = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        moved = self.create_appointment(self.doctors[0], self.local_datetime(0, 10))
+        gone = self.create_appointment(self.doctors[1], self.local_datetime(0, 9))
+        self.poll()
+
+        moved.start_datetime = self.local_datetime(1, 10)
+        moved.patient_first_name = 'Elena'
+        moved.save()
+        moved.save()
+        gone_id = gone.id
+        gone.delete()
+        # Log, then the changed appointments
+        data = self.poll(queries=3)
+        self.assertEqual([appointment['id'] for appointment in data['appointments']], [moved.id])
+        expected = AppointmentSerializer(Appointment.objects.get(pk=moved.id)).data
+        self.assertEqual(data['appointments'][0], json.loads(JSONRenderer().render(expected)))
+        self.assertEqual(data['deleted'], {'appointments': [gone_id], 'shifts': []})
+        self.assertFalse(data['has_more'])
+        self.assertNotIn(kept.id, [appointment['id'] for appointment in data['appointments']])
+
+        # Nothing new since
+        data = self.poll(queries=2)
+        self.assertEqual((data['appointments'], data['shifts'], data['cursor']), ([], [], data['since']))
+
+    def test_updated_at(self):
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        before = appointment.updated_at
+        item = {
+            'id': appointment.id,
+            'patient_first_name': 'Marko',
+            'patient_last_name': 'Stojanov',
+            'patient_phone_number': '071 222 333',
+            'doctor_id': self.doctors[1].id,
+            'service_id': self.service.id,
+            'price': '75.00',
+            'duration_minutes': 30,
+            'start_datetime': self.local_datetime(0, 11).isoformat(),
+        }
+        response = self.client.post('/api/appointments/bulk/', {'appointments': [item]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        appointment.refresh_from_db()
+        self.assertGreater(appointment.updated_at, before)
+        self.assertEqual([row['id'] for row in self.poll()['appointments']], [appointment.id])
+
+    def test_shift_doctor_membership(self):
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        data = self.poll()
+        self.assertEqual(len(data['shifts']), 11)
+        self.assertEqual(data['shifts'][0], json.loads(JSONRenderer().render(
+            ShiftSerializer(Shift.objects.get(pk=data['shifts'][0]['id'])).data
+        )))
+
+        shift = Shift.objects.get(year=self.year, week_of_year=self.week, day_of_week=0, shift_type='first')
+        before = shift.updated_at
+        new_doctor = Doctor.objects.create(full_name='Dr. New', phone_number='+389-70-999999')
+        self.client.post(f'/api/shifts/{shift.id}/doctors/', {'doctor_ids': [new_doctor.id]}, format='json')
+        data = self.poll()
+        self.assertEqual([row['id'] for row in data['shifts']], [shift.id])
+        self.assertIn(new_doctor.id, [doctor['id'] for doctor in data['shifts'][0]['doctors']])
+        shift.refresh_from_db()
+        self.assertGreater(shift.updated_at, before)
+
+        # From the doctor's side
+        new_doctor.shifts.clear()
+        self.assertEqual([row['id'] for row in self.poll()['shifts']], [shift.id])
+
+        # A deleted doctor's shifts change and their appointments are deleted
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(2, 9))
+        self.poll()
+        worked = set(self.doctors[0].shifts.values_list('id', flat=True))
+        self.doctors[0].delete()
+        data = self.poll()
+        self.assertEqual({row['id'] for row in data['shifts']}, worked)
+        self.assertEqual(data['deleted']['appointments'], [appointment.id])
+
+    def test_regenerating_logs_only_changed_shifts(self):
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        self.poll()
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        self.assertEqual(self.poll()['shifts'], [])
+
+    def test_service_deletion(self):
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        self.poll()
+        self.service.delete()
+        data = self.poll()
+        self.assertEqual([(row['id'], row['service']) for row in data['appointments']], [(appointment.id, None)])
+
+    def test_paging(self):
+        created = [self.create_appointment(self.doctors[i % 2], self.local_datetime(i // 2, 9)) for i in range(5)]
+        seen = []
+        while True:
+            data = self.poll(limit=2)
+            seen += [row['id'] for row in data['appointments']]
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, [appointment.id for appointment in created])
+
+    def test_compaction_and_retention(self):
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        for hour in (10, 11, 12):
+            appointment.start_datetime = self.local_datetime(0, hour)
+            appointment.save()
+        other = self.create_appointment(self.doctors[1], self.local_datetime(0, 9))
+        # The oldest entry stays, so the cursor of an idle client stays valid
+        self.assertEqual(changes.compact(), {'superseded': 2, 'expired': 0})
+        self.assertEqual(ChangeLog.objects.count(), 3)
+        # Compaction never changes what a cursor gets back
+        self.assertEqual({row['id'] for row in self.poll()['appointments']}, {appointment.id, other.id})
+
+        ChangeLog.objects.update(changed_at=timezone.now() - timedelta(days=8))
+        output = StringIO()
+        call_command('compact_changes', stdout=output)
+        self.assertIn('2 expired', output.getvalue())
+        # The newest entry stays
+        oldest = ChangeLog.objects.get().seq - 1
+        response = self.client.get('/api/changes/', {'since': oldest - 1})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data['oldest'], oldest)
+        self.assertEqual(self.client.get('/api/changes/', {'since': oldest}).status_code, 200)
+
+    @override_settings(CLINIC_CHANGE_LOG_COMPACT_EVERY=4)
+    def test_compacts_as_the_log_grows(self):
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        for hour in (10, 11, 12, 13, 14, 15):
+            appointment.start_datetime = self.local_datetime(0, hour)
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment.save()
+        self.assertLess(ChangeLog.objects.count(), 7)
+        self.assertEqual(changes.get_cache().get(changes.LATEST_KEY), ChangeLog.objects.latest('seq').seq)
+
+    def test_long_poll(self):
+        # Only the async endpoint may hold a request open
+        response = self.client.get('/api/changes/', {'since': self.cursor, 'wait': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('/api/async/changes/', response.data['error'])
+
+        started = perf_counter()
+        data = changes.changes_since(self.cursor, wait=0.3)
+        self.assertGreaterEqual(perf_counter() - started, 0.3)
+        self.assertEqual(data['appointments'], [])
+
+        # Another request commits a change while this one waits
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        latest = ChangeLog.objects.latest('seq').seq
+        timer = threading.Timer(0.1, changes.get_cache().set, (changes.LATEST_KEY, latest))
+        timer.start()
+        started = perf_counter()
+        self.assertTrue(changes.wait_for_change(latest - 1, 5))
+        self.assertLess(perf_counter() - started, 2)
+        timer.join()
+        self.assertFalse(changes.wait_for_change(latest, 0.1))
+        self.assertTrue(async_to_sync(changes.await_change)(latest - 1, 0.1))
+
+    def test_async_endpoint(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        response = async_to_sync(AsyncClient().get)('/api/async/changes/', {'since': self.cursor}, headers=headers)
+        self.assertEqual(response.json(), json.loads(self.client.get('/api/changes/', {'since': self.cursor}).content))
+        self.assertEqual(async_to_sync(AsyncClient().get)('/api/async/changes/', headers=headers).json(), {
+            'cursor': ChangeLog.objects.latest('seq').seq,
+        })
+
+    def test_errors(self):
+        for params in ({'since': 'x'}, {'since': -1}, {'since': 0, 'limit': 0}, {'since': 0, 'wait': 60}):
+            self.assertEqual(self.client.get('/api/changes/', params).status_code, 400)
+        self.client.force_authenticate(User.objects.create(username='receptionist'))
+        self.assertEqual(self.client.get('/api/changes/').status_code, 403)
+
+
+class RecordingBroker(LocalBroker):
+    """LocalBroker that keeps what it published"""
+    def __init__(self, hub):
+        super().__init__(hub)
+        self.published = []
+
+    def publish(self, event):
+        self.published.append(event)
+        super().publish(event)
+
+
+class LiveEventTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+
+    def open_stream(self, application, user=None, headers=None, **params):
+        if headers is None:
+            headers = [(b'authorization', f'Bearer {AccessToken.for_user(user or self.user)}'.encode())]
+        return EventStreamClient(application, '/api/async/events/', params, headers)
+
+    def run_streams(self, scenario):
+        """Run scenario in an event loop, without requests closing the test's connection, as the test client does"""
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            return async_to_sync(scenario)()
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    def commit(self, write):
+        """Run write in the test's thread and deliver its on-commit events"""
+        def committed():
+            with self.captureOnCommitCallbacks(execute=True):
+                return write()
+        return sync_to_async(committed)()
+
+    def test_stream_delivers_committed_changes(self):
+        application = ASGIHandler()
+        week_stream = self.open_stream(application, week=self.week, year=self.year)
+        doctor_stream = self.open_stream(application, doctor=self.doctors[1].id)
+        other_stream = self.open_stream(application, week=f'{self.week + 2},{self.week + 3}', year=self.year)
+        streams = [week_stream, doctor_stream, other_stream]
+
+        async def scenario():
+            tasks = [asyncio.create_task(stream.run()) for stream in streams]
+            await asyncio.gather(*(stream.connected.wait() for stream in streams))
+            self.assertEqual(len(hub.subscriptions), 3)
+
+            appointment = await self.commit(
+                lambda: self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+            )
+            self.assertTrue(await week_stream.wait_for_events(1, 5))
+
+            def move():
+                appointment.doctor = self.doctors[1]
+                appointment.save()
+            await self.commit(move)
+            self.assertTrue(await week_stream.wait_for_events(2, 5))
+            self.assertTrue(await doctor_stream.wait_for_events(1, 5))
+            for stream in streams:
+                stream.close()
+            await asyncio.gather(*tasks)
+            return appointment
+
+        appointment = self.run_streams(scenario)
+        self.assertEqual(week_stream.status, 200)
+        self.assertEqual(week_stream.headers['content-type'], 'text/event-stream')
+        self.assertEqual(week_stream.headers['cache-control'], 'no-cache')
+        self.assertEqual(week_stream.events[0], {
+            'event': 'appointment',
+            'data': {
+                'type': 'appointment',
+                'action': 'upsert',
+                'ids': [appointment.id],
+                'weeks': [[self.week, self.year]],
+                'doctors': [self.doctors[0].id],
+            },
+        })
+        # Moving to another doctor reaches the followers of both
+        self.assertEqual(week_stream.events[1]['data']['doctors'], [self.doctors[0].id, self.doctors[1].id])
+        # Event ids count per stream
+        self.assertEqual([event['data'] for event in doctor_stream.events], [week_stream.events[1]['data']])
+        self.assertEqual(other_stream.events, [])
+        self.assertGreaterEqual(other_stream.comments, 1)
+        # Disconnected clients are unsubscribed
+        self.assertEqual(hub.subscriptions, set())
+
+    def test_stream_errors(self):
+        token = AccessToken.for_user(self.user)
+        # Streams are only served under ASGI
+        response = self.client.get('/api/async/events/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 501)
+        response = self.client.get('/api/async/events/', headers={
+            'Authorization': f"Bearer {AccessToken.for_user(User.objects.create(username='reception'))}"
+        })
+        self.assertEqual(response.status_code, 403)
+
+        application = ASGIHandler()
+        streams = {
+            'no_token': self.open_stream(application, headers=[]),
+            'bad_week': self.open_stream(application, week='abc'),
+            'query_token': self.open_stream(application, headers=[], access_token=str(token), week=self.week),
+        }
+
+        async def scenario():
+            for stream in streams.values():
+                task = asyncio.create_task(stream.run())
+                await stream.connected.wait()
+                stream.close()
+                await task
+
+        self.run_streams(scenario)
+        self.assertEqual(
+            {name: stream.status for name, stream in streams.items()},
+            {'no_token': 401, 'bad_week': 400, 'query_token': 200},
+        )
+
+    def test_hub_filters_and_drops_slow_clients(self):
+        async def scenario():
+            events = EventHub(max_queued=2)
+            week = events.subscribe(weeks=[(10, 2026)])
+            doctor = events.subscribe(doctors=[1])
+            everyone = events.subscribe()
+            events.publish(make_event('appointment', 'upsert', [1], [(10, 2026)], [2]))
+            # Without doctors, as when a shift's times change
+            events.publish(make_event('shift', 'upsert', [5], [(11, 2026)]))
+            self.assertEqual([week.queue.qsize(), doctor.queue.qsize(), everyone.queue.qsize()], [1, 1, 2])
+
+            events.publish(make_event('appointment', 'delete', [2], [(10, 2026)], [1]))
+            self.assertEqual([week.queue.qsize(), doctor.queue.qsize()], [2, 2])
+            self.assertTrue(everyone.dropped)
+            self.assertNotIn(everyone, events.subscriptions)
+            self.assertEqual(events.stats, {'published': 3, 'delivered': 6, 'dropped': 1})
+            return [chunk async for chunk in stream_events(everyone)]
+
+        chunks = async_to_sync(scenario)()
+        self.assertEqual(chunks, ['retry: 3000\n: connected\n\n', 'event: dropped\ndata: {"reason":"too slow"}\n\n'])
+
+    def test_publish_from_another_thread(self):
+        async def scenario():
+            events = EventHub()
+            subscription = events.subscribe()
+            stream = stream_events(subscription, heartbeat=0.01)
+            chunks = [await anext(stream), await anext(stream)]
+            publisher = threading.Thread(target=events.publish, args=[make_event('shift', 'delete', [7], [(10, 2026)])])
+            publisher.start()
+            publisher.join()
+            chunk = await anext(stream)
+            while chunk == ': keep-alive\n\n':
+                chunk = await anext(stream)
+            await stream.aclose()
+            self.assertEqual(events.subscriptions, set())
+            return chunks + [chunk]
+
+        chunks = async_to_sync(scenario)()
+        self.assertEqual(chunks[1], ': keep-alive\n\n')
+        self.assertEqual(
+            chunks[2],
+            'event: shift\ndata: {"type":"shift","action":"delete","ids":[7],"weeks":[[10,2026]],"doctors":[]}\n\n',
+        )
+
+    @override_settings(CLINIC_EVENT_BROKER={'BACKEND': 'backend.clinic.tests.RecordingBroker'})
+    def test_events_of_bulk_changes(self):
+        broker = get_broker()
+        self.assertIsInstance(broker, RecordingBroker)
+        with self.captureOnCommitCallbacks(execute=True):
+            ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        shift_ids = sorted(Shift.objects.values_list('id', flat=True))
+        self.assertEqual(broker.published[-1], make_event('shift', 'upsert', shift_ids, [(self.week, self.year)]))
+
+        appointment = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        self.create_appointment(self.doctors[0], self.local_datetime(8, 9))
+        doctor_id = self.doctors[0].id
+        doctor_shifts = sorted(self.doctors[0].shifts.values_list('id', flat=True))
+        self.assertTrue(doctor_shifts)
+        broker.published.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctors[0].delete()
+        # One event for all of the doctor's appointments rather than one each
+        self.assertEqual(broker.published, [
+            make_event(
+                'appointment', 'delete', weeks=[(self.week, self.year), (self.week + 1, self.year)],
+                doctors=[doctor_id],
+            ),
+            make_event('shift', 'upsert', doctor_shifts, [(self.week, self.year)], [doctor_id]),
+        ])
+        self.assertNotIn(appointment.id, broker.published[0]['ids'])
+
+    def test_redis_broker_needs_redis(self):
+        with mock.patch.dict(sys.modules, {'redis': None}):
+            with self.assertRaises(ImproperlyConfigured):
+                RedisBroker(hub)
+
+
+class AuditTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        for shift in Shift.objects.all():
+            shift.doctors.clear()
+        # The first doctor works all Monday, the second Tuesday morning
+        self.shift(0, 'first').doctors.set([self.doctors[0]])
+        self.shift(0, 'second').doctors.set([self.doctors[0]])
+        self.shift(1, 'first').doctors.set([self.doctors[1]])
+
+    def shift(self, day_of_week, shift_type):
+        return Shift.objects.get(year=self.year, week_of_year=self.week, day_of_week=day_of_week, shift_type=shift_type)
+
+    def test_report(self):
+        # Across the change of shift, covered by both
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 12, 30), duration=60)
+        late = self.create_appointment(self.doctors[0], self.local_datetime(0, 20, 30))
+        off_day = self.create_appointment(self.doctors[1], self.local_datetime(0, 9))
+        first = self.create_appointment(self.doctors[1], self.local_datetime(1, 9), duration=60)
+        second = self.create_appointment(self.doctors[1], self.local_datetime(1, 9, 30))
+        into_afternoon = self.create_appointment(self.doctors[1], self.local_datetime(1, 12, 45))
+        next_week = self.create_appointment(self.doctors[0], self.local_datetime(7, 9))
+
+        params = {'start_date': self.week_start, 'end_date': self.week_start + timedelta(days=7)}
+        # Shifts, assignments and appointments
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/audit/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['counts'], {'outside_shift': 4, 'overlap': 1, 'understaffed': 8})
+        self.assertFalse(data['truncated'])
+        understaffed = [finding for finding in data['findings'] if finding['kind'] == 'understaffed']
+        self.assertEqual(understaffed[0], {
+            'kind': 'understaffed',
+            'shift_id': self.shift(1, 'second').id,
+            'date': (self.week_start + timedelta(days=1)).isoformat(),
+            'shift_type': 'second',
+            'doctors': 0,
+            'required': 1,
+        })
+        appointments = [
+            (finding['kind'], finding['appointment_id']) for finding in data['findings'] if finding['kind'] != 'understaffed'
+        ]
+        self.assertEqual(appointments, [
+            ('outside_shift', late.id), ('outside_shift', next_week.id),
+            ('outside_shift', off_day.id), ('overlap', second.id), ('outside_shift', into_afternoon.id),
+        ])
+        overlap = data['findings'][8 + 3]
+        self.assertEqual(overlap['other_appointment_id'], first.id)
+        self.assertEqual(
+            (overlap['start_datetime'], overlap['end_datetime']),
+            (self.local_datetime(1, 9, 30).isoformat(), self.local_datetime(1, 10).isoformat()),
+        )
+
+        response = self.client.get('/api/audit/', {**params, 'doctor': self.doctors[1].id, 'limit': 1})
+        self.assertEqual(response.data['counts'], {'outside_shift': 2, 'overlap': 1, 'understaffed': 0})
+        self.assertTrue(response.data['truncated'])
+        self.assertEqual(len(response.data['findings']), 1)
+
+        with override_settings(CLINIC_MIN_SHIFT_DOCTORS=0):
+            self.assertEqual(self.client.get('/api/audit/', params).data['counts']['understaffed'], 0)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/audit/', {'start_date': self.week_start}).status_code, 400)
+        params = {'start_date': self.week_start, 'end_date': self.week_start + timedelta(days=400)}
+        self.assertEqual(self.client.get('/api/audit/', params).status_code, 400)
+        params['end_date'] = self.week_start
+        self.assertEqual(self.client.get('/api/audit/', {**params, 'limit': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/audit/', {**params, 'limit': 10 ** 6}).status_code, 400)
+        self.client.force_authenticate(user=User.objects.create(username='reception'))
+        self.assertEqual(self.client.get('/api/audit/', params).status_code, 403)
+
+    def test_sweep_matches_pairwise_check(self):
+        doctors = self.doctors + self.create_doctors(2)
+        weeks = [(self.week, self.year), (self.week + 1, self.year)]
+        ShiftRotationManager.generate_shifts(weeks)
+        rng = random.Random(7)
+        appointments = []
+        for _ in range(200):
+            start = self.local_datetime(rng.randrange(14), rng.randrange(7, 21), rng.choice([0, 15, 30, 45]))
+            appointments.append(self.create_appointment(rng.choice(doctors), start, duration=rng.choice([15, 30, 60, 90])))
+
+        blocks = {}
+        for shift in Shift.objects.filter(ShiftRotationManager.weeks_filter(weeks)).prefetch_related('doctors'):
+            day = ShiftRotationManager.get_week_start_date(shift.week_of_year, shift.year) + timedelta(days=shift.day_of_week)
+            start, end = (timezone.make_aware(datetime.combine(day, value)) for value in (shift.start_time, shift.end_time))
+            for doctor in shift.doctors.all():
+                blocks.setdefault(doctor.id, []).append((start, end))
+
+        def covered(appointment):
+            # Extend through back-to-back shifts
+            start, end = appointment.start_datetime, appointment.end_datetime
+            for block_start, block_end in sorted(blocks.get(appointment.doctor_id, [])):
+                if block_start <= start < block_end:
+                    start = block_end
+                if start >= end:
+                    return True
+            return False
+
+        ordered = sorted(appointments, key=lambda appointment: (appointment.start_datetime, appointment.id))
+        expected = {('outside_shift', appointment.id) for appointment in appointments if not covered(appointment)}
+        expected |= {
+            ('overlap', later.id)
+            for i, later in enumerate(ordered)
+            if any(earlier.doctor_id == later.doctor_id and earlier.end_datetime > later.start_datetime for earlier in ordered[:i])
+        }
+        found = {
+            (finding['kind'], finding['appointment_id'])
+            for finding in iter_findings(self.week_start, self.week_start + timedelta(days=13))
+            if finding['kind'] != 'understaffed'
+        }
+        self.assertEqual(found, expected)
+        self.assertTrue(any(kind == 'overlap' for kind, _ in found))
+
+    def test_command(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        start, end = str(self.week_start), str(self.week_start)
+        call_command('audit_schedule', start, end, stdout=StringIO())
+
+        late = self.create_appointment(self.doctors[0], self.local_datetime(0, 21))
+        stdout = StringIO()
+        with NamedTemporaryFile('w+', suffix='.ndjson') as output:
+            with self.assertRaisesMessage(CommandError, '1 findings'):
+                call_command('audit_schedule', start, end, output=output.name, stdout=stdout)
+            findings = [json.loads(line) for line in output]
+        self.assertEqual([finding['appointment_id'] for finding in findings], [late.id])
+        self.assertIn(f'appointment {late.id}', stdout.getvalue())
+
+        # The whole week, where most shifts have nobody
+        with self.assertRaisesMessage(CommandError, '8 understaffed'):
+            call_command('audit_schedule', start, str(self.week_start + timedelta(days=6)), stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('audit_schedule', end, '2000-01-01', stdout=StringIO())
+
+
+class AvailabilityTests(ClinicTestCase):
+    def test_run_starts(self):
+        free = interval_mask(60, 120) | interval_mask(200, 215)
+        self.assertEqual(list(iter_bits(run_starts(free, 45))), list(range(60, 76)))
+        self.assertEqual(list(iter_bits(run_starts(free, 15))), list(range(60, 106)) + [200])
+        self.assertEqual(run_starts(free, 61), 0)
+
+    def test_free_slots_skip_booked_time(self):
+        doctor = self.create_doctors(1)[0]
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        self.create_appointment(doctor, self.local_datetime(0, 8, 30), duration=60)
+        self.create_appointment(doctor, self.local_datetime(0, 10))
+
+        availability = AvailabilityMap.load(self.week_start, self.week_start)
+        slots = availability.free_slots(doctor.id, self.week_start, 60, step=30)
+        starts = [format_minute(start) for start, end in slots]
+        # First shift 08:00-13:00 joins the second shift 13:00-20:00
+        self.assertEqual(starts[:4], ['10:30', '11:00', '11:30', '12:00'])
+        self.assertEqual(starts[-1], '19:00')
+        self.assertNotIn('09:00', starts)
+
+    def test_grid_cache_is_bounded(self):
+        doctor = self.create_doctors(1)[0]
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        availability = AvailabilityMap.load(self.week_start, self.week_start)
+        for step in range(1, 3 * GRID_CACHE_SIZE):
+            availability.free_slots(doctor.id, self.week_start, 30, step=step)
+        self.assertEqual(grid_mask.cache_info().currsize, GRID_CACHE_SIZE)
+        self.assertEqual(availability.free_slots(doctor.id, self.week_start, 30, step=10_000), [])
+
+    def test_sunday_has_no_slots(self):
+        doctor = self.create_doctors(1)[0]
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        sunday = self.week_start + timedelta(days=6)
+        self.assertEqual(AvailabilityMap.load(sunday, sunday).free_slots(doctor.id, sunday, 30), [])
+
+    def test_endpoint_query_count_is_constant(self):
+        url = (
+            f'/api/availability/?start_date={self.week_start}'
+            f'&end_date={self.week_start + timedelta(days=13)}&duration=30'
+        )
+        # Shifts, shift doctors, appointments and doctor names
+        self.create_week(doctor_count=1, appointments_per_day=2)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+        self.create_week(doctor_count=4, appointments_per_day=12)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['doctors']), 5)
+        monday = response.data['doctors'][0]['days'][str(self.week_start)]
+        self.assertEqual(monday[0], {'start_time': '08:30', 'end_time': '09:00'})
+
+    def test_endpoint_with_service_and_doctor_filter(self):
+        doctors = self.create_doctors(2)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        response = self.client.get(
+            f'/api/availability/?start_date={self.week_start}&service={self.service.id}&doctor={doctors[1].id}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['duration_minutes'], 30)
+        self.assertEqual([doctor['id'] for doctor in response.data['doctors']], [doctors[1].id])
+
+    def test_endpoint_validation(self):
+        self.assertEqual(self.client.get('/api/availability/').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/availability/?start_date={self.week_start}').status_code, 400)
+        response = self.client.get(
+            f'/api/availability/?start_date={self.week_start}&end_date={self.week_start + timedelta(days=60)}&duration=30'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class EarliestSlotTests(ClinicTestCase):
+    def test_find_gaps(self):
+        windows = [(480, 780), (780, 1200)]
+        busy = [(480, 540), (560, 600)]
+        self.assertEqual(find_gaps(merge_intervals(windows), busy, 30, 15, limit=3), [600, 615, 630])
+        self.assertEqual(find_gaps([(480, 780)], busy, 20, 10, limit=2), [540, 600])
+        self.assertEqual(find_gaps([(480, 780)], busy, 30, 15, not_before=700), [705, 720, 735, 750])
+
+    def test_earliest_slots_across_doctors(self):
+        doctors = self.create_doctors(2)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        # Both on Monday morning, overriding the rotation
+        Shift.objects.get(year=self.year, week_of_year=self.week, day_of_week=0, shift_type='first').doctors.set(doctors)
+        self.create_appointment(doctors[0], self.local_datetime(0, 8), duration=120)
+        self.create_appointment(doctors[1], self.local_datetime(0, 8), duration=60)
+
+        response = self.client.get('/api/availability/earliest/', {
+            'duration': 60, 'after': self.local_datetime(0, 7).isoformat(), 'limit': 3, 'step': 30,
+        })
+        self.assertEqual(response.status_code, 200)
+        slots = [(slot['doctor_id'], slot['start_datetime']) for slot in response.data['slots']]
+        self.assertEqual(slots, [
+            (doctors[1].id, self.local_datetime(0, 9).isoformat()),
+            (doctors[1].id, self.local_datetime(0, 9, 30).isoformat()),
+            (doctors[0].id, self.local_datetime(0, 10).isoformat()),
+        ])
+
+    def test_earliest_slots_respect_time_window_and_doctor(self):
+        doctors = self.create_doctors(2)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        response = self.client.get('/api/availability/earliest/', {
+            'service': self.service.id, 'doctor': doctors[1].id, 'limit': 1,
+            'after': self.local_datetime(0, 19, 45).isoformat(), 'from_time': '16:00', 'to_time': '18:00',
+        })
+        self.assertEqual(response.data['slots'], [{
+            'doctor_id': doctors[1].id,
+            'doctor_name': doctors[1].full_name,
+            'start_datetime': self.local_datetime(1, 16).isoformat(),
+            'end_datetime': self.local_datetime(1, 16, 30).isoformat(),
+        }])
+
+    def test_search_skips_fully_booked_weeks_and_stops_early(self):
+        doctor = self.create_doctors(1)[0]
+        weeks = list(ShiftRotationManager.iter_weeks(self.week, self.year, self.week + 7, self.year))
+        ShiftRotationManager.generate_shifts(weeks)
+
+        # Book every shift minute of the first four weeks
+        appointments = []
+        for day in range(4 * 7):
+            if day % 7 == 6:
+                continue
+            end_hour = 13 if day % 7 == 5 else 20
+            for hour in range(8, end_hour):
+                appointment = Appointment(
+                    doctor=doctor, service=self.service, patient_first_name='Ana',
+                    patient_last_name='Petrovska', patient_phone_number='070123456',
+                    price=self.service.price, duration_minutes=60,
+                    start_datetime=self.local_datetime(day, hour),
+                    end_datetime=self.local_datetime(day, hour) + timedelta(hours=1),
+                )
+                appointment.populate_derived_fields()
+                appointments.append(appointment)
+        Appointment.objects.bulk_create(appointments)
+
+        # Shift doctors and appointments for each of the rounds of one, two
+        # and four weeks, plus the doctor names
+        with self.assertNumQueries(3 * 2 + 1):
+            response = self.client.get('/api/availability/earliest/', {
+                'duration': 30, 'limit': 2, 'after': self.local_datetime(0, 0).isoformat(),
+            })
+        self.assertEqual(
+            [slot['start_datetime'] for slot in response.data['slots']],
+            [self.local_datetime(28, 8).isoformat(), self.local_datetime(28, 8, 15).isoformat()]
+        )
+
+
+class KeysetPaginationTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+        # Pairs of appointments share a start time to exercise the id tiebreak
+        for i in range(9):
+            self.create_appointment(self.doctors[i % 2], self.local_datetime(i // 2, 9))
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(appointment['id'] for appointment in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_pages_cover_all_rows_in_order(self):
+        expected = list(Appointment.objects.order_by('start_datetime', 'id').values_list('id', flat=True))
+        self.assertEqual(self.collect('/api/appointments/?page_size=2'), expected)
+
+    def test_deep_pages_do_not_use_offset(self):
+        response = self.client.get('/api/appointments/?page_size=4')
+        with self.assertNumQueries(1) as context:
+            self.client.get(response.data['next'])
+        self.assertNotIn('OFFSET', context.captured_queries[0]['sql'])
+
+    def test_inserts_do_not_shift_pages(self):
+        first = self.client.get('/api/appointments/?page_size=4').data
+        # A row sorting before the cursor must not appear on later pages
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 7))
+        rest = self.collect(first['next'])
+        seen = [appointment['id'] for appointment in first['results']] + rest
+        self.assertEqual(len(seen), 9)
+        self.assertEqual(len(set(seen)), 9)
+
+    def test_previous_link(self):
+        first = self.client.get('/api/appointments/?page_size=4').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_date_bounded_queries_are_unpaginated(self):
+        response = self.client.get('/api/appointments/', {
+            'start_date': str(self.week_start), 'end_date': str(self.week_start + timedelta(days=1)),
+        })
+        self.assertEqual(len(response.data), 4)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/appointments/?cursor=bogus').status_code, 404)
+
+    def test_shift_list(self):
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week + 1, self.year)
+        self.assertEqual(len(self.client.get(f'/api/shifts/?week={self.week}').data), 11)
+        response = self.client.get('/api/shifts/?page_size=20')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(len(self.client.get(response.data['next']).data['results']), 2)
+
+
+class PatientSearchTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = self.create_doctors(1)[0]
+        self.create_appointment(self.doctor, self.local_datetime(0, 9), patient_first_name='Ana', patient_last_name='Petrovska')
+        self.create_appointment(self.doctor, self.local_datetime(1, 9), patient_first_name='Ána', patient_last_name='Petrovska')
+        self.create_appointment(self.doctor, self.local_datetime(2, 9), patient_first_name='Petar', patient_last_name='Stojanov',
+                                patient_phone_number='+389 (71) 555-010')
+        self.create_appointment(self.doctor, self.local_datetime(3, 9), patient_first_name='Marija', patient_last_name='Anastasova')
+
+    def search(self, query):
+        response = self.client.get('/api/appointments/', {'patient_name': query})
+        self.assertEqual(response.status_code, 200)
+        return [(a['patient_first_name'], a['patient_last_name']) for a in response.data['results']]
+
+    def test_normalization(self):
+        self.assertEqual(normalize_name('  ÁNA   Petrovska '), 'ana petrovska')
+        self.assertEqual(normalize_phone('+389 (71) 555-010'), '38971555010')
+
+    def test_prefix_search_is_accent_insensitive_and_ranked_by_recency(self):
+        self.assertEqual(self.search('ana'), [
+            ('Marija', 'Anastasova'), ('Ána', 'Petrovska'), ('Ana', 'Petrovska'),
+        ])
+        self.assertEqual(self.search('PET'), [
+            ('Petar', 'Stojanov'), ('Ána', 'Petrovska'), ('Ana', 'Petrovska'),
+        ])
+        self.assertEqual(self.search('ana petr'), [('Ána', 'Petrovska'), ('Ana', 'Petrovska')])
+        self.assertEqual(self.search('petrovska an'), [('Ána', 'Petrovska'), ('Ana', 'Petrovska')])
+
+    def test_phone_search_uses_digits(self):
+        self.assertEqual(self.search('389 71'), [('Petar', 'Stojanov')])
+        self.assertEqual(self.search('070-123'), [('Marija', 'Anastasova'), ('Ána', 'Petrovska'), ('Ana', 'Petrovska')])
+
+    def test_search_fields_follow_updates(self):
+        appointment = Appointment.objects.get(patient_first_name='Marija')
+        appointment.patient_last_name = 'Zlatanovska'
+        appointment.save(update_fields=['patient_last_name'])
+        self.assertEqual(self.search('zlat'), [('Marija', 'Zlatanovska')])
+
+    def test_search_uses_indexes(self):
+        plan = Appointment.objects.filter(patient_search_filter('ana')).explain()
+        self.assertIn('appointment_first_name_idx', plan)
+        self.assertIn('appointment_last_name_idx', plan)
+        plan = Appointment.objects.filter(patient_search_filter('07012')).explain()
+        self.assertIn('appointment_phone_idx', plan)
+
+    def test_patients_endpoint(self):
+        response = self.client.get('/api/appointments/patients/', {'q': 'petrovska'})
+        self.assertEqual([
+            (patient['patient_first_name'], patient['appointment_count']) for patient in response.data
+        ], [('Ána', 1), ('Ana', 1)])
+        self.assertEqual(response.data[0]['last_appointment'], self.local_datetime(1, 9).isoformat())
+
+
+@skipUnless(os.environ.get('CLINIC_BENCHMARKS'), 'set CLINIC_BENCHMARKS=1 to run benchmarks')
+class PatientSearchBenchmark(ClinicTestCase):
+    rows = 500_000
+
+    def test_search_at_scale(self):
+        doctor = self.create_doctors(1)[0]
+        first_names = ['Ana', 'Marija', 'Elena', 'Petar', 'Nikola', 'Stefan', 'Ivana', 'Goran']
+        start = self.local_datetime(0, 8)
+        batch = []
+        for i in range(self.rows):
+            appointment = Appointment(
+                doctor=doctor, price=Decimal('75.00'), duration_minutes=30,
+                patient_first_name=first_names[i % len(first_names)],
+                patient_last_name=f'Patient{i:06d}', patient_phone_number=f'07{i:07d}',
+                start_datetime=start + timedelta(minutes=30 * i),
+                end_datetime=start + timedelta(minutes=30 * i + 30),
+            )
+            appointment.populate_derived_fields()
+            batch.append(appointment)
+            if len(batch) == 10_000:
+                Appointment.objects.bulk_create(batch)
+                batch = []
+
+        def timed(queryset, repeat=20):
+            began = perf_counter()
+            for _ in range(repeat):
+                list(queryset[:50])
+            return (perf_counter() - began) / repeat * 1000
+
+        for query in ['patient12345', '0701234']:
+            scan = Appointment.objects.filter(
+                Q(patient_first_name__icontains=query) | Q(patient_last_name__icontains=query) |
+                Q(patient_phone_number__icontains=query)
+            ).order_by('-start_datetime')
+            indexed = Appointment.objects.filter(patient_search_filter(query)).order_by('-start_datetime')
+            print(f'\n{self.rows} rows, {query!r}: icontains {timed(scan):.2f} ms, indexed {timed(indexed):.2f} ms')
+
+
+class CalendarCacheTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = self.create_week(doctor_count=2, appointments_per_day=2)[0]
+        self.url = f'/api/calendar/?week={self.week}'
+        self.next_url = f'/api/calendar/?week={self.week + 1}'
+
+    def assert_cached(self, url, cached=True):
+        # The next week has no shifts, so no shift doctors query
+        queries = 3 if url == self.url else 2
+        with self.assertNumQueries(0 if cached else queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_repeated_requests_hit_the_cache(self):
+        first = self.assert_cached(self.url, cached=False)
+        second = self.assert_cached(self.url)
+        self.assertEqual(first, second)
+        stats = self.client.get('/api/calendar/cache_stats/').data
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+
+    def test_appointment_changes_only_invalidate_their_weeks(self):
+        self.assert_cached(self.url, cached=False)
+        self.assert_cached(self.next_url, cached=False)
+
+        appointment = self.create_appointment(self.doctor, self.local_datetime(2, 15))
+        data = self.assert_cached(self.url, cached=False)
+        self.assertEqual(len(data['Wednesday']['appointments']), 3)
+        self.assert_cached(self.next_url)
+
+        # Moving it to the next week drops both weeks
+        appointment.start_datetime = self.local_datetime(8, 15)
+        appointment.save()
+        self.assertEqual(len(self.assert_cached(self.url, cached=False)['Wednesday']['appointments']), 2)
+        self.assertEqual(len(self.assert_cached(self.next_url, cached=False)['Tuesday']['appointments']), 1)
+
+        appointment.delete()
+        self.assert_cached(self.url)
+        self.assertEqual(self.assert_cached(self.next_url, cached=False)['Tuesday']['appointments'], [])
+
+    def test_shift_and_doctor_changes_invalidate(self):
+        self.assert_cached(self.url, cached=False)
+        shift = self.doctor.shifts.get(year=self.year, week_of_year=self.week, day_of_week=0)
+        shift.doctors.remove(self.doctor)
+        data = self.assert_cached(self.url, cached=False)
+        self.assertEqual(data['Monday']['shifts'][shift.shift_type]['doctors'], [])
+
+        self.doctor.shifts.add(shift)
+        self.assert_cached(self.url, cached=False)
+
+        self.doctor.full_name = 'Dr. Renamed'
+        self.doctor.save()
+        data = self.assert_cached(self.url, cached=False)
+        self.assertEqual(data['Monday']['appointments'][0]['doctor_name'], 'Dr. Renamed')
+
+        self.service.name = 'Checkup'
+        self.service.save()
+        self.assertEqual(self.assert_cached(self.url, cached=False)['Monday']['appointments'][0]['service_name'], 'Checkup')
+
+    def test_bulk_shift_generation_invalidates(self):
+        self.assert_cached(self.url, cached=False)
+        self.assert_cached(self.next_url, cached=False)
+        self.create_doctors(1)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        monday = self.assert_cached(self.url, cached=False)['Monday']['shifts']
+        self.assertEqual(len(monday['first']['doctors']) + len(monday['second']['doctors']), 3)
+        self.assert_cached(self.next_url)
+
+
+class BulkAppointmentTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+
+    def item(self, doctor, day, hour, minute=0, **kwargs):
+        data = {
+            'patient_first_name': 'Marko',
+            'patient_last_name': 'Stojanov',
+            'patient_phone_number': '071 222 333',
+            'doctor_id': doctor.id,
+            'service_id': self.service.id,
+            'price': str(self.service.price),
+            'duration_minutes': self.service.duration_minutes,
+            'start_datetime': self.local_datetime(day, hour, minute).isoformat(),
+        }
+        data.update(kwargs)
+        return data
+
+    def post(self, items, mode=None):
+        data = {'appointments': items}
+        if mode:
+            data['mode'] = mode
+        return self.client.post('/api/appointments/bulk/', data, format='json')
+
+    def test_find_interval_conflicts(self):
+        existing = [(0, 10), (20, 60), (30, 40)]
+        candidates = [('a', 10, 20), ('b', 45, 50), ('c', 60, 70), ('d', 65, 80), ('e', 62, 64)]
+        # The later-starting one of two overlapping candidates is rejected
+        self.assertEqual(find_interval_conflicts(existing, candidates), {'b': None, 'e': 'c', 'd': 'c'})
+        self.assertEqual(find_interval_conflicts([], [('a', 0, 10), ('b', 10, 20)]), {})
+
+    def test_bulk_create_and_update(self):
+        existing = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        items = [self.item(self.doctors[i % 2], i // 2, 10) for i in range(10)]
+        items.append(self.item(self.doctors[0], 0, 11, id=existing.id, patient_first_name='Ána'))
+
+        response = self.post(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 10)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(Appointment.objects.count(), 11)
+
+        existing.refresh_from_db()
+        self.assertEqual(existing.start_datetime, self.local_datetime(0, 11))
+        self.assertEqual(existing.end_datetime, self.local_datetime(0, 11, 30))
+        self.assertEqual(existing.patient_first_name_search, 'ana')
+        created = Appointment.objects.get(id=response.data['results'][0]['id'])
+        self.assertEqual(created.end_datetime, self.local_datetime(0, 10, 30))
+        self.assertEqual(created.start_date, self.week_start)
+        self.assertEqual(created.patient_phone_digits, '071222333')
+
+    def test_query_count_does_not_grow_with_items(self):
+        def queries_for(count):
+            items = [self.item(self.doctors[i % 2], count % 7, 8 + i // 2) for i in range(count)]
+            # Doctors, services, savepoint, one lock and one range query per
+            # doctor, the insert, the daily stats rebuild (an aggregate, two
+            # deletes and two inserts), the change log insert and the release
+            with self.assertNumQueries(15):
+                response = self.post(items)
+            self.assertEqual(response.data['created'], count)
+
+        queries_for(4)
+        self.assertEqual(Appointment.objects.count(), 4)
+        queries_for(20)
+
+    def test_atomic_rejects_whole_batch(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 10))
+        items = [
+            self.item(self.doctors[0], 0, 9),
+            self.item(self.doctors[0], 0, 10, 15),
+            self.item(self.doctors[1], 0, 10),
+            self.item(self.doctors[1], 0, 10, 15),
+            self.item(self.doctors[1], 0, 12, doctor_id=9999),
+        ]
+        response = self.post(items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['skipped', 'error', 'skipped', 'error', 'error'])
+        self.assertEqual(
+            response.data['results'][1]['errors'],
+            {'non_field_errors': ['This appointment conflicts with an existing appointment']}
+        )
+        self.assertEqual(
+            response.data['results'][3]['errors'],
+            {'non_field_errors': ['This appointment conflicts with item 2']}
+        )
+        self.assertIn('doctor_id', response.data['results'][4]['errors'])
+
+    def test_best_effort_saves_valid_items(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 10))
+        items = [
+            self.item(self.doctors[0], 0, 9),
+            self.item(self.doctors[0], 0, 10, 15),
+            self.item(self.doctors[0], 0, 9, 15),
+            self.item(self.doctors[1], 0, 10),
+        ]
+        response = self.post(items, mode='best_effort')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual(Appointment.objects.count(), 3)
+
+    def test_updates_may_swap_times(self):
+        first = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        second = self.create_appointment(self.doctors[0], self.local_datetime(0, 9, 30))
+        response = self.post([
+            self.item(self.doctors[0], 0, 9, 30, id=first.id),
+            self.item(self.doctors[0], 0, 9, id=second.id),
+        ])
+        self.assertEqual(response.status_code, 200)
+        first.refresh_from_db()
+        self.assertEqual(first.start_datetime, self.local_datetime(0, 9, 30))
+
+    def test_duplicate_ids_are_rejected(self):
+        existing = self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        items = [
+            self.item(self.doctors[0], 0, 11, id=existing.id),
+            self.item(self.doctors[0], 1, 11, id=existing.id, patient_first_name='Ana'),
+        ]
+        response = self.post(items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.data['results']], ['skipped', 'error'])
+        self.assertEqual(response.data['results'][1]['errors'], {'id': ['Duplicate id in request']})
+
+        # Best effort saves the first item only
+        response = self.post(items, mode='best_effort')
+        self.assertEqual([result['status'] for result in response.data['results']], ['updated', 'error'])
+        existing.refresh_from_db()
+        self.assertEqual(existing.start_datetime, self.local_datetime(0, 11))
+        self.assertEqual(existing.patient_first_name, 'Marko')
+
+    def test_invalidates_calendar_cache(self):
+        self.client.get(f'/api/calendar/?week={self.week}')
+        self.post([self.item(self.doctors[0], 1, 9)])
+        data = self.client.get(f'/api/calendar/?week={self.week}').data
+        self.assertEqual(len(data['Tuesday']['appointments']), 1)
+
+    def test_rejects_invalid_requests(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([self.item(self.doctors[0], 0, 9)], mode='partial').status_code, 400)
+        self.assertEqual(self.post([{}] * 501).status_code, 400)
+
+        response = self.post([self.item(self.doctors[0], 0, 9, id=9999)])
+        self.assertEqual(response.data['results'][0]['errors'], {'id': ['Appointment not found']})
+
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.post([self.item(self.doctors[0], 0, 9)]).status_code, 403)
+
+
+class BookingTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = self.create_doctors(1)[0]
+
+    def test_overlap_check(self):
+        first = self.create_appointment(self.doctor, self.local_datetime(0, 9))
+        second = self.create_appointment(self.doctor, self.local_datetime(0, 9, 30))
+        self.create_appointment(self.create_doctors(1)[0], self.local_datetime(0, 9))
+        self.assertFalse(overlapping_appointments().exists())
+        self.create_appointment(self.doctor, self.local_datetime(0, 9, 15))
+        # Overlapping both, which are flagged for the later booking
+        self.assertEqual(list(overlapping_appointments().order_by('id')), [first, second])
+
+    def booking(self, hour, minute=0, **kwargs):
+        data = {
+            'patient_first_name': 'Elena',
+            'patient_last_name': 'Ristova',
+            'patient_phone_number': '072 111 222',
+            'doctor_id': self.doctor.id,
+            'service_id': self.service.id,
+            'price': '75.00',
+            'duration_minutes': 30,
+            'start_datetime': self.local_datetime(0, hour, minute).isoformat(),
+        }
+        data.update(kwargs)
+        return data
+
+    def test_create_checks_conflict_once(self):
+        self.create_appointment(self.doctor, self.local_datetime(0, 9))
+        # Doctor and service lookups, savepoint, lock, one conflict check,
+        # rollback and release
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/appointments/', self.booking(9, 15), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data, {'non_field_errors': ['This appointment conflicts with an existing appointment']}
+        )
+
+        response = self.client.post('/api/appointments/', self.booking(9, 30), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_update_checks_conflicts(self):
+        self.create_appointment(self.doctor, self.local_datetime(0, 9))
+        appointment = self.create_appointment(self.doctor, self.local_datetime(0, 10))
+        url = f'/api/appointments/{appointment.id}/'
+
+        response = self.client.put(url, self.booking(9, 15), format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Moving within its own slot does not conflict with itself
+        response = self.client.put(url, self.booking(10, 15), format='json')
+        self.assertEqual(response.status_code, 200)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.end_datetime, self.local_datetime(0, 10, 45))
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Concurrent overlapping bookings through the API from many threads"""
+    threads = 8
+    bookings_per_thread = 12
+
+    def setUp(self):
+        self.user = User.objects.create(username='staff', email='staff@example.com', is_staff=True)
+        self.service = Service.objects.create(
+            name='Regular Checkup', price=Decimal('75.00'), duration_minutes=30
+        )
+        self.doctors = [
+            Doctor.objects.create(full_name=f'Dr. Test {i}', phone_number=f'+389-70-{i:06d}')
+            for i in range(2)
+        ]
+        self.day_start = timezone.make_aware(datetime(timezone.now().year + 1, 3, 2, 8))
+
+    def book(self, thread, results, barrier):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        barrier.wait()
+        try:
+            for i in range(self.bookings_per_thread):
+                # Every thread walks the same 15 minute grid, so most
+                # requests overlap a booking made by another thread
+                slot = (thread + i) % self.bookings_per_thread
+                response = client.post('/api/appointments/', {
+                    'patient_first_name': f'Patient {thread}',
+                    'patient_last_name': f'Slot {slot}',
+                    'patient_phone_number': '070 000 000',
+                    'doctor_id': self.doctors[i % 2].id,
+                    'service_id': self.service.id,
+                    'price': '75.00',
+                    'duration_minutes': 30,
+                    'start_datetime': (self.day_start + timedelta(minutes=15 * slot)).isoformat(),
+                }, format='json')
+                results.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_no_double_bookings(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Needs a file database, shared-cache SQLite fails instead of waiting for locks')
+
+        results = []
+        barrier = threading.Barrier(self.threads)
+        workers = [
+            threading.Thread(target=self.book, args=(thread, results, barrier))
+            for thread in range(self.threads)
+        ]
+        started = perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = perf_counter() - started
+
+        attempts = self.threads * self.bookings_per_thread
+        self.assertEqual(len(results), attempts)
+        self.assertEqual(set(results) - {201, 400}, set())
+        self.assertEqual(results.count(201), Appointment.objects.count())
+        self.assertGreater(results.count(201), 0)
+
+        self.assertFalse(overlapping_appointments().exists())
+
+        if os.environ.get('CLINIC_BENCHMARKS'):
+            print(f'\n{attempts} concurrent bookings in {elapsed:.2f}s ({attempts / elapsed:.0f}/s), '
+                  f'{results.count(201)} booked')
+
+
+class FastSerializerTests(ClinicTestCase):
+    def create_mixed_appointments(self):
+        doctors = self.create_doctors(2)
+        doctors[1].profile_picture_url = 'https://example.com/ćirilica.png'
+        doctors[1].save()
+        self.create_appointment(doctors[0], self.local_datetime(0, 9))
+        self.create_appointment(
+            doctors[1], self.local_datetime(1, 0, 15), service=self.service,
+            patient_first_name='Ѓорѓи', patient_last_name='Жежовски', price=Decimal('1234.5')
+        )
+        appointment = self.create_appointment(doctors[0], self.local_datetime(2, 23, 45), duration=45)
+        appointment.service = None
+        appointment.custom_service_name = 'X-ray'
+        appointment.price = Decimal('12')
+        appointment.save()
+        # Across the switch to summer time and exactly on a UTC midnight
+        self.create_appointment(doctors[1], timezone.make_aware(datetime(self.year, 3, 29, 1, 30)))
+        self.create_appointment(doctors[0], datetime.fromisoformat(f'{self.year}-06-01T00:00:00+00:00'))
+
+    def assert_same_json(self, fast, slow):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast), renderer.render(slow))
+
+    def test_output_matches_drf_serializers(self):
+        self.create_mixed_appointments()
+        queryset = Appointment.objects.select_related('doctor', 'service')
+        rows = list(appointment_values(Appointment.objects.all()))
+        self.assertEqual(len(rows), 5)
+
+        self.assert_same_json(serialize_appointments(rows), AppointmentSerializer(queryset, many=True).data)
+        self.assert_same_json(
+            serialize_calendar_appointments(rows), CalendarAppointmentSerializer(queryset, many=True).data
+        )
+        self.assertNotIn('service_name', serialize_calendar_appointments(rows)[2])
+
+    def test_list_endpoint_matches_drf_serializer(self):
+        self.create_mixed_appointments()
+        expected = AppointmentSerializer(Appointment.objects.select_related('doctor', 'service'), many=True).data
+
+        response = self.client.get('/api/appointments/')
+        self.assert_same_json(response.data['results'], expected)
+        response = self.client.get('/api/appointments/?page_size=2')
+        self.assert_same_json(response.data['results'], expected[:2])
+        response = self.client.get(response.data['next'])
+        self.assert_same_json(response.data['results'], expected[2:4])
+
+
+@skipUnless(os.environ.get('CLINIC_BENCHMARKS'), 'Set CLINIC_BENCHMARKS=1 to run benchmarks')
+class FastSerializerBenchmark(ClinicTestCase):
+    def test_serializers_at_scale(self):
+        doctors = self.create_doctors(10)
+        start = self.local_datetime(0, 8)
+        appointments = []
+        for i in range(10_000):
+            appointment = Appointment(
+                doctor=doctors[i % 10], service=self.service if i % 4 else None,
+                custom_service_name=None if i % 4 else 'Custom', price=Decimal('75.00'),
+                duration_minutes=30, patient_first_name='Ana', patient_last_name=f'Patient{i}',
+                patient_phone_number=f'07{i:07d}', start_datetime=start + timedelta(minutes=30 * i),
+                end_datetime=start + timedelta(minutes=30 * i + 30),
+            )
+            appointment.populate_derived_fields()
+            appointments.append(appointment)
+        Appointment.objects.bulk_create(appointments, batch_size=1000)
+
+        def timed(build, repeat=3):
+            began = perf_counter()
+            for _ in range(repeat):
+                build()
+            return (perf_counter() - began) / repeat * 1000
+
+        for count in [1_000, 10_000]:
+            queryset = Appointment.objects.select_related('doctor', 'service')[:count]
+            rows = appointment_values(Appointment.objects.all())[:count]
+            for name, slow, fast in [
+                ('AppointmentSerializer', AppointmentSerializer, serialize_appointments),
+                ('CalendarAppointmentSerializer', CalendarAppointmentSerializer, serialize_calendar_appointments),
+            ]:
+                drf = timed(lambda: slow(list(queryset), many=True).data)
+                values = timed(lambda: fast(list(rows)))
+                print(f'\n{count} rows, {name}: DRF {drf:.1f} ms, values {values:.1f} ms ({drf / values:.1f}x)')
+
+
+class ExportTests(ClinicTestCase):
+    # Peak memory allowed while streaming an export, whatever its size
+    MAX_EXPORT_MEMORY = 8 * 1024 * 1024
+
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+
+    def bulk_create_appointments(self, count):
+        start = self.local_datetime(0, 8)
+        batch = []
+        for i in range(count):
+            appointment = Appointment(
+                doctor=self.doctors[i % 2], service=self.service, price=Decimal('75.00'),
+                duration_minutes=30, patient_first_name='Ana', patient_last_name=f'Patient{i}',
+                patient_phone_number=f'07{i:07d}', start_datetime=start + timedelta(minutes=15 * i),
+                end_datetime=start + timedelta(minutes=15 * i + 30),
+            )
+            appointment.populate_derived_fields()
+            batch.append(appointment)
+            if len(batch) == 10_000:
+                Appointment.objects.bulk_create(batch)
+                batch = []
+        Appointment.objects.bulk_create(batch)
+
+    def export_url(self, **params):
+        params.setdefault('start_date', self.week_start.isoformat())
+        params.setdefault('end_date', (self.week_start + timedelta(days=6)).isoformat())
+        return '/api/appointments/export/?' + '&'.join(f'{name}={value}' for name, value in params.items())
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9), patient_last_name='Трајковска, Д.')
+        custom = self.create_appointment(self.doctors[1], self.local_datetime(1, 10))
+        custom.service = None
+        custom.custom_service_name = 'Whitening'
+        custom.save()
+        self.create_appointment(self.doctors[0], self.local_datetime(7, 9))
+
+        response = self.client.get(self.export_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(StringIO(self.read(response))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['patient_last_name'], 'Трајковска, Д.')
+        self.assertEqual(rows[0]['price'], '75.00')
+        self.assertEqual(rows[0]['start_datetime'], self.local_datetime(0, 9).isoformat())
+        self.assertEqual(rows[0]['date'], self.week_start.isoformat())
+        self.assertEqual((rows[1]['service_id'], rows[1]['custom_service_name']), ('', 'Whitening'))
+
+    def test_ndjson_export_with_filters(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        self.create_appointment(self.doctors[1], self.local_datetime(0, 9))
+
+        response = self.client.get(self.export_url(export_format='ndjson', doctor=self.doctors[1].id))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['doctor_name'], self.doctors[1].full_name)
+        self.assertEqual(records[0]['service_name'], 'Regular Checkup')
+
+        response = self.client.get(self.export_url(service=self.service.id + 1))
+        self.assertEqual(self.read(response).count('\n'), 1)
+
+    def test_rejects_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/appointments/export/').status_code, 400)
+        self.assertEqual(self.client.get(self.export_url(export_format='xml')).status_code, 400)
+        self.assertEqual(self.client.get(self.export_url(doctor='x')).status_code, 400)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.export_url()).status_code, 403)
+
+    def test_command_matches_endpoint(self):
+        self.bulk_create_appointments(1200)
+        output = StringIO()
+        call_command(
+            'export_appointments', self.week_start.isoformat(), (self.week_start + timedelta(days=30)).isoformat(),
+            export_format='ndjson', stdout=output
+        )
+        response = self.client.get(self.export_url(
+            export_format='ndjson', end_date=(self.week_start + timedelta(days=30)).isoformat()
+        ))
+        self.assertEqual(output.getvalue(), self.read(response))
+        self.assertEqual(output.getvalue().count('\n'), 1200)
+
+    def assert_export_memory(self, rows):
+        self.bulk_create_appointments(rows)
+        # Appointments start every 15 minutes, 96 a day
+        end_date = self.week_start + timedelta(days=rows // 96 + 1)
+
+        tracemalloc.start()
+        try:
+            response = self.client.get(self.export_url(end_date=end_date.isoformat()))
+            lines = 0
+            for chunk in response.streaming_content:
+                lines += chunk.count(b'\n')
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, rows + 1)
+        self.assertLess(peak, self.MAX_EXPORT_MEMORY)
+        return peak
+
+    def test_export_memory_is_bounded(self):
+        # Several fetch chunks, the million row run below uses the same bound
+        self.assert_export_memory(5_000)
+
+    @skipUnless(os.environ.get('CLINIC_BENCHMARKS'), 'Set CLINIC_BENCHMARKS=1 to run benchmarks')
+    def test_million_row_export_memory_is_bounded(self):
+        began = perf_counter()
+        peak = self.assert_export_memory(1_000_000)
+        print(f'\n1000000 rows exported with a {peak / 1024 / 1024:.1f} MiB peak in {perf_counter() - began:.0f}s')
+
+
+class ImportTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_doctors(2)
+
+    def run_import(self, content, *args, **options):
+        """Run import_clinic_data on content written to a temporary file"""
+        suffix = options.pop('suffix', '.json')
+        encoding = options.pop('encoding', 'utf-8')
+        with NamedTemporaryFile('w', suffix=suffix, encoding=encoding, delete=False) as file:
+            file.write(content)
+        output = StringIO()
+        try:
+            call_command('import_clinic_data', file.name, *args, stdout=output, **options)
+        finally:
+            os.unlink(file.name)
+        return output.getvalue()
+
+    def appointment_record(self, doctor, day, hour, minute=0, **kwargs):
+        record = {
+            'patient_first_name': 'Ana',
+            'patient_last_name': 'Petrovska',
+            'patient_phone_number': '070 123 456',
+            'doctor_email': doctor.email,
+            'service_name': 'regular checkup',
+            'start_datetime': self.local_datetime(day, hour, minute).isoformat(),
+        }
+        record.update(kwargs)
+        return record
+
+    def test_streamed_json_matches_whole_parse(self):
+        values = [{'a': [1, 2, {'b': 'x]y,'}]}, 12345, 'text', None, {'c': 1.5}]
+        for text in [json.dumps(values), '\n'.join(json.dumps(value) for value in values) + '\n']:
+            with mock.patch.object(importer, 'READ_SIZE', 3):
+                self.assertEqual(list(importer.iter_json_values(StringIO(text))), values)
+        for broken in ['[{"a": 1}', '[{"a": 1} {"b": 2}]', '[1] 2', '{"a": ']:
+            with self.assertRaises(ValueError):
+                list(importer.iter_json_values(StringIO(broken)))
+
+    def test_imports_mixed_records(self):
+        records = [
+            {'model': 'doctor', 'full_name': 'Dr. Nova', 'phone_number': '071 000 000', 'email': 'nova@example.com'},
+            {'model': 'doctor', 'full_name': 'Dr. Again', 'phone_number': '1', 'email': self.doctors[0].email.upper()},
+            {'model': 'service', 'name': 'Implant', 'price': '900.00', 'duration_minutes': 120},
+            self.appointment_record(self.doctors[0], 0, 9),
+            self.appointment_record(self.doctors[0], 0, 10, doctor_email=None, doctor_name='dr. nova', service_name='Implant'),
+            self.appointment_record(self.doctors[1], 0, 9, service_name='', custom_service_name='Consult', price='20', duration_minutes=15),
+        ]
+        output = self.run_import(json.dumps(records))
+
+        self.assertIn('Doctors: 1 created, 1 already existed', output)
+        self.assertIn('Services: 1 created, 0 already existed', output)
+        self.assertIn('Appointments: 3 created', output)
+        implant = Appointment.objects.get(service__name='Implant')
+        self.assertEqual(implant.doctor.email, 'nova@example.com')
+        self.assertEqual(implant.end_datetime, self.local_datetime(0, 12))
+        custom = Appointment.objects.get(custom_service_name='Consult')
+        self.assertEqual((custom.price, custom.duration_minutes, custom.service), (Decimal('20'), 15, None))
+        self.assertEqual(custom.patient_phone_digits, '070123456')
+
+    def test_reports_invalid_and_conflicting_rows(self):
+        self.create_appointment(self.doctors[0], self.local_datetime(0, 9))
+        lines = [
+            self.appointment_record(self.doctors[0], 0, 9, 15),
+            self.appointment_record(self.doctors[1], 0, 9),
+            self.appointment_record(self.doctors[1], 0, 9, 10),
+            self.appointment_record(self.doctors[1], 1, 9, doctor_email='nobody@example.com'),
+            self.appointment_record(self.doctors[1], 1, 9, start_datetime='tomorrow'),
+            self.appointment_record(self.doctors[1], 1, 9, patient_first_name=''),
+            self.appointment_record(self.doctors[1], 2, 9),
+        ]
+        output = self.run_import('\n'.join(json.dumps(line) for line in lines), suffix='.ndjson')
+
+        self.assertIn('Appointments: 2 created', output)
+        self.assertIn('3 invalid, 2 conflicting', output)
+        self.assertIn('record 1: conflicts with an existing appointment', output)
+        self.assertIn('record 3: conflicts with record 2', output)
+        self.assertIn("record 4: Unknown or ambiguous doctor 'nobody@example.com'", output)
+        self.assertIn('record 6: patient_first_name: This field cannot be blank.', output)
+        self.assertEqual(Appointment.objects.count(), 3)
+
+    def test_dry_run_and_atomic_save_nothing(self):
+        records = [self.appointment_record(self.doctors[0], 0, 9), self.appointment_record(self.doctors[0], 0, 9)]
+        output = self.run_import(json.dumps(records[:1]), dry_run=True)
+        self.assertIn('Dry run checked 1 rows', output)
+        self.assertEqual(Appointment.objects.count(), 0)
+
+        with self.assertRaises(CommandError):
+            self.run_import(json.dumps(records), atomic=True)
+        self.assertEqual(Appointment.objects.count(), 0)
+
+    def test_batches_use_constant_queries(self):
+        records = [self.appointment_record(self.doctors[i % 2], i // 20, 8 + i % 20 // 2) for i in range(120)]
+        # Doctor and service maps, then per batch a savepoint, one lock and
+        # one range query per doctor, the insert, the daily stats rebuild,
+        # the change log insert and the release
+        with self.assertNumQueries(2 + 3 * 13):
+            report = importer.ClinicImporter(batch_size=50).run(enumerate(records))
+        self.assertEqual(report['created']['appointment'], 120)
+
+    def test_round_trips_csv_export_and_dumpdata(self):
+        for day in range(3):
+            self.create_appointment(self.doctors[day % 2], self.local_datetime(day, 9), patient_last_name='Ѓорѓиева')
+        start, end = self.week_start.isoformat(), (self.week_start + timedelta(days=6)).isoformat()
+        exported = StringIO()
+        call_command('export_appointments', start, end, stdout=exported)
+        fixture = StringIO()
+        call_command('dumpdata', 'clinic.doctor', 'clinic.service', 'clinic.appointment', stdout=fixture)
+
+        Appointment.objects.all().delete()
+        self.run_import(exported.getvalue(), suffix='.csv')
+        reimported = StringIO()
+        call_command('export_appointments', start, end, stdout=reimported)
+        # Only the ids differ
+        strip_ids = lambda text: [line.split(',', 1)[1] for line in text.splitlines()]
+        self.assertEqual(strip_ids(reimported.getvalue()), strip_ids(exported.getvalue()))
+
+        Appointment.objects.all().delete()
+        Doctor.objects.all().delete()
+        Service.objects.all().delete()
+        # PowerShell redirects write UTF-16
+        output = self.run_import(fixture.getvalue(), encoding='utf-16')
+        self.assertIn('Doctors: 2 created', output)
+        self.assertIn('Appointments: 3 created', output)
+        self.assertEqual(Appointment.objects.filter(patient_last_name='Ѓорѓиева').count(), 3)
+
+    def test_sample_data_commands(self):
+        call_command('seed_sample_data', stdout=StringIO())
+        call_command('seed_sample_data', stdout=StringIO())
+        self.assertEqual(Service.objects.filter(name='Root Canal').count(), 1)
+        self.assertEqual(Doctor.objects.filter(email='doctor1@example.com').count(), 1)
+
+
+class MetricsTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+
+    def scrape(self):
+        response = self.client.get('/api/_metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_records_requests_per_route(self):
+        self.create_week(doctor_count=2, appointments_per_day=2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/calendar/?week={self.week}')
+        # Read now, the next request clears the query log
+        calendar_queries = len(queries)
+        self.client.get('/api/services/')
+        self.client.get('/api/services/')
+        self.client.get('/api/services/9999/')
+        self.client.get('/api/nowhere/')
+
+        samples = self.scrape()
+        labels = 'route="service-list",method="GET"'
+        self.assertEqual(samples[f'clinic_http_requests_total{{{labels},status="2xx"}}'], 2)
+        self.assertEqual(samples[f'clinic_http_request_duration_seconds_count{{{labels}}}'], 2)
+        self.assertEqual(samples[f'clinic_http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'], 2)
+        self.assertEqual(samples[f'clinic_http_recent_request_db_queries_count{{{labels}}}'], 2)
+        self.assertEqual(
+            samples['clinic_http_requests_total{route="service-detail",method="GET",status="4xx"}'], 1
+        )
+        self.assertEqual(samples['clinic_http_requests_total{route="unresolved",method="GET",status="4xx"}'], 1)
+        self.assertEqual(
+            samples['clinic_http_request_db_queries_total{route="calendar-list",method="GET"}'], calendar_queries
+        )
+
+    def test_unknown_methods_share_one_series(self):
+        client = APIClient()
+        for i in range(20):
+            client.generic(f'X{i}', '/api/doctors/')
+        self.assertEqual(sorted(metrics_registry.snapshot()), [('doctor-list', 'other')])
+        samples = self.scrape()
+        self.assertEqual(samples['clinic_http_requests_total{route="doctor-list",method="other",status="4xx"}'], 20)
+
+    def test_render_format(self):
+        registry = MetricsRegistry(ring_size=3)
+        for duration in [0.001, 0.02, 0.02, 3.0]:
+            registry.record('a"b', 'GET', 200, duration, 2, 0.001)
+        text = registry.render_prometheus()
+        self.assertIn('clinic_http_request_duration_seconds_bucket{route="a\\"b",method="GET",le="0.005"} 1', text)
+        self.assertIn('clinic_http_request_duration_seconds_bucket{route="a\\"b",method="GET",le="0.025"} 3', text)
+        self.assertIn('clinic_http_request_duration_seconds_bucket{route="a\\"b",method="GET",le="+Inf"} 4', text)
+        # Quantiles only cover the ring buffer
+        self.assertIn('clinic_http_recent_request_duration_seconds_count{route="a\\"b",method="GET"} 3', text)
+        self.assertIn('clinic_http_recent_request_duration_seconds{route="a\\"b",method="GET",quantile="0.5"} 0.020000', text)
+
+    def test_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/_metrics/').status_code, 403)
+        self.assertEqual(APIClient().get('/api/_metrics/').status_code, 401)
+
+
+@skipUnless(os.environ.get('CLINIC_BENCHMARKS'), 'Set CLINIC_BENCHMARKS=1 to run benchmarks')
+class MetricsOverheadBenchmark(ClinicTestCase):
+    requests = 2000
+
+    def test_middleware_overhead(self):
+        from django.conf import settings
+        from .middleware import MetricsMiddleware, QueryTimer, current_query_timer, time_query
+        self.create_doctors(3)
+        without = [name for name in settings.MIDDLEWARE if not name.endswith('MetricsMiddleware')]
+
+        def timed(requests=200):
+            began = perf_counter()
+            for _ in range(requests):
+                self.client.get('/api/doctors/')
+            return (perf_counter() - began) / requests * 1e6
+
+        # Alternate short runs and keep the best of each, the noise of
+        # whole requests is far larger than the overhead being measured
+        results = {'on': [], 'off': []}
+        for _ in range(self.requests // 200):
+            results['on'].append(timed())
+            with override_settings(MIDDLEWARE=without):
+                results['off'].append(timed())
+        on, off = min(results['on']), min(results['off'])
+
+        # The middleware around a view doing nothing, and the query wrapper
+        # around a no-op execute: both far below the noise of real requests
+        # and queries. Interleaved runs, keeping the best of each.
+        request = self.client.get('/api/doctors/').wsgi_request
+        response = HttpResponse()
+
+        def view(request):
+            return response
+
+        def execute(sql, params, many, context):
+            return None
+
+        def timed_query(request):
+            time_query(execute, 'SELECT 1', (), False, {})
+
+        def best_times(handlers, calls=20_000):
+            runs = {handler: [] for handler in handlers}
+            for _ in range(10):
+                for handler, times in runs.items():
+                    began = perf_counter()
+                    for _ in range(calls):
+                        handler(request)
+                    times.append((perf_counter() - began) / calls * 1e6)
+            return [min(times) for times in runs.values()]
+
+        bare, wrapped = best_times([view, MetricsMiddleware(view)])
+        token = current_query_timer.set(QueryTimer())
+        try:
+            plain, timed = best_times([lambda request: execute('SELECT 1', (), False, {}), timed_query])
+        finally:
+            current_query_timer.reset(token)
+
+        print(f'\n/api/doctors/: {off:.0f} us without metrics, {on:.0f} us with; middleware overhead '
+              f'{wrapped - bare:.1f} us per request plus {timed - plain:.2f} us per query')
+
+
+@override_settings(CLINIC_QUERY_BUDGETS=True)
+class QueryBudgetTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = self.create_week(doctor_count=4, appointments_per_day=24)
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week + 1, self.year)
+        self.services = [self.service] + [
+            Service.objects.create(name=f'Service {i}', price=Decimal('40.00') + i, duration_minutes=15 * i)
+            for i in range(1, 5)
+        ]
+        for i, service in enumerate(self.services[1:]):
+            self.create_appointment(self.doctors[i], self.local_datetime(0, 18, 15 * i), service=service)
+        self.create_appointment(
+            self.doctors[0], self.local_datetime(1, 19), service=None, custom_service_name='Consultation'
+        )
+
+    def endpoint_requests(self):
+        """One request per router endpoint and method, destructive ones last"""
+        doctor, service = self.doctors[0], self.services[1]
+        shift = Shift.objects.filter(year=self.year, week_of_year=self.week).first()
+        appointment = Appointment.objects.first()
+        week_end = self.week_start + timedelta(days=6)
+        booking = {
+            'patient_first_name': 'Marko',
+            'patient_last_name': 'Stojanov',
+            'patient_phone_number': '071 222 333',
+            'doctor_id': doctor.id,
+            'service_id': service.id,
+            'price': '41.00',
+            'duration_minutes': 15,
+            'start_datetime': self.local_datetime(5, 20).isoformat(),
+        }
+        moved = dict(booking, start_datetime=self.local_datetime(5, 21).isoformat())
+        bulk = [
+            dict(booking, start_datetime=self.local_datetime(day, 21).isoformat(), doctor_id=self.doctors[day % 4].id)
+            for day in range(6)
+        ]
+        return [
+            ('get', '/api/doctors/', None),
+            ('post', '/api/doctors/', {'full_name': 'Dr. New', 'phone_number': '+389-70-999999', 'email': 'new@example.com'}),
+            ('get', f'/api/doctors/{doctor.id}/', None),
+            ('put', f'/api/doctors/{doctor.id}/', {'full_name': doctor.full_name, 'phone_number': doctor.phone_number, 'email': doctor.email}),
+            ('patch', f'/api/doctors/{doctor.id}/', {'full_name': 'Dr. Renamed'}),
+            ('get', '/api/services/', None),
+            ('post', '/api/services/', {'name': 'Whitening', 'price': '120.00', 'duration_minutes': 60}),
+            ('get', f'/api/services/{service.id}/', None),
+            ('put', f'/api/services/{service.id}/', {'name': service.name, 'price': '45.00', 'duration_minutes': 15}),
+            ('patch', f'/api/services/{service.id}/', {'price': '46.00'}),
+            ('get', '/api/shifts/', None),
+            ('get', f'/api/shifts/?week={self.week}&year={self.year}', None),
+            ('post', '/api/shifts/', {'week_of_year': self.week + 3, 'year': self.year, 'day_of_week': 0, 'shift_type': 'first', 'start_time': '08:00', 'end_time': '14:00'}),
+            ('get', f'/api/shifts/{shift.id}/', None),
+            ('put', f'/api/shifts/{shift.id}/', {'week_of_year': shift.week_of_year, 'year': shift.year, 'day_of_week': shift.day_of_week, 'shift_type': shift.shift_type, 'start_time': '08:00', 'end_time': '14:00'}),
+            ('patch', f'/api/shifts/{shift.id}/', {'shift_type': shift.shift_type}),
+            ('post', f'/api/shifts/{shift.id}/doctors/', {'doctor_ids': [d.id for d in self.doctors]}),
+            ('delete', f'/api/shifts/{shift.id}/doctors/{doctor.id}/', None),
+            ('post', '/api/shifts/generate_week/', {'week': self.week + 2, 'year': self.year}),
+            ('post', '/api/shifts/generate_range/', {'start_week': self.week, 'start_year': self.year, 'end_week': self.week + 4, 'end_year': self.year}),
+            ('get', '/api/appointments/', None),
+            ('get', f'/api/appointments/?start_date={self.week_start}&end_date={week_end}', None),
+            ('get', f'/api/appointments/?doctor={doctor.id}&patient_name=ana', None),
+            ('post', '/api/appointments/', booking),
+            ('get', f'/api/appointments/{appointment.id}/', None),
+            ('put', f'/api/appointments/{appointment.id}/', dict(moved, id=appointment.id)),
+            ('patch', f'/api/appointments/{appointment.id}/', {'service_id': service.id, 'patient_first_name': 'Ivana'}),
+            ('post', '/api/appointments/bulk/', {'appointments': bulk}),
+            ('get', '/api/appointments/patients/?q=petr', None),
+            ('get', f'/api/appointments/export/?start_date={self.week_start}&end_date={week_end}', None),
+            ('get', f'/api/appointments/future/?week={self.week}', None),
+            ('get', f'/api/calendar/?week={self.week}', None),
+            ('get', f'/api/calendar/?week={self.week}', None),
+            ('get', f'/api/calendar/range/?start_date={self.week_start}&end_date={self.week_start + timedelta(days=91)}', None),
+            ('get', f'/api/calendar/range/?start_date={self.week_start}&end_date={week_end}&compact=true', None),
+            ('get', '/api/calendar/cache_stats/', None),
+            ('get', f'/api/stats/?start_date={self.week_start}&end_date={self.week_start + timedelta(days=365)}', None),
+            ('get', f'/api/stats/revenue/?year={self.year}', None),
+            ('get', '/api/stats/totals/', None),
+            ('get', '/api/changes/', None),
+            ('get', '/api/changes/?since=0', None),
+            ('get', f'/api/audit/?start_date={self.week_start}&end_date={self.week_start + timedelta(days=365)}', None),
+            ('get', f'/api/availability/?start_date={self.week_start}&end_date={week_end}&duration=30', None),
+            ('get', f'/api/availability/earliest/?after={self.week_start}&duration=30', None),
+            # Earliest slots after eight weeks without shifts, and none in a year
+            ('get', f'/api/availability/earliest/?after={self.week_start - timedelta(weeks=8)}&duration=30', None),
+            ('get', f'/api/availability/earliest/?after={self.week_start}&duration=30&from_time=08:00&to_time=08:20&until={self.week_start + timedelta(days=366)}', None),
+            ('get', '/api/_metrics/', None),
+            ('delete', f'/api/appointments/{appointment.id}/', None),
+            ('delete', f'/api/shifts/{shift.id}/', None),
+            ('delete', f'/api/services/{self.services[4].id}/', None),
+            ('delete', f'/api/doctors/{self.doctors[3].id}/', None),
+        ]
+
+    def test_every_endpoint_within_budget(self):
+        visited = set()
+        for method, url, data in self.endpoint_requests():
+            response = getattr(self.client, method)(url, data, format='json')
+            self.assertLess(response.status_code, 300, f'{method.upper()} {url}: {response.status_code}')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            self.assertEqual(
+                response.query_violations, [],
+                f'{method.upper()} {url}: ' + '; '.join(v['message'] for v in response.query_violations)
+            )
+            view = response.wsgi_request.resolver_match.func
+            visited.add((view.cls, (getattr(view, 'actions', None) or {}).get(method, method)))
+
+        # Every routed action has a budget and was requested above
+        metrics_view = resolve('/api/_metrics/').func
+        budgets = {(MetricsView, 'get'): get_query_budget(metrics_view, 'get')}
+        for pattern in router.urls:
+            for method, action in (getattr(pattern.callback, 'actions', None) or {}).items():
+                budgets[(pattern.callback.cls, action)] = get_query_budget(pattern.callback, method)
+        for (view, action), budget in budgets.items():
+            self.assertIsNotNone(budget, f'{view.__name__}.{action} has no query budget')
+        self.assertEqual(set(budgets) - visited, set())
+
+    def test_over_budget_is_logged(self):
+        with mock.patch.dict(DoctorViewSet.query_budgets, {'list': 0}):
+            with self.assertLogs('backend.clinic.queries', 'WARNING') as logs:
+                response = self.client.get('/api/doctors/')
+        self.assertEqual([v['kind'] for v in response.query_violations], ['budget'])
+        self.assertIn('1 queries, over the budget of 0', logs.output[0])
+        self.assertEqual(response['X-Query-Count'], '1')
+
+    def test_repeated_queries_are_flagged(self):
+        def view(request):
+            for shift in Shift.objects.all():
+                list(shift.doctors.all())
+            return HttpResponse()
+
+        request = RequestFactory().get('/shifts/')
+        with self.assertLogs('backend.clinic.queries', 'WARNING') as logs:
+            response = QueryBudgetMiddleware(view)(request)
+        shifts = Shift.objects.count()
+        self.assertEqual(len(response.query_violations), 1)
+        violation = response.query_violations[0]
+        self.assertEqual(violation['kind'], 'repeated')
+        self.assertTrue(violation['message'].startswith(f'{shifts} queries of the same shape'))
+        # The stack points at the loop in the view
+        self.assertIn('list(shift.doctors.all())', violation['stack'])
+        self.assertIn('list(shift.doctors.all())', logs.output[0])
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = %s'),
+            fingerprint('SELECT *  FROM t\nWHERE id IN (%s) AND name = %s'.replace('(%s)', '(%s, %s)')),
+        )
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 12 AND name = 'it''s' LIMIT 21"),
+            'SELECT * FROM t WHERE id = ? AND name = ? LIMIT ?',
+        )
+
+    def test_shift_admin_changelist(self):
+        admin = User.objects.create_superuser('shift-admin', 'shift-admin@example.com', 'password')
+        self.client.force_login(admin)
+
+        def changelist_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/clinic/shift/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.query_violations, [])
+            return len(queries)
+
+        before = changelist_queries()
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week + 2, self.year)
+        self.assertEqual(changelist_queries(), before)
+
+
+class DatasetTests(ClinicTestCase):
+    def test_generate_dataset(self):
+        calendar_cache.get_cached_week('week', self.week + 1, self.year)
+        out = StringIO()
+        call_command(
+            'generate_dataset', doctors=3, services=4, weeks=2, appointments=300,
+            start_week=self.week, start_year=self.year, chunk_size=70, stdout=out,
+        )
+        self.assertIn('Generated 300 appointments', out.getvalue())
+        self.assertEqual(Doctor.objects.count(), 3)
+        self.assertEqual(Service.objects.count(), 5)
+        self.assertEqual(Shift.objects.filter(week_of_year__in=[self.week, self.week + 1]).count(), 22)
+
+        appointments = Appointment.objects.select_related('service')
+        self.assertEqual(appointments.count(), 300)
+        self.assertFalse(Appointment.objects.filter(start_date__lt=self.week_start).exists())
+        self.assertFalse(overlapping_appointments().exists())
+        # Every appointment is inside one of its doctor's shifts
+        self.assertEqual(list(iter_findings(self.week_start, self.week_start + timedelta(days=13))), [])
+        for appointment in appointments[:50]:
+            stored = [getattr(appointment, field) for field in Appointment.DERIVED_FIELDS]
+            appointment.populate_derived_fields()
+            self.assertEqual(stored, [getattr(appointment, field) for field in Appointment.DERIVED_FIELDS])
+            self.assertEqual(
+                appointment.end_datetime, appointment.start_datetime + timedelta(minutes=appointment.duration_minutes)
+            )
+            if appointment.service:
+                self.assertEqual(appointment.price, appointment.service.price)
+        # The cached week was invalidated by the bulk insert
+        week = calendar_cache.get_cached_week('week', self.week + 1, self.year)
+        self.assertEqual(
+            sum(len(day['appointments']) for day in week.values()),
+            Appointment.objects.filter(start_date__gte=self.week_start + timedelta(weeks=1)).count(),
+        )
+
+    def test_same_seed_same_data(self):
+        def generate(seed):
+            # Doctors too, the shifts of new doctors depend on the ones before them
+            Appointment.objects.all().delete()
+            Doctor.objects.all().delete()
+            call_command(
+                'generate_dataset', doctors=2, services=3, weeks=1, appointments=40,
+                start_week=self.week, start_year=self.year, seed=seed, stdout=StringIO(),
+            )
+            return list(Appointment.objects.values_list(
+                'patient_first_name', 'patient_phone_number', 'start_datetime', 'duration_minutes'
+            ).order_by('start_datetime', 'doctor__email'))
+
+        self.assertEqual(generate(7), generate(7))
+        self.assertNotEqual(generate(7), generate(8))
+
+    def test_too_many_appointments(self):
+        with self.assertRaisesMessage(CommandError, 'At most'):
+            call_command('generate_dataset', doctors=1, weeks=1, appointments=10_000, stdout=StringIO())
+        self.assertEqual(Appointment.objects.count(), 0)
+
+    def test_benchmark_api(self):
+        call_command(
+            'generate_dataset', doctors=2, weeks=3, appointments=200, stdout=StringIO()
+        )
+        scenarios = ['calendar_week', 'create_appointment', 'create_conflicting', 'patient_search', 'generate_week']
+        options = [f'--scenario={scenario}' for scenario in scenarios]
+        appointments, shifts = Appointment.objects.count(), Shift.objects.count()
+        with NamedTemporaryFile('w+', suffix='.json') as output:
+            out = StringIO()
+            call_command('benchmark_api', *options, iterations=3, warmup=1, output=output.name, stdout=out)
+            results = json.load(output)
+            self.assertNotIn('unexpected status', out.getvalue())
+            self.assertEqual(list(results['scenarios']), scenarios)
+            for summary in results['scenarios'].values():
+                self.assertEqual(summary['requests'], 3)
+                self.assertEqual(summary['unexpected'], 0)
+                self.assertLessEqual(summary['p50_ms'], summary['p95_ms'])
+                self.assertLessEqual(summary['p95_ms'], summary['p99_ms'])
+            self.assertEqual(results['scenarios']['create_conflicting']['statuses'], {'400': 3})
+            # Writes were cleaned up
+            self.assertEqual((Appointment.objects.count(), Shift.objects.count()), (appointments, shifts))
+
+            # A far faster baseline, or one with fewer queries, is a regression
+            baseline = json.loads(json.dumps(results))
+            baseline['scenarios']['calendar_week']['p50_ms'] /= 20
+            baseline['scenarios']['patient_search']['queries'] = 0
+            output.seek(0)
+            output.truncate()
+            json.dump(baseline, output)
+            output.flush()
+            with self.assertRaisesMessage(CommandError, 'Regressed: calendar_week, patient_search'):
+                call_command(
+                    'benchmark_api', '--scenario=calendar_week', '--scenario=patient_search', '--scenario=generate_week',
+                    iterations=3, baseline=output.name, threshold=500, fail_on_regression=True, stdout=StringIO(),
+                )
+
+
+class DatabaseTuningTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            self.skipTest('Needs a file SQLite database')
+
+    def test_pragmas_on_new_connections(self):
+        connection.close()
+        self.assertEqual(get_sqlite_settings(connection), {
+            'busy_timeout': 5000,
+            'journal_mode': 'wal',
+            'synchronous': 1,
+            'cache_size': -64000,
+            'mmap_size': DEFAULT_SQLITE_PRAGMAS['mmap_size'],
+            'temp_store': 2,
+        })
+
+        with override_settings(CLINIC_SQLITE_PRAGMAS={'busy_timeout': 100, 'synchronous': 'full'}):
+            connection.close()
+            self.assertEqual(get_sqlite_settings(connection), {'busy_timeout': 100, 'synchronous': 2})
+        with override_settings(CLINIC_SQLITE_PRAGMAS={'busy_timeout': '1; DROP TABLE clinic_doctor'}):
+            connection.close()
+            with self.assertRaisesMessage(ValueError, 'Invalid SQLite pragma'):
+                connection.ensure_connection()
+        connection.close()
+
+    def test_immediate_transactions(self):
+        options = connection.settings_dict.setdefault('OPTIONS', {})
+        original = options.get('transaction_mode')
+        statements = []
+        try:
+            options['transaction_mode'] = 'IMMEDIATE'
+            connection.close()
+            with CaptureQueriesContext(connection) as queries, transaction.atomic():
+                Doctor.objects.create(full_name='Dr. Immediate', phone_number='+389-70-000001')
+            statements = [query['sql'] for query in queries.captured_queries]
+        finally:
+            options['transaction_mode'] = original
+            connection.close()
+        self.assertEqual(statements[0], 'BEGIN IMMEDIATE')
+
+    def test_benchmark_database(self):
+        Service.objects.create(name='Regular Checkup', price=Decimal('75.00'), duration_minutes=30)
+        Doctor.objects.create(full_name='Dr. Load', phone_number='+389-70-000002')
+        with NamedTemporaryFile('w+', suffix='.json') as output:
+            out = StringIO()
+            call_command(
+                'benchmark_database', processes=2, threads=2, duration=0.5, write_share=0.5,
+                output=output.name, stdout=out,
+            )
+            results = json.load(output)
+        self.assertEqual(list(results['profiles']), ['default', 'tuned', 'tuned_immediate'])
+        self.assertEqual(results['profiles']['default']['journal_mode'], 'delete')
+        self.assertEqual(results['profiles']['tuned']['journal_mode'], 'wal')
+        self.assertEqual(results['profiles']['tuned_immediate']['transaction_mode'], 'IMMEDIATE')
+        for summary in results['profiles'].values():
+            self.assertGreater(summary['read']['ok'] + summary['write']['ok'], 0)
+            self.assertEqual(summary['read']['errors'] + summary['write']['errors'], 0)
+            self.assertEqual(summary['read']['locked'] + summary['write']['locked'], 0)
+        # The benchmark ran on copies and restored the settings
+        self.assertEqual(Appointment.objects.count(), 0)
+        self.assertEqual(get_sqlite_settings(connection)['journal_mode'], 'wal')
+
+
+class AsyncViewTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+
+    def async_get(self, url, user=None, **kwargs):
+        """GET through the async handler, authenticated with a real JWT"""
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user or self.user)}'}
+        return async_to_sync(AsyncClient().get)(url, headers=headers, **kwargs)
+
+    def test_responses_match_sync_endpoints(self):
+        doctor = self.create_week(doctor_count=2, appointments_per_day=4)[0]
+        self.create_appointment(doctor, self.local_datetime(6, 10), service=None, custom_service_name='Consult')
+        for sync_url, async_url in [
+            (f'/api/calendar/?week={self.week}', f'/api/async/calendar/?week={self.week}'),
+            (f'/api/appointments/future/?week={self.week}', f'/api/async/appointments/future/?week={self.week}'),
+            (f'/api/shifts/?week={self.week}&year={self.year}', f'/api/async/shifts/?week={self.week}&year={self.year}'),
+        ]:
+            calendar_cache.get_cache().clear()
+            expected = self.client.get(sync_url)
+            calendar_cache.get_cache().clear()
+            response = self.async_get(async_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(response.json(), json.loads(expected.content))
+
+        # Filled from, and served by, the same cache as the sync endpoint
+        cached = self.client.get(f'/api/calendar/?week={self.week}').data
+        self.create_appointment(doctor, self.local_datetime(5, 12))
+        self.assertEqual(self.async_get(f'/api/async/calendar/?week={self.week}').json(), json.loads(
+            self.client.get(f'/api/calendar/?week={self.week}').content
+        ))
+        self.assertNotEqual(self.async_get(f'/api/async/calendar/?week={self.week}').json(), cached)
+
+    def test_errors(self):
+        self.assertEqual(self.async_get('/api/async/calendar/').json(), {'error': 'week parameter is required'})
+        response = self.async_get('/api/async/shifts/?week=abc')
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid week parameter'}))
+
+        response = async_to_sync(AsyncClient().get)(f'/api/async/calendar/?week={self.week}')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = async_to_sync(AsyncClient().get)(
+            f'/api/async/calendar/?week={self.week}', headers={'Authorization': 'Bearer invalid'}
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'token_not_valid')
+        inactive = User.objects.create(username='inactive')
+        token = AccessToken.for_user(inactive)
+        User.objects.filter(pk=inactive.pk).update(is_active=False)
+        response = async_to_sync(AsyncClient().get)(
+            f'/api/async/calendar/?week={self.week}', headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.json(), {'detail': 'User is inactive', 'code': 'user_inactive'})
+
+        response = async_to_sync(AsyncClient().post)('/api/async/calendar/')
+        self.assertEqual((response.status_code, response['Allow']), (405, 'GET'))
+
+    def test_shifts_of_non_staff(self):
+        ShiftRotationManager.create_or_update_shifts_for_week(self.week, self.year)
+        user = User.objects.create(username='reception')
+        self.assertEqual(self.async_get(f'/api/async/shifts/?week={self.week}', user=user).json(), [])
+
+    @override_settings(CLINIC_QUERY_BUDGETS=True)
+    def test_query_budgets_and_metrics(self):
+        self.create_week(doctor_count=3, appointments_per_day=6)
+        # The user, then appointments, shifts and shift doctors
+        for url, queries in [
+            (f'/api/async/calendar/?week={self.week}', 4),
+            (f'/api/async/appointments/future/?week={self.week}', 2),
+            (f'/api/async/shifts/?week={self.week}', 3),
+        ]:
+            with self.assertNumQueries(queries):
+                response = self.async_get(url)
+            self.assertEqual(response['X-Query-Count'], str(queries))
+            self.assertEqual(response.query_violations, [])
+
+        self.assertEqual(metrics_registry.snapshot()[('async-calendar', 'GET')]['queries'], 4)
+
+
+class AsgiBenchmarkTests(TransactionTestCase):
+    def test_benchmark_asgi(self):
+        # Sync views run in asgiref's worker thread, which needs committed data
+        Doctor.objects.create(full_name='Dr. Load', phone_number='+389-70-000003')
+        year = timezone.now().year
+        ShiftRotationManager.create_or_update_shifts_for_week(10, year)
+        ShiftRotationManager.create_or_update_shifts_for_week(11, year)
+        for cached in (False, True):
+            with NamedTemporaryFile('w+', suffix='.json') as output:
+                call_command(
+                    'benchmark_asgi', clients=4, duration=0.2, cached=cached, output=output.name, stdout=StringIO(),
+                )
+                results = json.load(output)
+            self.assertEqual(list(results['scenarios']), ['calendar_week', 'future_week', 'shift_week'])
+            for modes in results['scenarios'].values():
+                self.assertEqual(list(modes), ['sync', 'async'])
+                for summary in modes.values():
+                    self.assertGreater(summary['requests'], 0)
+                    self.assertEqual(summary['errors'], 0)
+        # The benchmark user is gone again
+        self.assertFalse(User.objects.filter(username__startswith='asgi-benchmark').exists())
+
+
+class SseBenchmarkTests(TransactionTestCase):
+    @override_settings(CLINIC_EVENTS_MAX_QUEUED=5)
+    def test_benchmark_sse(self):
+        with NamedTemporaryFile('w+', suffix='.json') as output:
+            call_command(
+                'benchmark_sse', idle=3, active=2, slow=1, events=20, rate=50, output=output.name, stdout=StringIO(),
+            )
+            results = json.load(output)
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(results['delivered'], results['expected_deliveries'])
+        self.assertEqual(results['expected_deliveries'], 40)
+        self.assertEqual(results['idle_delivered'], 0)
+        # The slow stream fell more than 5 events behind
+        self.assertEqual(results['slow_dropped'], 1)
+        self.assertEqual(results['hub']['dropped'], 1)
+        self.assertIsNotNone(results['latency_p95_ms'])
+        self.assertGreater(results['memory_per_stream_kb'], 0)
+        self.assertFalse(User.objects.filter(username__startswith='sse-benchmark').exists())
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_sse', events=0, stdout=StringIO())
@@ -6,8 +6,9 @@ from drf_yasg import openapi
 from rest_framework import permissions
 from .views import (
     DoctorViewSet, ShiftViewSet, AppointmentViewSet, 
-    ServiceViewSet, CalendarViewSet
+    ServiceViewSet, CalendarViewSet, AvailabilityViewSet, StatsViewSet, ChangeFeedViewSet, AuditViewSet, MetricsView
 )
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'doctors', DoctorViewSet)
@@ -15,6 +16,10 @@ router.register(r'shifts', ShiftViewSet)
 router.register(r'appointments', AppointmentViewSet)
 router.register(r'services', ServiceViewSet)
 router.register(r'calendar', CalendarViewSet, basename='calendar')
+router.register(r'availability', AvailabilityViewSet, basename='availability')
+router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'changes', ChangeFeedViewSet, basename='changes')
+router.register(r'audit', AuditViewSet, basename='audit')
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -29,6 +34,13 @@ schema_view = get_schema_view(
 )
 
 urlpatterns = [
+    path('api/_metrics/', MetricsView.as_view(), name='metrics'),
+    # Async versions of read-heavy endpoints, for ASGI deployments
+    path('api/async/calendar/', async_views.calendar_week, name='async-calendar'),
+    path('api/async/appointments/future/', async_views.future_week, name='async-appointments-future'),
+    path('api/async/shifts/', async_views.shift_week, name='async-shifts'),
+    path('api/async/changes/', async_views.changes, name='async-changes'),
+    path('api/async/events/', async_views.events, name='async-events'),
     path('api/', include(router.urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
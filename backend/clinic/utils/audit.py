@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import groupby
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+from ..models import Appointment, Shift
+from .fast_serializers import datetime_formatter
+from .shift_rotation import ShiftRotationManager
+
+# Audit of a date range: bookings outside their doctor's shifts, bookings
+# of one doctor that overlap, and shifts with too few doctors. Appointments
+# and shift assignments are streamed sorted by doctor and time and checked
+# in a single sweep, holding only the shifts' times in memory.
+
+# Rows fetched from the database per round trip
+AUDIT_CHUNK_SIZE = 2000
+
+# Doctors a shift needs unless CLINIC_MIN_SHIFT_DOCTORS says otherwise
+DEFAULT_MIN_SHIFT_DOCTORS = 1
+
+# Findings listed in a report, the counts include the rest
+DEFAULT_FINDING_LIMIT = 1000
+MAX_FINDING_LIMIT = 10_000
+
+FINDING_KINDS = ('outside_shift', 'overlap', 'understaffed')
+
+
+def get_min_shift_doctors():
+    return getattr(settings, 'CLINIC_MIN_SHIFT_DOCTORS', DEFAULT_MIN_SHIFT_DOCTORS)
+
+
+def range_weeks(start_date, end_date):
+    """(week_of_year, year) of every week the range touches"""
+    return list(ShiftRotationManager.iter_weeks(
+        *ShiftRotationManager.get_week_and_year(start_date), *ShiftRotationManager.get_week_and_year(end_date)
+    ))
+
+
+def shift_rows(weeks):
+    """Shifts of the weeks with their doctor counts, in time order"""
+    return Shift.objects.filter(ShiftRotationManager.weeks_filter(weeks)).annotate(
+        doctor_count=Count('doctors')
+    ).order_by('year', 'week_of_year', 'day_of_week', 'start_time').values_list(
+        'id', 'year', 'week_of_year', 'day_of_week', 'shift_type', 'start_time', 'end_time', 'doctor_count'
+    )
+
+
+def shift_times(day, start_time, end_time):
+    """A shift's start and end as UTC datetimes, to compare with stored appointments"""
+    return tuple(
+        timezone.make_aware(datetime.combine(day, value)).astimezone(dt_timezone.utc)
+        for value in (start_time, end_time)
+    )
+
+
+def assignment_rows(weeks, doctor_ids=None):
+    """(doctor_id, shift_id) of the shifts of the weeks, sorted by doctor and time"""
+    queryset = Shift.doctors.through.objects.filter(ShiftRotationManager.weeks_filter(weeks, prefix='shift__'))
+    if doctor_ids is not None:
+        queryset = queryset.filter(doctor_id__in=doctor_ids)
+    return queryset.order_by(
+        'doctor_id', 'shift__year', 'shift__week_of_year', 'shift__day_of_week', 'shift__start_time'
+    ).values_list('doctor_id', 'shift_id')
+
+
+def appointment_rows(start_date, end_date, doctor_ids=None):
+    """(id, doctor_id, start_datetime, end_datetime) of the range, sorted by doctor and start"""
+    queryset = Appointment.objects.filter(start_date__range=[start_date, end_date])
+    if doctor_ids is not None:
+        queryset = queryset.filter(doctor_id__in=doctor_ids)
+    return queryset.order_by('doctor_id', 'start_datetime', 'id').values_list(
+        'id', 'doctor_id', 'start_datetime', 'end_datetime'
+    )
+
+
+def merge_blocks(intervals):
+    """Merge sorted (start, end) intervals that touch or overlap, so back-to-back shifts cover a booking across both"""
+    block = None
+    for start, end in intervals:
+        if block is not None and start <= block[1]:
+            block = (block[0], max(block[1], end))
+            continue
+        if block is not None:
+            yield block
+        block = (start, end)
+    if block is not None:
+        yield block
+
+
+def sweep_doctor(doctor_id, appointments, blocks):
+    """
+    Findings of one doctor's appointments, sorted by start, against the
+    doctor's merged shift blocks, sorted by time. Both are consumed once.
+    """
+    block = next(blocks, None)
+    latest_id = latest_end = None
+    for appointment_id, _, start, end in appointments:
+        # Blocks ending before this start cannot cover it or any later one
+        while block is not None and block[1] <= start:
+            block = next(blocks, None)
+        if block is None or start < block[0] or end > block[1]:
+            yield {
+                'kind': 'outside_shift',
+                'doctor_id': doctor_id,
+                'appointment_id': appointment_id,
+                'start_datetime': start,
+                'end_datetime': end,
+            }
+        if latest_end is not None and start < latest_end:
+            yield {
+                'kind': 'overlap',
+                'doctor_id': doctor_id,
+                'appointment_id': appointment_id,
+                'other_appointment_id': latest_id,
+                'start_datetime': start,
+                'end_datetime': min(end, latest_end),
+            }
+        if latest_end is None or end > latest_end:
+            latest_id, latest_end = appointment_id, end
+
+
+def iter_findings(start_date, end_date, doctor_ids=None, min_doctors=None):
+    """
+    Yield the findings of a clinic-local date range: understaffed shifts in
+    time order, then per doctor bookings outside shifts and overlaps in
+    time order. Three queries, the last two streamed in chunks.
+    """
+    min_doctors = get_min_shift_doctors() if min_doctors is None else min_doctors
+    weeks = range_weeks(start_date, end_date)
+    times = {}
+    for shift_id, year, week_of_year, day_of_week, shift_type, start_time, end_time, doctor_count in shift_rows(weeks):
+        day = ShiftRotationManager.get_week_start_date(week_of_year, year) + timedelta(days=day_of_week)
+        times[shift_id] = shift_times(day, start_time, end_time)
+        if start_date <= day <= end_date and doctor_count < min_doctors and doctor_ids is None:
+            yield {
+                'kind': 'understaffed',
+                'shift_id': shift_id,
+                'date': day,
+                'shift_type': shift_type,
+                'doctors': doctor_count,
+                'required': min_doctors,
+            }
+
+    assignments = groupby(
+        assignment_rows(weeks, doctor_ids).iterator(chunk_size=AUDIT_CHUNK_SIZE), key=lambda row: row[0]
+    )
+    assigned_doctor, shifts = next(assignments, (None, iter(())))
+    for doctor_id, appointments in groupby(
+        appointment_rows(start_date, end_date, doctor_ids).iterator(chunk_size=AUDIT_CHUNK_SIZE), key=lambda row: row[1]
+    ):
+        # Both streams are sorted by doctor, so skip to this doctor's shifts
+        while assigned_doctor is not None and assigned_doctor < doctor_id:
+            assigned_doctor, shifts = next(assignments, (None, iter(())))
+        blocks = merge_blocks(times[shift_id] for _, shift_id in shifts) if assigned_doctor == doctor_id else iter(())
+        yield from sweep_doctor(doctor_id, appointments, blocks)
+
+
+def format_finding(finding, format_datetime):
+    finding = dict(finding)
+    for name in ('start_datetime', 'end_datetime'):
+        if name in finding:
+            finding[name] = format_datetime(finding[name])
+    if 'date' in finding:
+        finding['date'] = finding['date'].isoformat()
+    return finding
+
+
+def audit_report(start_date, end_date, doctor_ids=None, limit=DEFAULT_FINDING_LIMIT, min_doctors=None):
+    """Counts of every kind of finding, and the first limit findings"""
+    counts = dict.fromkeys(FINDING_KINDS, 0)
+    findings = []
+    format_datetime = datetime_formatter()
+    for finding in iter_findings(start_date, end_date, doctor_ids, min_doctors):
+        counts[finding['kind']] += 1
+        if len(findings) < limit:
+            findings.append(format_finding(finding, format_datetime))
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'counts': counts,
+        'truncated': sum(counts.values()) > len(findings),
+        'findings': findings,
+    }
@@ -0,0 +1,277 @@
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from django.utils import timezone
+from ..models import Shift, Appointment
+from .shift_rotation import ShiftRotationManager
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def minutes_of_day(value):
+    """Get the minute of the day of a time"""
+    return value.hour * 60 + value.minute
+
+
+def format_minute(minute):
+    """Format a minute of the day as HH:MM"""
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def interval_mask(start_minute, end_minute):
+    """Bitset with the minutes in [start_minute, end_minute) set"""
+    if end_minute <= start_minute:
+        return 0
+    return ((1 << (end_minute - start_minute)) - 1) << start_minute
+
+
+def run_starts(free, length):
+    """
+    Bitset of the minutes that start a run of at least `length` free minutes.
+
+    Folds the bitset onto itself with doubling shifts, so a run of N minutes
+    costs O(log N) big-integer operations instead of a scan per slot.
+    """
+    starts = free
+    covered = 1
+    while covered < length and starts:
+        step = min(covered, length - covered)
+        starts &= starts >> step
+        covered += step
+    return starts
+
+
+# Grids kept in grid_mask's cache. step comes from the client, so the cache
+# is bounded rather than growing with every value requested.
+GRID_CACHE_SIZE = 32
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def grid_mask(step):
+    """Bitset with every `step`-th minute of the day set"""
+    mask = 0
+    for minute in range(0, MINUTES_PER_DAY, step):
+        mask |= 1 << minute
+    return mask
+
+
+def split_by_day(start, end):
+    """
+    Split an aware datetime interval into clinic-local
+    (date, start_minute, end_minute) pieces, one per day it touches.
+    """
+    clinic_tz = timezone.get_default_timezone()
+    start = timezone.localtime(start, clinic_tz)
+    end = timezone.localtime(end, clinic_tz)
+    day = start.date()
+    start_minute = minutes_of_day(start)
+    while day <= end.date():
+        if day == end.date():
+            end_minute = minutes_of_day(end) + (1 if end.second or end.microsecond else 0)
+        else:
+            end_minute = MINUTES_PER_DAY
+        if end_minute > start_minute:
+            yield day, start_minute, end_minute
+        day += timedelta(days=1)
+        start_minute = 0
+
+
+def iter_bits(mask):
+    """Yield the positions of the set bits of a bitset, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class AvailabilityMap:
+    """
+    Per-doctor, per-day occupancy as minute-granularity bitsets.
+
+    Each (doctor_id, date) pair maps to a 1440-bit integer where a set bit
+    is a minute the doctor is on shift and not booked. The whole date range
+    is loaded with a fixed number of queries.
+    """
+
+    def __init__(self, start_date, end_date, doctor_ids=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.doctor_ids = set(doctor_ids) if doctor_ids is not None else None
+        self.shift_masks = {}
+        self.busy_masks = {}
+
+    @classmethod
+    def load(cls, start_date, end_date, doctor_ids=None):
+        availability = cls(start_date, end_date, doctor_ids)
+        availability._load_shifts()
+        availability._load_appointments()
+        return availability
+
+    def dates(self):
+        current = self.start_date
+        while current <= self.end_date:
+            yield current
+            current += timedelta(days=1)
+
+    def _load_shifts(self):
+        weeks = {ShiftRotationManager.get_week_and_year(day) for day in self.dates()}
+        shifts = Shift.objects.filter(ShiftRotationManager.weeks_filter(weeks)).prefetch_related('doctors')
+        for shift in shifts:
+            day = ShiftRotationManager.get_week_start_date(shift.week_of_year, shift.year) + timedelta(days=shift.day_of_week)
+            if not self.start_date <= day <= self.end_date:
+                continue
+            mask = interval_mask(minutes_of_day(shift.start_time), minutes_of_day(shift.end_time))
+            for doctor in shift.doctors.all():
+                if self.doctor_ids is not None and doctor.id not in self.doctor_ids:
+                    continue
+                key = (doctor.id, day)
+                self.shift_masks[key] = self.shift_masks.get(key, 0) | mask
+
+    def _load_appointments(self):
+        # Appointments starting the day before may run past midnight
+        appointments = Appointment.objects.filter(
+            start_date__range=[self.start_date - timedelta(days=1), self.end_date]
+        )
+        if self.doctor_ids is not None:
+            appointments = appointments.filter(doctor_id__in=self.doctor_ids)
+
+        for doctor_id, start, end in appointments.order_by().values_list('doctor_id', 'start_datetime', 'end_datetime'):
+            for day, start_minute, end_minute in split_by_day(start, end):
+                if self.start_date <= day <= self.end_date:
+                    key = (doctor_id, day)
+                    self.busy_masks[key] = self.busy_masks.get(key, 0) | interval_mask(start_minute, end_minute)
+
+    def free_mask(self, doctor_id, day):
+        """Bitset of the minutes the doctor is on shift and not booked"""
+        key = (doctor_id, day)
+        return self.shift_masks.get(key, 0) & ~self.busy_masks.get(key, 0)
+
+    def doctors_on_shift(self):
+        return sorted({doctor_id for doctor_id, day in self.shift_masks})
+
+    def free_slots(self, doctor_id, day, duration, step=15):
+        """Get the (start_minute, end_minute) slots of `duration` minutes starting on the `step` grid"""
+        # Steps of a day or more all keep only midnight
+        starts = run_starts(self.free_mask(doctor_id, day), duration) & grid_mask(min(step, MINUTES_PER_DAY))
+        return [(minute, minute + duration) for minute in iter_bits(starts)]
+
+
+def merge_intervals(intervals):
+    """Merge overlapping or touching (start, end) intervals, sorted by start"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def find_gaps(windows, busy, duration, step, not_before=0, limit=None):
+    """
+    Find slot starts of `duration` minutes inside the shift `windows` that do
+    not overlap the `busy` intervals. Both lists hold sorted, merged
+    (start_minute, end_minute) pairs; slots start on the `step` grid.
+
+    Walks windows and busy intervals with a single cursor each, so a day
+    costs O(windows + appointments + slots).
+    """
+    starts = []
+    busy_index = 0
+    for window_start, window_end in windows:
+        cursor = max(window_start, not_before)
+        cursor = -(-cursor // step) * step
+        while cursor + duration <= window_end:
+            # Skip busy intervals that end before the candidate starts
+            while busy_index < len(busy) and busy[busy_index][1] <= cursor:
+                busy_index += 1
+            if busy_index < len(busy) and busy[busy_index][0] < cursor + duration:
+                cursor = -(-busy[busy_index][1] // step) * step
+                continue
+            starts.append(cursor)
+            if limit is not None and len(starts) >= limit:
+                return starts
+            cursor += step
+    return starts
+
+
+def find_earliest_slots(duration, after, until, limit=5, doctor_ids=None,
+                        day_start=None, day_end=None, step=15):
+    """
+    Find the first `limit` free slots of `duration` minutes with any of the
+    given doctors (all doctors on shift when None), starting at the aware
+    datetime `after` and ending on the date `until`.
+
+    Scans forward in rounds, the first up to the end of the week of `after`
+    and each later one twice as long as the one before, and stops after the
+    round that found enough slots. A round costs two queries, so a search
+    of a year takes at most six rounds. `day_start`/`day_end` (minutes of
+    the day) restrict the time window on every day.
+
+    Returns (doctor_id, start_datetime, end_datetime) tuples ordered by time.
+    """
+    clinic_tz = timezone.get_default_timezone()
+    after = timezone.localtime(after, clinic_tz)
+    window_start = day_start if day_start is not None else 0
+    window_end = day_end if day_end is not None else MINUTES_PER_DAY
+
+    slots = []
+    chunk_start = after.date()
+    chunk_days = 7
+    chunk_end = chunk_start + timedelta(days=6 - chunk_start.weekday())
+    while chunk_start <= until and len(slots) < limit:
+        chunk_end = min(chunk_end, until)
+        weeks = ShiftRotationManager.iter_weeks(
+            *ShiftRotationManager.get_week_and_year(chunk_start), *ShiftRotationManager.get_week_and_year(chunk_end)
+        )
+
+        # Shift windows per day and doctor, clipped to the daily time window
+        windows = {}
+        assignments = Shift.doctors.through.objects.filter(ShiftRotationManager.weeks_filter(weeks, prefix='shift__'))
+        if doctor_ids is not None:
+            assignments = assignments.filter(doctor_id__in=doctor_ids)
+        for doctor_id, year, week_of_year, day_of_week, start_time, end_time in assignments.values_list(
+            'doctor_id', 'shift__year', 'shift__week_of_year', 'shift__day_of_week', 'shift__start_time', 'shift__end_time'
+        ):
+            day = ShiftRotationManager.get_week_start_date(week_of_year, year) + timedelta(days=day_of_week)
+            if not chunk_start <= day <= chunk_end:
+                continue
+            start = max(minutes_of_day(start_time), window_start)
+            end = min(minutes_of_day(end_time), window_end)
+            if end - start >= duration:
+                windows.setdefault(day, {}).setdefault(doctor_id, []).append((start, end))
+
+        if windows:
+            busy = {}
+            appointments = Appointment.objects.filter(
+                doctor_id__in={doctor_id for day_windows in windows.values() for doctor_id in day_windows},
+                start_date__range=[chunk_start - timedelta(days=1), chunk_end]
+            ).order_by().values_list('doctor_id', 'start_datetime', 'end_datetime')
+            for doctor_id, start, end in appointments:
+                for day, start_minute, end_minute in split_by_day(start, end):
+                    busy.setdefault((doctor_id, day), []).append((start_minute, end_minute))
+
+            for day in sorted(windows):
+                if len(slots) >= limit:
+                    break
+                not_before = 0
+                if day == after.date():
+                    not_before = minutes_of_day(after) + (1 if after.second or after.microsecond else 0)
+                needed = limit - len(slots)
+                day_slots = []
+                for doctor_id, doctor_windows in windows[day].items():
+                    for start in find_gaps(
+                        merge_intervals(doctor_windows), merge_intervals(busy.get((doctor_id, day), [])),
+                        duration, step, not_before, limit=needed
+                    ):
+                        day_slots.append((start, doctor_id))
+                for start, doctor_id in sorted(day_slots)[:needed]:
+                    start_datetime = timezone.make_aware(
+                        datetime.combine(day, time(start // 60, start % 60)), clinic_tz
+                    )
+                    slots.append((doctor_id, start_datetime, start_datetime + timedelta(minutes=duration)))
+
+        chunk_start = chunk_end + timedelta(days=1)
+        chunk_days *= 2
+        chunk_end += timedelta(days=chunk_days)
+    return slots
@@ -0,0 +1,225 @@
+import logging
+import platform
+import statistics
+from datetime import datetime, time, timedelta
+from time import perf_counter
+import django
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Max, Min
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..models import Doctor, Service, Shift, Appointment
+from .calendar_cache import invalidate_weeks
+from .shift_rotation import ShiftRotationManager
+
+# Percentiles reported per scenario
+PERCENTILES = (50, 95, 99)
+
+DEFAULT_ITERATIONS = 50
+DEFAULT_WARMUP = 5
+
+# Slowdown of a percentile over the baseline reported as a regression
+DEFAULT_THRESHOLD = 0.25
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(durations, queries, statuses):
+    durations = sorted(durations)
+    summary = {'requests': len(durations)}
+    for percent in PERCENTILES:
+        summary[f'p{percent}_ms'] = round(percentile(durations, percent) * 1000, 3)
+    summary.update({
+        'mean_ms': round(statistics.fmean(durations) * 1000, 3),
+        'max_ms': round(durations[-1] * 1000, 3),
+        'queries': statistics.median_low(queries),
+        'max_queries': max(queries),
+        'statuses': {str(code): statuses.count(code) for code in sorted(set(statuses))},
+    })
+    return summary
+
+
+class ApiBenchmark:
+    """
+    Time the key API paths through the test client against the data in the
+    database. What a write request creates is deleted again after it has
+    been timed, and calendar weeks are dropped from the cache before
+    uncached requests, so every iteration does the same work. Expected
+    client errors, such as conflicting bookings, are not logged.
+    """
+    SCENARIOS = (
+        'calendar_week', 'calendar_week_cached', 'future_week', 'create_appointment',
+        'create_conflicting', 'patient_search', 'generate_week',
+    )
+    # Status every request of a scenario is expected to return
+    EXPECTED_STATUS = {'create_appointment': 201, 'create_conflicting': 400}
+
+    def __init__(self, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP, scenarios=None, progress=None):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.scenarios = scenarios or self.SCENARIOS
+        self.progress = progress
+        self.client = APIClient()
+        # Never saved, so the benchmark writes nothing
+        self.client.force_authenticate(User(username='benchmark', is_staff=True, is_superuser=True))
+        self.queries = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def prepare(self):
+        """Pick the weeks, doctors and appointments the scenarios request"""
+        year = timezone.localdate().year
+        bounds = Appointment.objects.filter(start_date__year=year).aggregate(
+            first=Min('start_date'), last=Max('start_date')
+        )
+        if bounds['first'] is None:
+            raise ValueError(f'There are no appointments in {year}, generate a dataset first')
+        first_week = ShiftRotationManager.get_week_and_year(bounds['first'])
+        last_week = ShiftRotationManager.get_week_and_year(bounds['last'])
+        self.weeks = [
+            week_of_year for week_of_year, week_year in ShiftRotationManager.iter_weeks(*first_week, *last_week)
+            if week_year == year
+        ]
+        self.year = year
+        self.doctors = list(Doctor.objects.values_list('id', flat=True)[:50])
+        self.service = Service.objects.order_by('id').first()
+        self.booked = list(
+            Appointment.objects.filter(start_date__year=year).exclude(service=None)
+            .order_by('start_date', 'id').values('doctor_id', 'service_id', 'start_datetime')[:200]
+        )
+        names = Appointment.objects.values_list('patient_last_name', flat=True).distinct()[:50]
+        self.prefixes = sorted({name[:3] for name in names if len(name) >= 3}) or ['ana']
+        # Usually a week without shifts yet, as when planning ahead
+        self.new_week = ShiftRotationManager.get_week_and_year(
+            ShiftRotationManager.get_week_start_date(*last_week) + timedelta(weeks=1)
+        )
+        self.new_week_existed = Shift.objects.filter(year=self.new_week[1], week_of_year=self.new_week[0]).exists()
+
+    def booking(self, doctor_id, service_id, start):
+        return {
+            'patient_first_name': 'Bench',
+            'patient_last_name': 'Mark',
+            'patient_phone_number': '070 000 000',
+            'doctor_id': doctor_id,
+            'service_id': service_id,
+            'price': str(self.service.price),
+            'duration_minutes': self.service.duration_minutes,
+            'start_datetime': timezone.localtime(start).isoformat(),
+        }
+
+    def request(self, scenario, i):
+        """Send the i-th request of a scenario"""
+        week = self.weeks[i % len(self.weeks)]
+        if scenario in ('calendar_week', 'calendar_week_cached', 'future_week'):
+            kind = 'future' if scenario == 'future_week' else 'week'
+            if scenario != 'calendar_week_cached':
+                invalidate_weeks([(week, self.year)])
+            url = '/api/appointments/future/' if kind == 'future' else '/api/calendar/'
+            return self.client.get(url, {'week': week})
+        if scenario == 'create_appointment':
+            # Sundays have no shifts, so the slot is free but still checked
+            sunday = ShiftRotationManager.get_week_start_date(week, self.year) + timedelta(days=6)
+            start = timezone.make_aware(datetime.combine(sunday, time(10)))
+            data = self.booking(self.doctors[i % len(self.doctors)], self.service.id, start)
+            return self.client.post('/api/appointments/', data, format='json')
+        if scenario == 'create_conflicting':
+            booked = self.booked[i % len(self.booked)]
+            data = self.booking(booked['doctor_id'], booked['service_id'], booked['start_datetime'])
+            return self.client.post('/api/appointments/', data, format='json')
+        if scenario == 'patient_search':
+            return self.client.get('/api/appointments/patients/', {'q': self.prefixes[i % len(self.prefixes)]})
+        if scenario == 'generate_week':
+            week_of_year, year = self.new_week
+            return self.client.post('/api/shifts/generate_week/', {'week': week_of_year, 'year': year}, format='json')
+        raise ValueError(f'Unknown scenario {scenario}')
+
+    def clean_up(self, scenario, response):
+        """Delete what a request created"""
+        if scenario == 'create_appointment' and response.status_code == 201:
+            Appointment.objects.filter(pk=response.data['id']).delete()
+        elif scenario == 'generate_week' and not self.new_week_existed:
+            week_of_year, year = self.new_week
+            Shift.objects.filter(year=year, week_of_year=week_of_year).delete()
+
+    def run_scenario(self, scenario):
+        for i in range(self.warmup):
+            self.clean_up(scenario, self.request(scenario, i))
+        durations, queries, statuses = [], [], []
+        with connection.execute_wrapper(self.count_query):
+            for i in range(self.iterations):
+                self.queries = 0
+                started = perf_counter()
+                response = self.request(scenario, i)
+                durations.append(perf_counter() - started)
+                queries.append(self.queries)
+                statuses.append(response.status_code)
+                self.clean_up(scenario, response)
+        summary = summarize(durations, queries, statuses)
+        expected = self.EXPECTED_STATUS.get(scenario, 200)
+        summary['unexpected'] = sum(1 for status in statuses if status != expected)
+        return summary
+
+    def run(self):
+        # Production settings, without DEBUG's query log and the query budget checks
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(DEBUG=False, CLINIC_QUERY_BUDGETS=False):
+                return self.run_all()
+        finally:
+            request_logger.setLevel(level)
+
+    def run_all(self):
+        self.prepare()
+        results = {
+            'created': timezone.now().isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'doctors': Doctor.objects.count(),
+                'appointments': Appointment.objects.count(),
+                'shifts': Shift.objects.count(),
+            },
+            'iterations': self.iterations,
+            'scenarios': {},
+        }
+        for scenario in self.scenarios:
+            results['scenarios'][scenario] = self.run_scenario(scenario)
+            if self.progress:
+                self.progress(scenario, results['scenarios'][scenario])
+        return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare results with a baseline run. Returns a row per scenario in both,
+    with the current / baseline ratio of each percentile and whether a
+    percentile slowed down by more than threshold or the queries grew.
+    """
+    rows = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if previous is None:
+            continue
+        ratios = {}
+        for percent in PERCENTILES:
+            key = f'p{percent}_ms'
+            ratios[key] = current[key] / previous[key] if previous[key] else None
+        slower = [key for key, ratio in ratios.items() if ratio is not None and ratio > 1 + threshold]
+        rows.append({
+            'scenario': scenario,
+            'ratios': ratios,
+            'queries': (previous['queries'], current['queries']),
+            'regressed': bool(slower) or current['queries'] > previous['queries'],
+        })
+    return rows
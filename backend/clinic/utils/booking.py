@@ -0,0 +1,224 @@
+from bisect import bisect_left
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from ..models import Doctor, Service, Appointment
+from ..signals import appointments_bulk_changed
+
+CONFLICT_MESSAGE = "This appointment conflicts with an existing appointment"
+
+# Fields a bulk update writes back
+UPDATE_FIELDS = [
+    'patient_first_name', 'patient_last_name', 'patient_phone_number', 'doctor', 'service',
+    'custom_service_name', 'price', 'duration_minutes', 'start_datetime', 'end_datetime',
+    *Appointment.DERIVED_FIELDS, 'updated_at',
+]
+
+
+def lock_doctors(doctor_ids):
+    """
+    Serialise bookings of the given doctors until the transaction ends.
+
+    A no-op UPDATE takes the doctor's row lock on PostgreSQL and the write
+    lock on SQLite, which ignores SELECT ... FOR UPDATE. Doctors are locked
+    in id order so concurrent batches cannot deadlock.
+    """
+    for doctor_id in sorted(set(doctor_ids)):
+        Doctor.objects.filter(pk=doctor_id).update(full_name=F('full_name'))
+
+
+def is_doctor_booked(doctor_id, start_datetime, end_datetime, exclude_id=None):
+    """Whether the doctor has an appointment overlapping the interval"""
+    conflicts = Appointment.objects.filter(
+        doctor_id=doctor_id,
+        start_datetime__lt=end_datetime,
+        end_datetime__gt=start_datetime
+    )
+    if exclude_id is not None:
+        conflicts = conflicts.exclude(id=exclude_id)
+    return conflicts.exists()
+
+
+def find_interval_conflicts(existing, candidates):
+    """
+    Find candidate intervals that overlap each other or existing ones.
+
+    `existing` holds (start, end) pairs already booked, `candidates` holds
+    (key, start, end) triples. Each candidate is checked against the
+    existing intervals with a binary search over their starts and a prefix
+    maximum of their ends, then the survivors are swept in start order and
+    the later-starting one of two overlapping candidates is rejected.
+    O((n + m) log(n + m)) overall.
+
+    Returns {key: None} for candidates overlapping an existing interval and
+    {key: other_key} for those overlapping an accepted candidate.
+    """
+    existing = sorted(existing)
+    starts = [start for start, end in existing]
+    max_ends = []
+    for start, end in existing:
+        max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+
+    conflicts = {}
+    survivors = []
+    for key, start, end in candidates:
+        index = bisect_left(starts, end) - 1
+        if index >= 0 and max_ends[index] > start:
+            conflicts[key] = None
+        else:
+            survivors.append((start, end, key))
+
+    accepted_end = None
+    accepted_key = None
+    for start, end, key in sorted(survivors, key=lambda item: (item[0], item[1])):
+        if accepted_end is not None and start < accepted_end:
+            conflicts[key] = accepted_key
+            continue
+        accepted_end, accepted_key = end, key
+    return conflicts
+
+
+def load_doctor_bookings(intervals_by_doctor, exclude_ids=()):
+    """
+    Fetch the booked intervals around the given candidate intervals with
+    one range query per doctor.
+    """
+    existing = {}
+    for doctor_id, intervals in intervals_by_doctor.items():
+        range_start = min(start for start, end in intervals)
+        range_end = max(end for start, end in intervals)
+        existing[doctor_id] = list(
+            Appointment.objects.filter(
+                doctor_id=doctor_id,
+                start_datetime__lt=range_end,
+                end_datetime__gt=range_start
+            ).exclude(id__in=exclude_ids).order_by().values_list('start_datetime', 'end_datetime')
+        )
+    return existing
+
+
+def bulk_write_appointments(items, atomic=True):
+    """
+    Create or update many appointments at once.
+
+    Items with an `id` replace that appointment (like PUT), the others are
+    created. Items are validated without per-item queries, checked for
+    conflicts against the database and each other with one range query per
+    locked doctor, and written with bulk_create/bulk_update in one
+    transaction.
+
+    With `atomic`, nothing is written if any item fails. Otherwise the
+    valid items are written and the failures reported.
+
+    Returns (results, written) where results holds one dict per item with
+    its index, status ('created', 'updated', 'error' or 'skipped'), id and
+    errors.
+    """
+    # Imported here as the serializers use the locking helpers above
+    from ..serializers import BulkAppointmentSerializer
+
+    results = [{'index': index, 'status': None, 'id': None, 'errors': None} for index in range(len(items))]
+    if not items:
+        return results, False
+
+    def ids_of(name):
+        ids = set()
+        for item in items:
+            try:
+                ids.add(int(item.get(name)))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return ids
+
+    context = {
+        'doctors': Doctor.objects.in_bulk(ids_of('doctor_id')),
+        'services': Service.objects.in_bulk(ids_of('service_id')),
+    }
+    instances = Appointment.objects.in_bulk(ids_of('id'))
+
+    # Validate every item without touching the database
+    valid = {}
+    seen_ids = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index].update(status='error', errors={'non_field_errors': ['Expected an object']})
+            continue
+        instance = None
+        if item.get('id') is not None:
+            try:
+                instance = instances.get(int(item['id']))
+            except (TypeError, ValueError):
+                pass
+            if instance is None:
+                results[index].update(status='error', errors={'id': ['Appointment not found']})
+                continue
+            # Items with the same id would share one instance, the last silently winning
+            if instance.pk in seen_ids:
+                results[index].update(status='error', errors={'id': ['Duplicate id in request']})
+                continue
+            seen_ids.add(instance.pk)
+        serializer = BulkAppointmentSerializer(instance, data=item, context=context)
+        if serializer.is_valid():
+            valid[index] = (instance, serializer.validated_data)
+        else:
+            results[index].update(status='error', errors=serializer.errors)
+
+    with transaction.atomic():
+        # Conflict check for all valid items at once
+        candidates_by_doctor = {}
+        for index, (instance, data) in valid.items():
+            start = data['start_datetime']
+            end = start + timedelta(minutes=data['duration_minutes'])
+            candidates_by_doctor.setdefault(data['doctor'].pk, []).append((index, start, end))
+
+        lock_doctors(candidates_by_doctor)
+        existing = load_doctor_bookings(
+            {doctor_id: [(start, end) for index, start, end in candidates] for doctor_id, candidates in candidates_by_doctor.items()},
+            exclude_ids=[instance.pk for instance, data in valid.values() if instance is not None]
+        )
+        for doctor_id, candidates in candidates_by_doctor.items():
+            for index, other in find_interval_conflicts(existing[doctor_id], candidates).items():
+                message = CONFLICT_MESSAGE if other is None else f"This appointment conflicts with item {other}"
+                results[index].update(status='error', errors={'non_field_errors': [message]})
+                del valid[index]
+
+        failed = any(result['status'] == 'error' for result in results)
+        if atomic and failed:
+            for result in results:
+                if result['status'] is None:
+                    result['status'] = 'skipped'
+            return results, False
+
+        created = []
+        updated = []
+        for index, (instance, data) in valid.items():
+            appointment = instance or Appointment()
+            for field, value in data.items():
+                setattr(appointment, field, value)
+            appointment.end_datetime = appointment.start_datetime + timedelta(minutes=appointment.duration_minutes)
+            appointment.populate_derived_fields()
+            (updated if instance else created).append((index, appointment))
+
+        if created:
+            Appointment.objects.bulk_create([appointment for index, appointment in created])
+        if updated:
+            # bulk_update skips auto_now
+            now = timezone.now()
+            for index, appointment in updated:
+                appointment.updated_at = now
+            Appointment.objects.bulk_update([appointment for index, appointment in updated], UPDATE_FIELDS)
+
+        for index, appointment in created:
+            results[index].update(status='created', id=appointment.pk)
+        for index, appointment in updated:
+            results[index].update(status='updated', id=appointment.pk)
+
+        if created or updated:
+            appointments_bulk_changed.send(
+                sender=Appointment,
+                created=[appointment for index, appointment in created],
+                updated=[appointment for index, appointment in updated],
+                deleted=[],
+            )
+    return results, bool(created or updated)
@@ -0,0 +1,133 @@
+from datetime import timedelta
+from django.db.models import Count, Sum
+from ..models import Appointment
+from .fast_serializers import appointment_values, serialize_appointments, serialize_calendar_appointments
+from .shift_rotation import ShiftRotationManager
+
+
+def group_appointments_by_day(appointments):
+    """Group appointment rows by their clinic-local start date in a single pass"""
+    grouped = {}
+    for appointment in appointments:
+        grouped.setdefault(appointment['start_date'], []).append(appointment)
+    return grouped
+
+
+def get_week_appointments(week_start, week_end):
+    """Fetch the rows of every appointment of a week with one indexed query"""
+    return appointment_values(Appointment.objects.filter(start_date__range=[week_start, week_end]))
+
+
+def week_bounds(week_of_year, year):
+    week_start = ShiftRotationManager.get_week_start_date(week_of_year, year)
+    return week_start, week_start + timedelta(days=6)
+
+
+def week_calendar_payload(week_start, appointments, shift_schedule):
+    """Calendar payload of a week, keyed by day name, from its appointment rows and shift schedule"""
+    appointments_by_day = group_appointments_by_day(appointments)
+    calendar_data = {}
+    for day in range(7):
+        current_date = week_start + timedelta(days=day)
+        day_name = current_date.strftime('%A')
+        calendar_data[day_name] = {
+            'date': current_date.strftime('%Y-%m-%d'),
+            'day_name': day_name,
+            'shifts': shift_schedule.get(day_name, {}),
+            'appointments': serialize_calendar_appointments(appointments_by_day.get(current_date, []))
+        }
+    return calendar_data
+
+
+def future_week_payload(week_start, appointments):
+    """Future appointments payload of a week, keyed by date, from its appointment rows"""
+    appointments_by_day = group_appointments_by_day(appointments)
+    calendar_data = {}
+    for day in range(7):
+        current_date = week_start + timedelta(days=day)
+        calendar_data[current_date.strftime('%Y-%m-%d')] = {
+            'date': current_date.strftime('%Y-%m-%d'),
+            'day_name': current_date.strftime('%A'),
+            'appointments': serialize_appointments(appointments_by_day.get(current_date, []))
+        }
+    return calendar_data
+
+
+def build_week_calendar(week_of_year, year):
+    """
+    Build the calendar payload for a week, keyed by day name.
+
+    Appointments, shifts and shift doctors are each fetched with a single
+    query and grouped by day in memory.
+    """
+    week_start, week_end = week_bounds(week_of_year, year)
+    return week_calendar_payload(
+        week_start,
+        get_week_appointments(week_start, week_end),
+        ShiftRotationManager.get_shift_schedule_for_week(week_of_year, year),
+    )
+
+
+def build_future_week(week_of_year, year):
+    """Build the future appointments payload for a week, keyed by date"""
+    week_start, week_end = week_bounds(week_of_year, year)
+    return future_week_payload(week_start, get_week_appointments(week_start, week_end))
+
+
+def build_range_calendar(start_date, end_date, compact=False):
+    """
+    Build the calendar payload of every day from start_date to end_date,
+    keyed by date. Appointments (or, in compact mode, their per-doctor
+    counts and booked minutes) and shifts with their doctors take three
+    queries for any span.
+    """
+    shift_schedule = ShiftRotationManager.get_shift_schedule_for_range(start_date, end_date)
+    appointments = Appointment.objects.filter(start_date__range=[start_date, end_date])
+    if compact:
+        totals = appointments.values('start_date', 'doctor_id', 'doctor__full_name').annotate(
+            appointment_count=Count('id'), booked_minutes=Sum('duration_minutes')
+        ).order_by('start_date', 'doctor_id')
+        doctors_by_day = {}
+        for row in totals:
+            doctors_by_day.setdefault(row['start_date'], []).append({
+                'id': row['doctor_id'],
+                'full_name': row['doctor__full_name'],
+                'appointment_count': row['appointment_count'],
+                'booked_minutes': row['booked_minutes'],
+            })
+    else:
+        appointments_by_day = group_appointments_by_day(appointment_values(appointments))
+
+    calendar_data = {}
+    current_date = start_date
+    while current_date <= end_date:
+        day = {
+            'date': current_date.strftime('%Y-%m-%d'),
+            'day_name': current_date.strftime('%A'),
+            'shifts': shift_schedule.get(current_date, {}),
+        }
+        if compact:
+            doctors = doctors_by_day.get(current_date, [])
+            day['appointment_count'] = sum(doctor['appointment_count'] for doctor in doctors)
+            day['booked_minutes'] = sum(doctor['booked_minutes'] for doctor in doctors)
+            day['doctors'] = doctors
+        else:
+            day['appointments'] = serialize_calendar_appointments(appointments_by_day.get(current_date, []))
+        calendar_data[day['date']] = day
+        current_date += timedelta(days=1)
+    return calendar_data
+
+
+async def abuild_week_calendar(week_of_year, year):
+    """Async build_week_calendar, fetching with the async ORM"""
+    week_start, week_end = week_bounds(week_of_year, year)
+    appointments = [row async for row in get_week_appointments(week_start, week_end).aiterator()]
+    shift_schedule = await ShiftRotationManager.aget_shift_schedule_for_week(week_of_year, year)
+    return week_calendar_payload(week_start, appointments, shift_schedule)
+
+
+async def abuild_future_week(week_of_year, year):
+    """Async build_future_week, fetching with the async ORM"""
+    week_start, week_end = week_bounds(week_of_year, year)
+    appointments = [row async for row in get_week_appointments(week_start, week_end).aiterator()]
+    return future_week_payload(week_start, appointments)
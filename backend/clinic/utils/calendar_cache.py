@@ -0,0 +1,189 @@
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from ..models import Doctor, Service, Shift, Appointment
+from ..signals import shifts_bulk_changed, appointments_bulk_changed
+from .calendar import abuild_future_week, abuild_week_calendar, build_future_week, build_week_calendar
+from .shift_rotation import ShiftRotationManager
+
+# Cached payload kinds and their builders
+BUILDERS = {
+    'week': build_week_calendar,
+    'future': build_future_week,
+}
+
+# Their async counterparts, for the async views
+ASYNC_BUILDERS = {
+    'week': abuild_week_calendar,
+    'future': abuild_future_week,
+}
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def get_cache():
+    return caches[getattr(settings, 'CLINIC_CALENDAR_CACHE', 'default')]
+
+
+def cache_key(kind, week_start):
+    return f'clinic:calendar:{kind}:{week_start.isoformat()}'
+
+
+def week_start_of(day):
+    """Monday of the week containing a date"""
+    return day - timedelta(days=day.weekday())
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def get_cache_stats():
+    """Hit, miss and invalidation counters of this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def get_cached_week(kind, week_of_year, year):
+    """
+    Get a calendar payload of a week from the cache, building and storing it
+    on a miss. Weeks are keyed by their Monday, so equivalent (week, year)
+    spellings share one entry.
+    """
+    week_start = ShiftRotationManager.get_week_start_date(week_of_year, year)
+    key = cache_key(kind, week_start)
+    cache = get_cache()
+
+    payload = cache.get(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+
+    _count('misses')
+    week_of_year, year = ShiftRotationManager.get_week_and_year(week_start)
+    payload = BUILDERS[kind](week_of_year, year)
+    cache.set(key, payload, getattr(settings, 'CLINIC_CALENDAR_CACHE_TIMEOUT', 3600))
+    return payload
+
+
+async def aget_cached_week(kind, week_of_year, year):
+    """Async get_cached_week, building a missing week with the async ORM"""
+    week_start = ShiftRotationManager.get_week_start_date(week_of_year, year)
+    key = cache_key(kind, week_start)
+    cache = get_cache()
+
+    payload = await cache.aget(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+
+    _count('misses')
+    week_of_year, year = ShiftRotationManager.get_week_and_year(week_start)
+    payload = await ASYNC_BUILDERS[kind](week_of_year, year)
+    await cache.aset(key, payload, getattr(settings, 'CLINIC_CALENDAR_CACHE_TIMEOUT', 3600))
+    return payload
+
+
+def invalidate_week_starts(week_starts):
+    """Drop the cached payloads of the weeks starting on the given Mondays"""
+    keys = [cache_key(kind, week_start) for week_start in set(week_starts) for kind in BUILDERS]
+    if not keys:
+        return
+
+    def delete():
+        get_cache().delete_many(keys)
+        _count('invalidations', len(keys))
+
+    # Drop now, and again once the transaction commits in case a concurrent
+    # request rebuilt a week from data read before the commit
+    delete()
+    transaction.on_commit(delete)
+
+
+def invalidate_dates(dates):
+    invalidate_week_starts(week_start_of(day) for day in dates if day is not None)
+
+
+def invalidate_weeks(weeks):
+    invalidate_week_starts(
+        ShiftRotationManager.get_week_start_date(week_of_year, year) for week_of_year, year in weeks
+    )
+
+
+def appointment_changed(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    invalidate_dates([instance.start_date, loaded.get('start_date')])
+
+
+def appointments_bulk_changed_handler(sender, created=(), updated=(), deleted=(), dates=(), **kwargs):
+    dates = list(dates)
+    for appointment in [*created, *updated, *deleted]:
+        dates.append(appointment.start_date)
+        dates.append(getattr(appointment, '_loaded_values', {}).get('start_date'))
+    invalidate_dates(dates)
+
+
+def shift_changed(sender, instance, **kwargs):
+    weeks = [(instance.week_of_year, instance.year)]
+    loaded = getattr(instance, '_loaded_values', {})
+    if 'week_of_year' in loaded and 'year' in loaded:
+        weeks.append((loaded['week_of_year'], loaded['year']))
+    invalidate_weeks(weeks)
+
+
+def shifts_bulk_changed_handler(sender, weeks=(), **kwargs):
+    invalidate_weeks(weeks)
+
+
+def shift_doctors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_weeks([(instance.week_of_year, instance.year)])
+        return
+
+    # Changed from the doctor side: pk_set holds shift ids (None on clear)
+    shifts = Shift.objects.all() if pk_set is None else Shift.objects.filter(pk__in=pk_set)
+    if pk_set is None:
+        shifts = shifts.filter(doctors=instance)
+    invalidate_weeks(shifts.values_list('week_of_year', 'year').distinct())
+
+
+def doctor_changed(sender, instance, **kwargs):
+    """A doctor's name or picture appears in every week they work or have bookings"""
+    invalidate_dates(instance.appointments.values_list('start_date', flat=True).distinct())
+    invalidate_weeks(instance.shifts.values_list('week_of_year', 'year').distinct())
+
+
+def service_changed(sender, instance, **kwargs):
+    invalidate_dates(instance.appointments.values_list('start_date', flat=True).distinct())
+
+
+def connect_signals():
+    dispatch_uid = 'clinic_calendar_cache'
+    post_save.connect(appointment_changed, sender=Appointment, dispatch_uid=dispatch_uid)
+    post_delete.connect(appointment_changed, sender=Appointment, dispatch_uid=dispatch_uid)
+    appointments_bulk_changed.connect(appointments_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    post_save.connect(shift_changed, sender=Shift, dispatch_uid=dispatch_uid)
+    post_delete.connect(shift_changed, sender=Shift, dispatch_uid=dispatch_uid)
+    shifts_bulk_changed.connect(shifts_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    m2m_changed.connect(shift_doctors_changed, sender=Shift.doctors.through, dispatch_uid=dispatch_uid)
+    post_save.connect(doctor_changed, sender=Doctor, dispatch_uid=dispatch_uid)
+    # Related rows are gone (or set to NULL) after the delete, so look them up before
+    pre_delete.connect(doctor_changed, sender=Doctor, dispatch_uid=dispatch_uid)
+    post_save.connect(service_changed, sender=Service, dispatch_uid=dispatch_uid)
+    pre_delete.connect(service_changed, sender=Service, dispatch_uid=dispatch_uid)
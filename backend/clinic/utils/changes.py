@@ -0,0 +1,303 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Exists, Max, Min, OuterRef
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.utils import timezone
+from ..models import Appointment, ChangeLog, Doctor, Service, Shift
+from ..serializers import ShiftSerializer
+from ..signals import appointments_bulk_changed, shifts_bulk_changed
+from .fast_serializers import appointment_values, serialize_appointments
+from .shift_rotation import ShiftRotationManager
+
+# Entries returned by one feed request
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+# Longest long-poll wait, and how often a waiting request checks the cache
+MAX_WAIT_SECONDS = 25
+WAIT_INTERVAL = 0.25
+
+# Entries inserted per query
+BATCH_SIZE = 500
+
+# Compact the log whenever its seq passes another multiple of this
+DEFAULT_COMPACT_EVERY = 10_000
+
+DEFAULT_RETENTION_DAYS = 7
+
+LATEST_KEY = 'clinic:changes:latest'
+
+
+class ChangesExpired(Exception):
+    """The changes after a cursor were dropped by retention, so the client must reload"""
+    def __init__(self, oldest):
+        super().__init__(f'Changes before {oldest} are no longer kept')
+        self.oldest = oldest
+
+
+def get_cache():
+    return caches[getattr(settings, 'CLINIC_CHANGES_CACHE', 'default')]
+
+
+def get_retention():
+    return timedelta(days=getattr(settings, 'CLINIC_CHANGE_LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+
+
+def log_changes(object_type, ids, action='upsert'):
+    """Append an entry per object id, and announce the new seq once committed"""
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return
+    now = timezone.now()
+    entries = [ChangeLog(object_type=object_type, object_id=object_id, action=action, changed_at=now) for object_id in ids]
+    if len(entries) == 1:
+        entries[0].save()
+    else:
+        ChangeLog.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+    seqs = [entry.seq for entry in entries if entry.seq is not None]
+    if seqs:
+        transaction.on_commit(lambda: committed(min(seqs), max(seqs)))
+
+
+def committed(first, last):
+    """Wake up long polls, and compact when the log grew past another multiple of CLINIC_CHANGE_LOG_COMPACT_EVERY"""
+    get_cache().set(LATEST_KEY, last, None)
+    every = getattr(settings, 'CLINIC_CHANGE_LOG_COMPACT_EVERY', DEFAULT_COMPACT_EVERY)
+    if every and (first - 1) // every != last // every:
+        compact()
+
+
+def touch_shifts(shift_ids):
+    """Bump updated_at of shifts whose doctors changed and log them"""
+    shift_ids = list(shift_ids)
+    if shift_ids:
+        Shift.objects.filter(pk__in=shift_ids).update(updated_at=timezone.now())
+        log_changes('shift', shift_ids)
+
+
+def appointment_saved(sender, instance, **kwargs):
+    log_changes('appointment', [instance.pk])
+
+
+def appointment_deleted(sender, instance, origin=None, **kwargs):
+    # A deleted doctor logs all of their appointments at once
+    if isinstance(origin, Doctor) or getattr(origin, 'model', None) is Doctor:
+        return
+    log_changes('appointment', [instance.pk], 'delete')
+
+
+def appointments_bulk_changed_handler(sender, created=(), updated=(), deleted=(), dates=(), **kwargs):
+    upserted = [appointment.pk for appointment in [*created, *updated]]
+    if dates:
+        # Writers without instances: every appointment of those days
+        upserted += Appointment.objects.filter(start_date__in=list(dates)).values_list('id', flat=True)
+    log_changes('appointment', upserted)
+    log_changes('appointment', [appointment.pk for appointment in deleted], 'delete')
+
+
+def shift_saved(sender, instance, **kwargs):
+    log_changes('shift', [instance.pk])
+
+
+def shift_deleted(sender, instance, **kwargs):
+    log_changes('shift', [instance.pk], 'delete')
+
+
+def shifts_bulk_changed_handler(sender, weeks=(), shift_ids=None, **kwargs):
+    if shift_ids is None:
+        # Senders that only know the weeks: every shift of those weeks
+        shift_ids = Shift.objects.filter(ShiftRotationManager.weeks_filter(weeks)).values_list('id', flat=True) if weeks else []
+    touch_shifts(shift_ids)
+
+
+def shift_doctors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        touch_shifts([instance.pk])
+    elif pk_set is None:
+        # Cleared from the doctor side
+        touch_shifts(instance.shifts.values_list('id', flat=True))
+    else:
+        touch_shifts(pk_set)
+
+
+def doctor_deleting(sender, instance, **kwargs):
+    # Their appointments and shift assignments go without signals of their own
+    log_changes('appointment', instance.appointments.values_list('id', flat=True), 'delete')
+    touch_shifts(instance.shifts.values_list('id', flat=True))
+
+
+def service_deleting(sender, instance, **kwargs):
+    # Its appointments become custom ones in an UPDATE without signals
+    ids = list(instance.appointments.values_list('id', flat=True))
+    if ids:
+        Appointment.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+        log_changes('appointment', ids)
+
+
+def parse_feed_params(params):
+    """since, limit and wait of a feed request, since None when not given"""
+    since = params.get('since')
+    since = int(since) if since else None
+    limit = int(params.get('limit') or DEFAULT_LIMIT)
+    wait = float(params.get('wait') or 0)
+    if since is not None and since < 0:
+        raise ValueError('since must not be negative')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+    if not 0 <= wait <= MAX_WAIT_SECONDS:
+        raise ValueError(f'wait must be between 0 and {MAX_WAIT_SECONDS} seconds')
+    return since, limit, wait
+
+
+def latest_seq():
+    return ChangeLog.objects.aggregate(latest=Max('seq'))['latest'] or 0
+
+
+def oldest_seq():
+    """The earliest cursor the log can still answer for"""
+    oldest = ChangeLog.objects.aggregate(oldest=Min('seq'))['oldest']
+    return oldest - 1 if oldest is not None else 0
+
+
+def fetch_changes(since, limit):
+    entries = list(
+        ChangeLog.objects.filter(seq__gt=since).order_by('seq').values_list('seq', 'object_type', 'object_id', 'action')[:limit + 1]
+    )
+    return entries[:limit], len(entries) > limit
+
+
+def build_changes(since, entries, has_more):
+    """
+    The current state of every object changed in entries, and the ids of the
+    deleted ones. An object changed several times is listed once, as it is now.
+    """
+    latest = {}
+    for seq, object_type, object_id, action in entries:
+        latest[object_type, object_id] = action
+    ids = {'appointment': [], 'shift': []}
+    deleted = {'appointment': [], 'shift': []}
+    for (object_type, object_id), action in latest.items():
+        (deleted if action == 'delete' else ids)[object_type].append(object_id)
+
+    appointments = []
+    if ids['appointment']:
+        appointments = serialize_appointments(
+            appointment_values(Appointment.objects.filter(pk__in=ids['appointment']).order_by('id'))
+        )
+    shifts = []
+    if ids['shift']:
+        shifts = ShiftSerializer(
+            Shift.objects.filter(pk__in=ids['shift']).prefetch_related('doctors').order_by('id'), many=True
+        ).data
+    return {
+        'since': since,
+        'cursor': entries[-1][0] if entries else since,
+        'has_more': has_more,
+        'appointments': appointments,
+        'shifts': shifts,
+        'deleted': {'appointments': sorted(deleted['appointment']), 'shifts': sorted(deleted['shift'])},
+    }
+
+
+def changes_since(since, limit=DEFAULT_LIMIT, wait=0):
+    """
+    Appointments and shifts changed after the since cursor, and the cursor
+    to ask with next. Without changes yet, waits up to wait seconds for one.
+    Raises ChangesExpired when since is older than the log.
+    """
+    oldest = oldest_seq()
+    if since < oldest:
+        raise ChangesExpired(oldest)
+    entries, has_more = fetch_changes(since, limit)
+    if not entries and wait > 0 and wait_for_change(since, wait):
+        entries, has_more = fetch_changes(since, limit)
+    return build_changes(since, entries, has_more)
+
+
+def fetch_and_build(since, limit):
+    return build_changes(since, *fetch_changes(since, limit))
+
+
+async def achanges_since(since, limit=DEFAULT_LIMIT, wait=0):
+    """changes_since for async views, waiting in the event loop"""
+    changes = await sync_to_async(changes_since)(since, limit)
+    if changes['cursor'] == since and wait > 0 and await await_change(since, wait):
+        changes = await sync_to_async(fetch_and_build)(since, limit)
+    return changes
+
+
+def has_news(since):
+    latest = get_cache().get(LATEST_KEY)
+    return latest is not None and latest > since
+
+
+def wait_for_change(since, timeout):
+    """
+    Wait for a commit past since, watching the cache rather than the
+    database. Returns whether one was announced in time.
+    """
+    deadline = time.monotonic() + timeout
+    while not has_news(since):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(WAIT_INTERVAL, remaining))
+    return True
+
+
+async def await_change(since, timeout):
+    """wait_for_change without blocking the event loop"""
+    deadline = time.monotonic() + timeout
+    while True:
+        latest = await get_cache().aget(LATEST_KEY)
+        if latest is not None and latest > since:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(WAIT_INTERVAL, remaining))
+
+
+def compact(retention=None):
+    """
+    Drop entries superseded by a newer entry of the same object, then
+    entries older than the retention period. The oldest seq left tells
+    clients how far back the log reaches, so only retention moves it: the
+    oldest entry is never dropped as superseded and the newest never expires.
+    Returns how many entries were deleted by each step.
+    """
+    retention = get_retention() if retention is None else retention
+    with transaction.atomic():
+        bounds = ChangeLog.objects.aggregate(oldest=Min('seq'), latest=Max('seq'))
+        if bounds['oldest'] is None:
+            return {'superseded': 0, 'expired': 0}
+        superseded_count, _ = ChangeLog.objects.filter(
+            Exists(ChangeLog.objects.filter(
+                object_type=OuterRef('object_type'), object_id=OuterRef('object_id'), seq__gt=OuterRef('seq')
+            )),
+            seq__gt=bounds['oldest'],
+        ).delete()
+        expired_count, _ = ChangeLog.objects.filter(
+            changed_at__lt=timezone.now() - retention, seq__lt=bounds['latest']
+        ).delete()
+    return {'superseded': superseded_count, 'expired': expired_count}
+
+
+def connect_signals():
+    dispatch_uid = 'clinic_changes'
+    post_save.connect(appointment_saved, sender=Appointment, dispatch_uid=dispatch_uid)
+    post_delete.connect(appointment_deleted, sender=Appointment, dispatch_uid=dispatch_uid)
+    appointments_bulk_changed.connect(appointments_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    post_save.connect(shift_saved, sender=Shift, dispatch_uid=dispatch_uid)
+    post_delete.connect(shift_deleted, sender=Shift, dispatch_uid=dispatch_uid)
+    shifts_bulk_changed.connect(shifts_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    m2m_changed.connect(shift_doctors_changed, sender=Shift.doctors.through, dispatch_uid=dispatch_uid)
+    pre_delete.connect(doctor_deleting, sender=Doctor, dispatch_uid=dispatch_uid)
+    pre_delete.connect(service_deleting, sender=Service, dispatch_uid=dispatch_uid)
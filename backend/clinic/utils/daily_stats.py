@@ -0,0 +1,320 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import ExtractMonth
+from django.db.models.signals import post_delete, post_save, pre_delete
+from ..models import Appointment, DailyDoctorServiceStats, DailyDoctorStats, Doctor, Service
+from ..signals import appointments_bulk_changed
+from .fast_serializers import decimal_formatter
+
+# Appointment fields the rollup is computed from
+STATS_FIELDS = ('doctor_id', 'start_date', 'service_id', 'duration_minutes', 'price')
+
+# Measures kept per row of both rollup tables
+MEASURES = ('appointment_count', 'booked_minutes', 'revenue')
+
+# Days rebuilt per transaction by rebuild_stats
+REBUILD_CHUNK_DAYS = 31
+
+format_revenue = decimal_formatter(DailyDoctorStats._meta.get_field('revenue'))
+
+
+def current_values(appointment):
+    return tuple(getattr(appointment, field) for field in STATS_FIELDS)
+
+
+def stored_values(appointment):
+    """
+    The rollup inputs of an appointment as they were loaded from the database,
+    or None for one that was never loaded. Fields that were not loaded are
+    assumed unchanged.
+    """
+    loaded = getattr(appointment, '_loaded_values', None)
+    if loaded is None:
+        return None
+    return tuple(loaded.get(field, getattr(appointment, field)) for field in STATS_FIELDS)
+
+
+def apply_delta(values, sign):
+    """Add (sign 1) or remove (sign -1) one appointment's values to or from its rollup rows"""
+    doctor_id, day, service_id, duration_minutes, price = values
+    deltas = {
+        'appointment_count': sign,
+        'booked_minutes': sign * duration_minutes,
+        'revenue': sign * Decimal(price),
+    }
+    for model, key in (
+        (DailyDoctorStats, {'doctor_id': doctor_id, 'date': day}),
+        (DailyDoctorServiceStats, {'doctor_id': doctor_id, 'date': day, 'service_id': service_id}),
+    ):
+        if sign > 0:
+            model.objects.bulk_create([model(**key)], ignore_conflicts=True)
+        # Increments in the UPDATE itself, so concurrent writers never lose one
+        model.objects.filter(**key).update(**{field: F(field) + delta for field, delta in deltas.items()})
+        if sign < 0:
+            model.objects.filter(**key, appointment_count__lte=0).delete()
+
+
+def appointment_saved(sender, instance, created, **kwargs):
+    new = current_values(instance)
+    old = None if created else stored_values(instance)
+    if old == new:
+        return
+    with transaction.atomic(savepoint=False):
+        if created:
+            apply_delta(new, 1)
+        elif old is None:
+            # Saved without being loaded, so what it replaced is unknown
+            rebuild_keys([(instance.doctor_id, instance.start_date)])
+        else:
+            apply_delta(old, -1)
+            apply_delta(new, 1)
+
+
+def appointment_deleted(sender, instance, origin=None, **kwargs):
+    # A deleted doctor takes their rollup rows along
+    if isinstance(origin, Doctor) or getattr(origin, 'model', None) is Doctor:
+        return
+    with transaction.atomic(savepoint=False):
+        apply_delta(stored_values(instance) or current_values(instance), -1)
+
+
+def appointments_bulk_changed_handler(sender, created=(), updated=(), deleted=(), dates=(), **kwargs):
+    keys = set()
+    for appointment in [*created, *updated, *deleted]:
+        keys.add((appointment.doctor_id, appointment.start_date))
+        stored = stored_values(appointment)
+        if stored is not None:
+            keys.add(stored[:2])
+    rebuild_keys(keys, dates)
+
+
+def service_deleting(sender, instance, **kwargs):
+    # Its appointments become custom ones without signals, so the days it
+    # was booked on are rebuilt once it is gone
+    instance._daily_stats_keys = list(
+        DailyDoctorServiceStats.objects.filter(service=instance).values_list('doctor_id', 'date')
+    )
+
+
+def service_deleted(sender, instance, **kwargs):
+    rebuild_keys(getattr(instance, '_daily_stats_keys', []))
+
+
+def aggregate_appointments(appointments):
+    """
+    Rollup rows of the given appointments, as unsaved DailyDoctorStats and
+    DailyDoctorServiceStats instances, from one grouped query
+    """
+    rows = appointments.values('doctor_id', 'start_date', 'service_id').annotate(
+        appointment_count=Count('id'), booked_minutes=Sum('duration_minutes'), revenue=Sum('price')
+    ).order_by()
+    totals = {}
+    services = []
+    for row in rows:
+        measures = {field: row[field] for field in MEASURES}
+        services.append(DailyDoctorServiceStats(
+            doctor_id=row['doctor_id'], date=row['start_date'], service_id=row['service_id'], **measures
+        ))
+        total = totals.get((row['doctor_id'], row['start_date']))
+        if total is None:
+            totals[row['doctor_id'], row['start_date']] = DailyDoctorStats(
+                doctor_id=row['doctor_id'], date=row['start_date'], **measures
+            )
+        else:
+            for field in MEASURES:
+                setattr(total, field, getattr(total, field) + measures[field])
+    return list(totals.values()), services
+
+
+def rebuild(stats_filter, appointment_filter):
+    """Replace the rollup rows matching stats_filter with those of the appointments matching appointment_filter"""
+    totals, services = aggregate_appointments(Appointment.objects.filter(appointment_filter))
+    with transaction.atomic(savepoint=False):
+        DailyDoctorStats.objects.filter(stats_filter).delete()
+        DailyDoctorServiceStats.objects.filter(stats_filter).delete()
+        DailyDoctorStats.objects.bulk_create(totals, batch_size=2000)
+        DailyDoctorServiceStats.objects.bulk_create(services, batch_size=2000)
+    return len(totals)
+
+
+def rebuild_keys(keys, dates=()):
+    """
+    Rebuild the rollup of the given (doctor_id, date) keys, and of every
+    doctor on the given dates, with a fixed number of queries
+    """
+    keys = {(doctor_id, day) for doctor_id, day in keys if day is not None}
+    dates = {day for day in dates if day is not None}
+    if not keys and not dates:
+        return 0
+    # The doctors x dates rectangle around the keys, rebuilding a few
+    # unchanged rows is cheaper than a condition per key
+    doctor_ids = {doctor_id for doctor_id, day in keys}
+    key_dates = {day for doctor_id, day in keys}
+    stats_filter = Q(date__in=dates) | Q(doctor_id__in=doctor_ids, date__in=key_dates)
+    appointment_filter = Q(start_date__in=dates) | Q(doctor_id__in=doctor_ids, start_date__in=key_dates)
+    return rebuild(stats_filter, appointment_filter)
+
+
+def stats_bounds(start_date=None, end_date=None):
+    """The given range, with missing ends taken from the appointments and rollup rows"""
+    if start_date is None or end_date is None:
+        appointments = Appointment.objects.aggregate(first=Min('start_date'), last=Max('start_date'))
+        stats = DailyDoctorStats.objects.aggregate(first=Min('date'), last=Max('date'))
+        firsts = [day for day in (appointments['first'], stats['first']) if day is not None]
+        lasts = [day for day in (appointments['last'], stats['last']) if day is not None]
+        if not firsts:
+            return None, None
+        start_date = start_date or min(firsts)
+        end_date = end_date or max(lasts)
+    return start_date, end_date
+
+
+def iter_chunks(start_date, end_date, days):
+    current = start_date
+    while current <= end_date:
+        chunk_end = min(current + timedelta(days=days - 1), end_date)
+        yield current, chunk_end
+        current = chunk_end + timedelta(days=1)
+
+
+def rebuild_stats(start_date=None, end_date=None, chunk_days=REBUILD_CHUNK_DAYS, progress=None):
+    """
+    Rebuild the rollup from the appointments table, for backfills and after
+    writes that bypass the signals. Runs one transaction per chunk of days,
+    returning the number of (doctor, date) rows written.
+    """
+    start_date, end_date = stats_bounds(start_date, end_date)
+    if start_date is None:
+        return 0
+    written = 0
+    for chunk_start, chunk_end in iter_chunks(start_date, end_date, chunk_days):
+        written += rebuild(
+            Q(date__range=[chunk_start, chunk_end]), Q(start_date__range=[chunk_start, chunk_end])
+        )
+        if progress:
+            progress(chunk_end, written)
+    return written
+
+
+def find_inconsistencies(start_date=None, end_date=None, chunk_days=REBUILD_CHUNK_DAYS):
+    """
+    Compare the rollup with the appointments table. Returns a dict per row
+    that differs, with its doctor_id, date, service_id (absent for the daily
+    totals) and the expected and stored measures, None for a missing row.
+    """
+    start_date, end_date = stats_bounds(start_date, end_date)
+    if start_date is None:
+        return []
+    mismatches = []
+    for chunk_start, chunk_end in iter_chunks(start_date, end_date, chunk_days):
+        totals, services = aggregate_appointments(
+            Appointment.objects.filter(start_date__range=[chunk_start, chunk_end])
+        )
+        for model, expected_rows, key_fields in (
+            (DailyDoctorStats, totals, ('doctor_id', 'date')),
+            (DailyDoctorServiceStats, services, ('doctor_id', 'date', 'service_id')),
+        ):
+            expected = {
+                tuple(getattr(row, field) for field in key_fields): tuple(getattr(row, field) for field in MEASURES)
+                for row in expected_rows
+            }
+            stored = {
+                row[:len(key_fields)]: row[len(key_fields):]
+                for row in model.objects.filter(date__range=[chunk_start, chunk_end]).values_list(*key_fields, *MEASURES)
+            }
+            for key in sorted(expected.keys() | stored.keys(), key=lambda key: tuple(str(part) for part in key)):
+                if expected.get(key) != stored.get(key):
+                    mismatch = dict(zip(key_fields, key))
+                    mismatch['expected'] = dict(zip(MEASURES, expected[key])) if key in expected else None
+                    mismatch['stored'] = dict(zip(MEASURES, stored[key])) if key in stored else None
+                    mismatches.append(mismatch)
+    return mismatches
+
+
+def format_measures(row):
+    return {
+        'appointment_count': row['appointment_count'],
+        'booked_minutes': row['booked_minutes'],
+        'revenue': format_revenue(row['revenue']),
+    }
+
+
+def add_measures(total, row):
+    total['appointment_count'] += row['appointment_count']
+    total['booked_minutes'] += row['booked_minutes']
+    total['revenue'] += Decimal(row['revenue'])
+
+
+def daily_report(start_date, end_date, doctor_ids=None):
+    """Per doctor and day rollup rows of a date range with their per-service breakdown, from two queries"""
+    stats_filter = Q(date__range=[start_date, end_date])
+    if doctor_ids is not None:
+        stats_filter &= Q(doctor_id__in=doctor_ids)
+
+    services = {}
+    for row in DailyDoctorServiceStats.objects.filter(stats_filter).values(
+        'doctor_id', 'date', 'service_id', 'service__name', *MEASURES
+    ).order_by('service_id'):
+        services.setdefault((row['doctor_id'], row['date']), []).append({
+            'id': row['service_id'],
+            'name': row['service__name'],
+            **format_measures(row),
+        })
+
+    days = []
+    for row in DailyDoctorStats.objects.filter(stats_filter).values(
+        'doctor_id', 'doctor__full_name', 'date', *MEASURES
+    ).order_by('date', 'doctor_id'):
+        days.append({
+            'date': row['date'].strftime('%Y-%m-%d'),
+            'doctor': {'id': row['doctor_id'], 'full_name': row['doctor__full_name']},
+            **format_measures(row),
+            'services': services.get((row['doctor_id'], row['date']), []),
+        })
+    return days
+
+
+def monthly_report(year, doctor_ids=None):
+    """
+    Appointments, booked minutes and revenue by doctor by month of a year,
+    summed in one query over the rollup. Every doctor gets all 12 months.
+    """
+    stats = DailyDoctorStats.objects.filter(date__range=[date(year, 1, 1), date(year, 12, 31)])
+    if doctor_ids is not None:
+        stats = stats.filter(doctor_id__in=doctor_ids)
+    rows = stats.annotate(month=ExtractMonth('date')).values('doctor_id', 'doctor__full_name', 'month').annotate(
+        count=Sum('appointment_count'), minutes=Sum('booked_minutes'), amount=Sum('revenue')
+    ).order_by('doctor__full_name', 'doctor_id', 'month')
+
+    empty = lambda: {'appointment_count': 0, 'booked_minutes': 0, 'revenue': Decimal('0')}
+    doctors = {}
+    year_total = empty()
+    for row in rows:
+        doctor = doctors.get(row['doctor_id'])
+        if doctor is None:
+            doctor = doctors[row['doctor_id']] = {
+                'id': row['doctor_id'],
+                'full_name': row['doctor__full_name'],
+                'months': [{'month': month, **empty()} for month in range(1, 13)],
+                'total': empty(),
+            }
+        measures = {'appointment_count': row['count'], 'booked_minutes': row['minutes'], 'revenue': row['amount']}
+        for total in (doctor['months'][row['month'] - 1], doctor['total'], year_total):
+            add_measures(total, measures)
+
+    for doctor in doctors.values():
+        for measures in (*doctor['months'], doctor['total']):
+            measures['revenue'] = format_revenue(measures['revenue'])
+    year_total['revenue'] = format_revenue(year_total['revenue'])
+    return {'year': year, 'doctors': list(doctors.values()), 'total': year_total}
+
+
+def connect_signals():
+    dispatch_uid = 'clinic_daily_stats'
+    post_save.connect(appointment_saved, sender=Appointment, dispatch_uid=dispatch_uid)
+    post_delete.connect(appointment_deleted, sender=Appointment, dispatch_uid=dispatch_uid)
+    appointments_bulk_changed.connect(appointments_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    pre_delete.connect(service_deleting, sender=Service, dispatch_uid=dispatch_uid)
+    post_delete.connect(service_deleted, sender=Service, dispatch_uid=dispatch_uid)
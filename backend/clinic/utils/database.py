@@ -0,0 +1,57 @@
+import re
+from django.conf import settings
+
+# Pragmas applied to every new SQLite connection unless CLINIC_SQLITE_PRAGMAS
+# overrides them. busy_timeout comes first so the rest wait for locks.
+DEFAULT_SQLITE_PRAGMAS = {
+    # Wait up to 5 s for a lock instead of failing with "database is locked"
+    'busy_timeout': 5000,
+    # Readers keep reading while a writer commits, and commits only append
+    'journal_mode': 'wal',
+    # In WAL mode a crash can lose the last commits but never corrupts
+    'synchronous': 'normal',
+    # 64 MiB page cache and memory-mapped reads per connection
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+# Pragmas that make no sense for in-memory databases
+FILE_ONLY_PRAGMAS = ('journal_mode', 'mmap_size')
+
+_pragma_value = re.compile(r'^-?\w+$')
+
+
+def get_sqlite_pragmas():
+    pragmas = getattr(settings, 'CLINIC_SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+    return pragmas or {}
+
+
+def apply_sqlite_pragmas(sender=None, connection=None, **kwargs):
+    """connection_created receiver configuring new SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    in_memory = connection.is_in_memory_db()
+    # Straight on the sqlite3 connection, so query counters and execute
+    # wrappers only see the application's queries
+    cursor = connection.connection.cursor()
+    try:
+        for name, value in get_sqlite_pragmas().items():
+            if in_memory and name in FILE_ONLY_PRAGMAS:
+                continue
+            if not name.isidentifier() or not _pragma_value.match(str(value)):
+                raise ValueError(f'Invalid SQLite pragma {name} = {value!r}')
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def get_sqlite_settings(connection):
+    """The current values of the configured pragmas, for diagnostics"""
+    with connection.cursor() as cursor:
+        values = {}
+        for name in get_sqlite_pragmas():
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+        return values
@@ -0,0 +1,256 @@
+import math
+import random
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from time import perf_counter
+from django.db import connection, transaction
+from django.utils import timezone
+from ..models import Doctor, Service, Shift, Appointment
+from ..signals import appointments_bulk_changed
+from .audit import merge_blocks
+from .search import normalize_name, normalize_phone
+from .shift_rotation import ShiftRotationManager
+
+# Appointments built and written per transaction
+DEFAULT_CHUNK_SIZE = 5000
+
+FIRST_NAMES = (
+    'Ana', 'Marija', 'Elena', 'Ivana', 'Sara', 'Jovana', 'Teodora', 'Mila', 'Angela', 'Simona',
+    'Katerina', 'Biljana', 'Vesna', 'Natasha', 'Sofija', 'Marko', 'Nikola', 'Stefan', 'Filip',
+    'Aleksandar', 'David', 'Petar', 'Bojan', 'Goran', 'Dimitar', 'Viktor', 'Kristijan', 'Igor',
+    'Darko', 'Zoran',
+)
+LAST_NAMES = (
+    'Petrovski', 'Stojanovski', 'Nikolovski', 'Trajkovski', 'Jovanovski', 'Georgievski', 'Dimitrovski',
+    'Ristovski', 'Kostovski', 'Angelovski', 'Popovski', 'Ilievski', 'Todorovski', 'Spasovski',
+    'Mitrevski', 'Stefanovski', 'Velkovski', 'Pavlovski', 'Markovski', 'Zdravkovski',
+)
+SERVICES = (
+    ('Regular Checkup', '40.00', 30), ('Cleaning', '60.00', 30), ('Filling', '120.00', 45),
+    ('Extraction', '90.00', 45), ('Root Canal', '600.00', 90), ('Whitening', '250.00', 60),
+    ('Crown', '450.00', 90), ('Orthodontic Consultation', '50.00', 30), ('X-Ray', '25.00', 15),
+    ('Implant Consultation', '70.00', 45),
+)
+# Appointment columns written by the generator, in row order
+INSERT_FIELDS = (
+    'patient_first_name', 'patient_last_name', 'patient_phone_number', 'doctor', 'service',
+    'custom_service_name', 'price', 'duration_minutes', 'start_datetime', 'end_datetime', 'start_date',
+    'patient_first_name_search', 'patient_last_name_search', 'patient_phone_digits', 'updated_at',
+)
+# Minutes left free after an appointment, picked at random
+GAPS = (0, 0, 0, 15, 30)
+# Share of appointments booked under a custom service name
+CUSTOM_SERVICE_SHARE = 0.05
+
+
+def iter_generated_weeks(weeks, start_week=None, start_year=None):
+    """(week_of_year, year) of the generated weeks, by default centred on the current week"""
+    if start_week is None:
+        start_date = timezone.localdate() - timedelta(weeks=weeks // 2)
+    else:
+        start_date = ShiftRotationManager.get_week_start_date(start_week, start_year)
+    for offset in range(weeks):
+        yield ShiftRotationManager.get_week_and_year(start_date + timedelta(weeks=offset))
+
+
+def to_minutes(value):
+    """Minutes since midnight of a time or an 'HH:MM' string"""
+    if isinstance(value, str):
+        return int(value[:2]) * 60 + int(value[3:])
+    return value.hour * 60 + value.minute
+
+
+def shift_minutes():
+    """{shift_type: minutes} of the default shift times"""
+    return {
+        shift_type: to_minutes(times['end']) - to_minutes(times['start'])
+        for shift_type, times in ShiftRotationManager.DEFAULT_SHIFT_TIMES.items()
+    }
+
+
+class DatasetGenerator:
+    """
+    Bulk-insert a synthetic clinic: doctors, services, the shifts of a run
+    of weeks and appointments spread evenly over the new doctors' shifts.
+    Appointments never overlap and never leave a doctor's shifts, as each
+    shift is filled from its start onwards. The same seed generates the
+    same data.
+    """
+    def __init__(self, doctors=10, services=len(SERVICES), weeks=4, appointments=1000, start_week=None,
+                 start_year=None, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.doctor_count = doctors
+        self.service_count = services
+        self.weeks = list(iter_generated_weeks(weeks, start_week, start_year))
+        self.appointment_count = appointments
+        self.random = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.fields = {field.name: field for field in Appointment._meta.concrete_fields}
+        # Bound once, the connection proxy is slow to look through per value
+        self.adapt_datetime = connection.ops.adapt_datetimefield_value
+        self.adapt_date = connection.ops.adapt_datefield_value
+        self.normalized_names = {name: normalize_name(name) for name in FIRST_NAMES + LAST_NAMES}
+        self.created_at = self.adapt_datetime(timezone.now())
+        self.insert_sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            connection.ops.quote_name(Appointment._meta.db_table),
+            ', '.join(connection.ops.quote_name(self.fields[name].column) for name in INSERT_FIELDS),
+            ', '.join(['%s'] * len(INSERT_FIELDS)),
+        )
+
+    def capacity(self):
+        """
+        Most appointments that fit in the new doctors' planned shifts, with
+        back to back appointments of the shortest service
+        """
+        shortest = min(duration for name, price, duration in SERVICES[:max(self.service_count, 1)])
+        minutes = shift_minutes()
+        # New doctors get the highest ids, so they take the last places in the rotation
+        existing = Doctor.objects.count()
+        plan = ShiftRotationManager.plan_rotation(self.weeks, range(existing + self.doctor_count))
+        return sum(
+            minutes[shift_type] // shortest
+            for week_of_year, year, day_of_week, shift_type, doctor_id in plan.assignments()
+            if doctor_id >= existing
+        )
+
+    def run(self):
+        if self.appointment_count and not (self.doctor_count and self.service_count and self.weeks):
+            raise ValueError('Appointments need at least one doctor, service and week')
+        if self.appointment_count > self.capacity():
+            raise ValueError(
+                f'At most {self.capacity()} appointments fit in {len(self.weeks)} weeks '
+                f'with {self.doctor_count} doctors'
+            )
+        started = perf_counter()
+        self.report = {'doctors': 0, 'services': 0, 'shifts': 0, 'appointments': 0, 'weeks': len(self.weeks)}
+
+        doctors = self.create_doctors()
+        services = self.create_services()
+        shifts = ShiftRotationManager.generate_shifts(self.weeks)
+        self.report['shifts'] = shifts['created']
+
+        rows, dates = [], set()
+        for day, row in self.iter_appointments(doctors, services):
+            rows.append(row)
+            dates.add(day)
+            if len(rows) >= self.chunk_size:
+                self.write(rows, dates)
+                rows, dates = [], set()
+                if self.progress:
+                    self.progress(self.report, perf_counter() - started)
+        if rows:
+            self.write(rows, dates)
+        self.report['elapsed'] = perf_counter() - started
+        return self.report
+
+    def create_doctors(self):
+        first = Doctor.objects.count()
+        doctors = Doctor.objects.bulk_create([
+            Doctor(
+                full_name=f'Dr. {self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}',
+                phone_number=f'+389-2-{first + i:06d}',
+                email=f'doctor{first + i}@generated.example.com',
+            )
+            for i in range(self.doctor_count)
+        ])
+        if any(doctor.pk is None for doctor in doctors):
+            # Backends that cannot return ids from bulk inserts
+            doctors = list(Doctor.objects.order_by('-pk')[:self.doctor_count])[::-1]
+        self.report['doctors'] = len(doctors)
+        return doctors
+
+    def create_services(self):
+        services = []
+        for i in range(self.service_count):
+            name, price, duration = SERVICES[i % len(SERVICES)]
+            if i >= len(SERVICES):
+                name = f'{name} {i // len(SERVICES) + 1}'
+            services.append(Service(name=name, price=Decimal(price), duration_minutes=duration))
+        services = Service.objects.bulk_create(services)
+        if any(service.pk is None for service in services):
+            services = list(Service.objects.order_by('-pk')[:self.service_count])[::-1]
+        self.report['services'] = len(services)
+        return services
+
+    def shift_windows(self, doctors):
+        """
+        {(date, doctor_id): [(start minute, end minute)]} of the doctors'
+        assigned shifts, back-to-back shifts merged into one window
+        """
+        windows = {}
+        for doctor_id, year, week_of_year, day_of_week, start_time, end_time in Shift.doctors.through.objects.filter(
+            ShiftRotationManager.weeks_filter(self.weeks, prefix='shift__'),
+            doctor_id__in=[doctor.pk for doctor in doctors],
+        ).order_by('shift__start_time').values_list(
+            'doctor_id', 'shift__year', 'shift__week_of_year', 'shift__day_of_week', 'shift__start_time', 'shift__end_time'
+        ):
+            day = ShiftRotationManager.get_week_start_date(week_of_year, year) + timedelta(days=day_of_week)
+            windows.setdefault((day, doctor_id), []).append((to_minutes(start_time), to_minutes(end_time)))
+        return {key: list(merge_blocks(spans)) for key, spans in windows.items()}
+
+    def iter_appointments(self, doctors, services):
+        """(date, row) of the appointments, day by day, each doctor's shifts filled in order"""
+        windows = self.shift_windows(doctors)
+        days = sorted({day for day, doctor_id in windows})
+        self.prices = {
+            service.pk: self.fields['price'].get_db_prep_save(service.price, connection) for service in services
+        }
+        shortest = min(services, key=lambda service: service.duration_minutes)
+        longest = max(service.duration_minutes for service in services)
+        mean = sum(service.duration_minutes for service in services) / len(services)
+        remaining = self.appointment_count
+        # Shift minutes left, shifts get appointments in proportion to their length
+        open_minutes = sum(end - start for spans in windows.values() for start, end in spans)
+        for day in days:
+            midnight = timezone.make_aware(datetime.combine(day, time()))
+            for doctor in doctors:
+                for opening, closing in windows.get((day, doctor.pk), ()):
+                    if not remaining:
+                        return
+                    quota = math.ceil(remaining * (closing - opening) / open_minutes)
+                    open_minutes -= closing - opening
+                    minute = opening
+                    while quota:
+                        service = self.random.choice(services)
+                        if minute + quota * mean > closing:
+                            # Behind on the quota, squeeze in the shortest service
+                            service = shortest
+                        if minute + service.duration_minutes > closing:
+                            break
+                        yield day, self.build_row(day, doctor, service, midnight + timedelta(minutes=minute))
+                        minute += service.duration_minutes
+                        quota -= 1
+                        remaining -= 1
+                        # Leave gaps only while the rest of the quota still fits
+                        if quota * longest < closing - minute:
+                            minute += self.random.choice(GAPS)
+
+    def build_row(self, day, doctor, service, start):
+        """
+        Database-ready values of an appointment in INSERT_FIELDS order, with
+        the derived fields filled the way Appointment.populate_derived_fields
+        fills them
+        """
+        first_name = self.random.choice(FIRST_NAMES)
+        last_name = self.random.choice(LAST_NAMES)
+        phone_number = f'07{self.random.randrange(10)} {self.random.randrange(1000):03d} {self.random.randrange(1000):03d}'
+        custom = self.random.random() < CUSTOM_SERVICE_SHARE
+        end = start + timedelta(minutes=service.duration_minutes)
+        return (
+            first_name, last_name, phone_number, doctor.pk,
+            None if custom else service.pk, 'Consultation' if custom else None,
+            self.prices[service.pk], service.duration_minutes,
+            self.adapt_datetime(start), self.adapt_datetime(end), self.adapt_date(day),
+            self.normalized_names[first_name], self.normalized_names[last_name], normalize_phone(phone_number),
+            self.created_at,
+        )
+
+    def write(self, rows, dates):
+        """
+        Insert rows with one prepared statement. Far faster than bulk_create
+        for millions of rows, which compiles every value of every batch.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(self.insert_sql, rows)
+            appointments_bulk_changed.send(sender=Appointment, dates=sorted(dates))
+        self.report['appointments'] += len(rows)
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.utils.module_loading import import_string
+from ..models import Appointment, Doctor, Shift
+from ..signals import appointments_bulk_changed, shifts_bulk_changed
+from .shift_rotation import ShiftRotationManager
+
+# Live appointment and shift events for the dashboard, pushed over
+# Server-Sent Events by the async events view. Committed changes are
+# published to a broker, which fans them out to the EventHub of every
+# process; the hub copies each event into the bounded queue of every
+# matching client connected to that process.
+
+# Events a client may fall behind by before it is disconnected
+DEFAULT_MAX_QUEUED = 100
+
+# Seconds between keep-alive comments on an idle stream
+DEFAULT_HEARTBEAT = 15
+
+# Milliseconds a browser waits before reconnecting
+RETRY_MS = 3000
+
+DEFAULT_BROKER = {'BACKEND': 'backend.clinic.utils.events.LocalBroker'}
+
+
+class Subscription:
+    """One connected client: its filters and its queue of pending events"""
+    def __init__(self, hub, weeks=None, doctors=None, max_queued=DEFAULT_MAX_QUEUED):
+        self.hub = hub
+        self.weeks = set(weeks) if weeks else None
+        self.doctors = set(doctors) if doctors else None
+        self.queue = asyncio.Queue(max_queued)
+        self.dropped = False
+
+    def matches(self, event):
+        if self.weeks is not None and not self.weeks.intersection(map(tuple, event['weeks'])):
+            return False
+        # Events without doctors, such as a shift's times changing, reach everyone
+        if self.doctors is not None and event['doctors'] and not self.doctors.intersection(event['doctors']):
+            return False
+        return True
+
+
+class EventHub:
+    """
+    In-process broadcast to the subscriptions of one event loop. publish may
+    be called from any thread; delivery always happens in the loop. A client
+    whose queue is full is dropped rather than slowing everyone else down.
+    """
+    def __init__(self, max_queued=None):
+        self.max_queued = max_queued
+        self.loop = None
+        self.subscriptions = set()
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    def subscribe(self, weeks=None, doctors=None):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # Subscriptions of a closed loop can never read again
+            self.loop = loop
+            self.subscriptions = set()
+        max_queued = self.max_queued or getattr(settings, 'CLINIC_EVENTS_MAX_QUEUED', DEFAULT_MAX_QUEUED)
+        subscription = Subscription(self, weeks, doctors, max_queued)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, event):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.dispatch(event)
+        else:
+            loop.call_soon_threadsafe(self.dispatch, event)
+
+    def dispatch(self, event):
+        self.stats['published'] += 1
+        for subscription in list(self.subscriptions):
+            if not subscription.matches(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+                self.stats['delivered'] += 1
+            except asyncio.QueueFull:
+                self.drop(subscription)
+
+    def drop(self, subscription):
+        """Disconnect a slow client: what it has not read yet is replaced by the drop notice"""
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+        self.stats['dropped'] += 1
+
+
+hub = EventHub()
+
+
+class LocalBroker:
+    """
+    Fan-out inside this process only. Enough for a single ASGI worker, and
+    the stand-in for RedisBroker in tests.
+    """
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, event):
+        self.hub.publish(event)
+
+    async def start(self):
+        pass
+
+
+class RedisBroker:
+    """
+    Fan-out through Redis pub/sub, so clients connected to any worker
+    process get every event. Needs the redis package. Options: URL and
+    CHANNEL.
+    """
+    def __init__(self, hub, url='redis://localhost:6379/0', channel='clinic:events'):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker needs the redis package: pip install redis')
+        self.hub = hub
+        self.url = url
+        self.channel = channel
+        self.client = redis.Redis.from_url(url)
+        self.listener = None
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    async def start(self):
+        """Listen in the hub's loop, once per loop"""
+        if self.listener is not None and not self.listener.done() and self.listener.get_loop() is asyncio.get_running_loop():
+            return
+        self.listener = asyncio.create_task(self.listen())
+
+    async def listen(self):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self.url)
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    self.hub.dispatch(json.loads(message['data']))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The broker configured by CLINIC_EVENT_BROKER ({'BACKEND': path, 'OPTIONS': {...}})"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = getattr(settings, 'CLINIC_EVENT_BROKER', DEFAULT_BROKER)
+            _broker = import_string(config['BACKEND'])(hub, **config.get('OPTIONS', {}))
+        return _broker
+
+
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'CLINIC_EVENT_BROKER':
+        with _broker_lock:
+            _broker = None
+
+
+def publish_on_commit(event):
+    if event['weeks'] or event['ids']:
+        transaction.on_commit(lambda: get_broker().publish(event))
+
+
+def make_event(object_type, action, ids=(), weeks=(), doctors=()):
+    return {
+        'type': object_type,
+        'action': action,
+        'ids': sorted(set(ids)),
+        'weeks': sorted({tuple(week) for week in weeks if week[0] is not None}),
+        'doctors': sorted({doctor_id for doctor_id in doctors if doctor_id is not None}),
+    }
+
+
+def appointment_weeks(appointments):
+    """Weeks an appointment is in now or was in when it was loaded"""
+    days = set()
+    for appointment in appointments:
+        days.add(appointment.start_date)
+        days.add(getattr(appointment, '_loaded_values', {}).get('start_date'))
+    return [ShiftRotationManager.get_week_and_year(day) for day in days if day is not None]
+
+
+def appointment_doctors(appointments):
+    doctors = set()
+    for appointment in appointments:
+        doctors.add(appointment.doctor_id)
+        doctors.add(getattr(appointment, '_loaded_values', {}).get('doctor_id'))
+    return doctors
+
+
+def appointment_saved(sender, instance, **kwargs):
+    publish_on_commit(make_event(
+        'appointment', 'upsert', [instance.pk], appointment_weeks([instance]), appointment_doctors([instance])
+    ))
+
+
+def appointment_deleted(sender, instance, origin=None, **kwargs):
+    # A deleted doctor publishes one event for all of their appointments
+    if isinstance(origin, Doctor) or getattr(origin, 'model', None) is Doctor:
+        return
+    publish_on_commit(make_event(
+        'appointment', 'delete', [instance.pk], appointment_weeks([instance]), appointment_doctors([instance])
+    ))
+
+
+def appointments_bulk_changed_handler(sender, created=(), updated=(), deleted=(), dates=(), **kwargs):
+    # One event per kind of change, however many appointments it covers
+    upserted = [*created, *updated]
+    weeks = [ShiftRotationManager.get_week_and_year(day) for day in set(dates)]
+    if upserted or weeks:
+        publish_on_commit(make_event(
+            'appointment', 'upsert', [appointment.pk for appointment in upserted],
+            appointment_weeks(upserted) + weeks, appointment_doctors(upserted),
+        ))
+    if deleted:
+        publish_on_commit(make_event(
+            'appointment', 'delete', [appointment.pk for appointment in deleted],
+            appointment_weeks(deleted), appointment_doctors(deleted),
+        ))
+
+
+def shift_week(shift):
+    weeks = [(shift.week_of_year, shift.year)]
+    loaded = getattr(shift, '_loaded_values', {})
+    if 'week_of_year' in loaded and 'year' in loaded:
+        weeks.append((loaded['week_of_year'], loaded['year']))
+    return weeks
+
+
+def shift_saved(sender, instance, **kwargs):
+    publish_on_commit(make_event('shift', 'upsert', [instance.pk], shift_week(instance)))
+
+
+def shift_deleted(sender, instance, **kwargs):
+    publish_on_commit(make_event('shift', 'delete', [instance.pk], shift_week(instance)))
+
+
+def shifts_bulk_changed_handler(sender, weeks=(), shift_ids=None, **kwargs):
+    publish_on_commit(make_event('shift', 'upsert', shift_ids or (), weeks))
+
+
+def shift_doctors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        doctors = pk_set if pk_set is not None else instance.doctors.values_list('id', flat=True)
+        publish_on_commit(make_event('shift', 'upsert', [instance.pk], shift_week(instance), doctors))
+        return
+    # Changed from the doctor side: pk_set holds shift ids (None on clear)
+    shifts = Shift.objects.filter(pk__in=pk_set) if pk_set is not None else instance.shifts.all()
+    rows = list(shifts.values_list('id', 'week_of_year', 'year'))
+    publish_on_commit(make_event(
+        'shift', 'upsert', [row[0] for row in rows], [row[1:] for row in rows], [instance.pk]
+    ))
+
+
+def doctor_deleting(sender, instance, **kwargs):
+    # Their appointments and shift assignments go without signals of their own
+    days = instance.appointments.values_list('start_date', flat=True).distinct()
+    publish_on_commit(make_event(
+        'appointment', 'delete', weeks=[ShiftRotationManager.get_week_and_year(day) for day in days],
+        doctors=[instance.pk],
+    ))
+    rows = list(instance.shifts.values_list('id', 'week_of_year', 'year'))
+    publish_on_commit(make_event(
+        'shift', 'upsert', [row[0] for row in rows], [row[1:] for row in rows], [instance.pk]
+    ))
+
+
+def format_event(event):
+    """
+    An event as an SSE message. Messages carry no id: a stream has no
+    position to resume from, so a reconnecting client catches up from the
+    change feed instead of sending Last-Event-ID.
+    """
+    return f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+async def stream_events(subscription, heartbeat=None):
+    """
+    The SSE body of a subscription: events as they arrive, a comment when
+    there were none for heartbeat seconds, and a final dropped event if the
+    client fell too far behind
+    """
+    heartbeat = heartbeat or getattr(settings, 'CLINIC_EVENTS_HEARTBEAT', DEFAULT_HEARTBEAT)
+    try:
+        yield f'retry: {RETRY_MS}\n: connected\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if event is None:
+                # Whatever the client missed is in the change feed
+                yield 'event: dropped\ndata: {"reason":"too slow"}\n\n'
+                return
+            yield format_event(event)
+    finally:
+        subscription.hub.unsubscribe(subscription)
+
+
+def connect_signals():
+    dispatch_uid = 'clinic_events'
+    post_save.connect(appointment_saved, sender=Appointment, dispatch_uid=dispatch_uid)
+    post_delete.connect(appointment_deleted, sender=Appointment, dispatch_uid=dispatch_uid)
+    appointments_bulk_changed.connect(appointments_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    post_save.connect(shift_saved, sender=Shift, dispatch_uid=dispatch_uid)
+    post_delete.connect(shift_deleted, sender=Shift, dispatch_uid=dispatch_uid)
+    shifts_bulk_changed.connect(shifts_bulk_changed_handler, dispatch_uid=dispatch_uid)
+    m2m_changed.connect(shift_doctors_changed, sender=Shift.doctors.through, dispatch_uid=dispatch_uid)
+    pre_delete.connect(doctor_deleting, sender=Doctor, dispatch_uid=dispatch_uid)
+    setting_changed.connect(reset_broker, dispatch_uid=dispatch_uid)
@@ -0,0 +1,102 @@
+import csv
+import json
+from ..models import Appointment
+from .fast_serializers import datetime_formatter, format_price
+
+# Rows fetched from the database per round trip
+EXPORT_CHUNK_SIZE = 2000
+
+# Rows encoded into one chunk of the output stream
+EXPORT_LINES_PER_CHUNK = 500
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Output column and the .values_list() column it comes from
+EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('date', 'start_date'),
+    ('start_datetime', 'start_datetime'),
+    ('end_datetime', 'end_datetime'),
+    ('doctor_id', 'doctor_id'),
+    ('doctor_name', 'doctor__full_name'),
+    ('service_id', 'service_id'),
+    ('service_name', 'service__name'),
+    ('custom_service_name', 'custom_service_name'),
+    ('patient_first_name', 'patient_first_name'),
+    ('patient_last_name', 'patient_last_name'),
+    ('patient_phone_number', 'patient_phone_number'),
+    ('price', 'price'),
+    ('duration_minutes', 'duration_minutes'),
+)
+
+
+def export_queryset(start_date, end_date, doctor_id=None, service_id=None):
+    """Appointments of a clinic-local date range as tuples of EXPORT_COLUMNS"""
+    queryset = Appointment.objects.filter(start_date__range=[start_date, end_date])
+    if doctor_id is not None:
+        queryset = queryset.filter(doctor_id=doctor_id)
+    if service_id is not None:
+        queryset = queryset.filter(service_id=service_id)
+    return queryset.order_by('start_datetime', 'id').values_list(*[column for name, column in EXPORT_COLUMNS])
+
+
+def iter_export_records(queryset):
+    """
+    Stream export records as dicts, fetching EXPORT_CHUNK_SIZE rows at a
+    time so memory use does not depend on the size of the range
+    """
+    names = [name for name, column in EXPORT_COLUMNS]
+    format_datetime = datetime_formatter()
+    for row in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        record = dict(zip(names, row))
+        record['date'] = record['date'].isoformat()
+        record['start_datetime'] = format_datetime(record['start_datetime'])
+        record['end_datetime'] = format_datetime(record['end_datetime'])
+        record['price'] = format_price(record['price'])
+        yield record
+
+
+class LineBuffer:
+    """File-like object collecting what csv.writer writes"""
+    def __init__(self):
+        self.lines = []
+
+    def write(self, value):
+        self.lines.append(value)
+
+    def flush(self):
+        text = ''.join(self.lines)
+        self.lines = []
+        return text
+
+
+def iter_csv(records):
+    buffer = LineBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, column in EXPORT_COLUMNS])
+    for count, record in enumerate(records, 1):
+        writer.writerow(['' if value is None else value for value in record.values()])
+        if count % EXPORT_LINES_PER_CHUNK == 0:
+            yield buffer.flush()
+    yield buffer.flush()
+
+
+def iter_ndjson(records):
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if len(lines) == EXPORT_LINES_PER_CHUNK:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def iter_export(queryset, export_format):
+    """Encoded chunks of an export in 'csv' or 'ndjson' format"""
+    encode = iter_csv if export_format == 'csv' else iter_ndjson
+    for chunk in encode(iter_export_records(queryset)):
+        if chunk:
+            yield chunk
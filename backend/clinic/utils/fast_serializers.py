@@ -0,0 +1,110 @@
+from decimal import Context, Decimal
+from django.utils import timezone
+from ..models import Appointment, Service
+
+# Read-only fast paths for AppointmentSerializer and
+# CalendarAppointmentSerializer: they build the same dicts straight from
+# .values() rows with precomputed formatters, skipping model instances and
+# DRF's per-field machinery. The tests compare both outputs byte for byte.
+#
+# Columns fetched for both
+APPOINTMENT_VALUES = (
+    'id', 'patient_first_name', 'patient_last_name', 'patient_phone_number',
+    'doctor_id', 'doctor__full_name', 'doctor__phone_number', 'doctor__email',
+    'doctor__profile_picture_url', 'service_id', 'service__name', 'service__price',
+    'service__duration_minutes', 'custom_service_name', 'price', 'duration_minutes',
+    'start_datetime', 'end_datetime', 'start_date', 'updated_at',
+)
+
+
+def decimal_formatter(model_field):
+    """Format Decimals like DRF's DecimalField for the given model field"""
+    quantum = Decimal(1).scaleb(-model_field.decimal_places)
+    context = Context(prec=model_field.max_digits)
+
+    def format_decimal(value):
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(quantum, context=context))
+    return format_decimal
+
+
+def datetime_formatter():
+    """Format aware datetimes like DRF's DateTimeField in the current time zone"""
+    current_timezone = timezone.get_current_timezone()
+
+    def format_datetime(value):
+        if value is None:
+            return None
+        value = value.astimezone(current_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return format_datetime
+
+
+format_price = decimal_formatter(Appointment._meta.get_field('price'))
+format_service_price = decimal_formatter(Service._meta.get_field('price'))
+
+
+def appointment_values(queryset):
+    return queryset.values(*APPOINTMENT_VALUES)
+
+
+def serialize_appointments(rows):
+    """AppointmentSerializer(rows, many=True).data for .values() rows"""
+    format_datetime = datetime_formatter()
+    data = []
+    for row in rows:
+        if row['service_id'] is None:
+            service = None
+        else:
+            service = {
+                'id': row['service_id'],
+                'name': row['service__name'],
+                'price': format_service_price(row['service__price']),
+                'duration_minutes': row['service__duration_minutes'],
+            }
+        data.append({
+            'id': row['id'],
+            'patient_first_name': row['patient_first_name'],
+            'patient_last_name': row['patient_last_name'],
+            'patient_full_name': f"{row['patient_first_name']} {row['patient_last_name']}",
+            'patient_phone_number': row['patient_phone_number'],
+            'doctor': {
+                'id': row['doctor_id'],
+                'full_name': row['doctor__full_name'],
+                'phone_number': row['doctor__phone_number'],
+                'email': row['doctor__email'],
+                'profile_picture_url': row['doctor__profile_picture_url'],
+            },
+            'service': service,
+            'custom_service_name': row['custom_service_name'],
+            'price': format_price(row['price']),
+            'duration_minutes': row['duration_minutes'],
+            'start_datetime': format_datetime(row['start_datetime']),
+            'end_datetime': format_datetime(row['end_datetime']),
+            'updated_at': format_datetime(row['updated_at']),
+        })
+    return data
+
+
+def serialize_calendar_appointments(rows):
+    """CalendarAppointmentSerializer(rows, many=True).data for .values() rows"""
+    format_datetime = datetime_formatter()
+    data = []
+    for row in rows:
+        item = {
+            'id': row['id'],
+            'patient_full_name': f"{row['patient_first_name']} {row['patient_last_name']}",
+            'doctor_name': row['doctor__full_name'],
+            'doctor_profile_picture': row['doctor__profile_picture_url'],
+        }
+        # DRF leaves out dotted sources whose related object is missing
+        if row['service_id'] is not None:
+            item['service_name'] = row['service__name']
+        item['price'] = format_price(row['price'])
+        item['start_datetime'] = format_datetime(row['start_datetime'])
+        item['end_datetime'] = format_datetime(row['end_datetime'])
+        data.append(item)
+    return data
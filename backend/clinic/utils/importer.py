@@ -0,0 +1,418 @@
+import codecs
+import csv
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from time import perf_counter
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from ..models import Doctor, Service, Appointment
+from ..signals import appointments_bulk_changed
+from .booking import find_interval_conflicts, load_doctor_bookings, lock_doctors
+
+# Characters read from the input at a time when streaming JSON
+READ_SIZE = 64 * 1024
+
+# Rows validated and written together
+DEFAULT_BATCH_SIZE = 500
+
+# Row errors kept for the report, the rest are only counted
+MAX_REPORTED_ERRORS = 50
+
+IMPORT_MODELS = ('doctor', 'service', 'appointment')
+
+# Input fields of each model, anything else in a record is ignored
+IMPORT_FIELDS = {
+    'doctor': ('full_name', 'phone_number', 'email', 'profile_picture_url'),
+    'service': ('name', 'price', 'duration_minutes'),
+    'appointment': (
+        'patient_first_name', 'patient_last_name', 'patient_phone_number', 'doctor', 'doctor_email',
+        'doctor_name', 'service', 'service_name', 'custom_service_name', 'price', 'duration_minutes',
+        'start_datetime',
+    ),
+}
+
+# Nullable fields, where an empty CSV cell means NULL
+NULLABLE_FIELDS = ('profile_picture_url', 'custom_service_name', 'service', 'service_name')
+
+
+def open_text(stream):
+    """Wrap a binary stream as text, honouring UTF-8 and UTF-16 byte order marks"""
+    stream = io.BufferedReader(stream) if not hasattr(stream, 'peek') else stream
+    head = stream.peek(4)[:4]
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    else:
+        encoding = 'utf-8-sig'
+    return io.TextIOWrapper(stream, encoding=encoding, newline='')
+
+
+def iter_json_values(stream):
+    """
+    Yield the items of a JSON array, or a sequence of JSON values such as
+    NDJSON, decoding them one at a time as the input is read
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    # None until the first value, then 'array', 'values' or 'closed'
+    state = None
+    need_separator = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if eof:
+                break
+            chunk = stream.read(READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        if state is None:
+            state = 'array' if buffer[0] == '[' else 'values'
+            if state == 'array':
+                buffer = buffer[1:]
+            continue
+        if state == 'closed':
+            raise ValueError('Unexpected data after the end of the JSON array')
+        if state == 'array' and buffer[0] == ']':
+            buffer = buffer[1:]
+            state = 'closed'
+            continue
+        if need_separator:
+            if buffer[0] != ',':
+                raise ValueError(f'Expected "," or "]" in the JSON array, got {buffer[:20]!r}')
+            buffer = buffer[1:]
+            need_separator = False
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as error:
+            if eof:
+                raise ValueError(f'Invalid JSON: {error}')
+            end = None
+        # Read more when the value may continue past the buffer, like a number
+        if end is None or (end == len(buffer) and not eof):
+            chunk = stream.read(READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        buffer = buffer[end:]
+        need_separator = state == 'array'
+        yield value
+
+    if state == 'array':
+        raise ValueError('The JSON array is not closed')
+
+
+def guess_model(fields):
+    if 'patient_first_name' in fields or 'start_datetime' in fields:
+        return 'appointment'
+    if 'full_name' in fields:
+        return 'doctor'
+    if 'name' in fields:
+        return 'service'
+    return None
+
+
+def normalize_record(record):
+    """
+    Get (model, fields, fixture_pk) of an input record. Records may be flat
+    dicts, with an optional "model", or dumpdata fixture entries with
+    "model", "pk" and "fields".
+    """
+    if not isinstance(record, dict):
+        raise ValidationError('Expected an object')
+    if isinstance(record.get('fields'), dict):
+        app_label, _, model = str(record.get('model', '')).rpartition('.')
+        return model if app_label == 'clinic' else None, record['fields'], record.get('pk')
+    return record.get('model') or guess_model(record), record, None
+
+
+def iter_records(stream, input_format, model=None):
+    """
+    Yield (position, record) pairs from a CSV, JSON or NDJSON text stream.
+    `model` applies to records that do not name their own.
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(stream)
+        records = ((f'line {reader.line_num}', record) for record in reader)
+    else:
+        records = ((f'record {index}', record) for index, record in enumerate(iter_json_values(stream), 1))
+    for position, record in records:
+        if model and isinstance(record, dict) and not record.get('model'):
+            record = {**record, 'model': model}
+        yield position, record
+
+
+class ClinicImporter:
+    """
+    Bulk importer of doctors, services and appointments.
+
+    Records are validated in batches against in-memory maps of doctors (by
+    email and by name) and services (by name), so validation needs no
+    queries. Appointments are checked for conflicts with one range query
+    per doctor and batch, under the doctors' booking locks, and every
+    batch is written with bulk_create in its own transaction. Existing
+    doctors and services are matched by natural key and left unchanged.
+
+    With `atomic` the whole import runs in one transaction that is rolled
+    back if any record fails, with `dry_run` it is always rolled back.
+    """
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, atomic=False, progress=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.atomic = atomic or dry_run
+        self.progress = progress
+        self.report = {
+            'rows': 0,
+            'created': dict.fromkeys(IMPORT_MODELS, 0),
+            'existing': dict.fromkeys(IMPORT_MODELS, 0),
+            'ignored': 0,
+            'invalid': 0,
+            'conflicts': 0,
+            'errors': [],
+            'elapsed': 0.0,
+            'dry_run': dry_run,
+            'rolled_back': False,
+        }
+        self.doctors_by_email = {}
+        self.doctors_by_name = {}
+        self.services_by_name = {}
+        self.fixture_objects = {'doctor': {}, 'service': {}}
+
+    @staticmethod
+    def key(value):
+        return ' '.join(str(value).split()).casefold()
+
+    def load_maps(self):
+        for doctor in Doctor.objects.all():
+            self.remember_doctor(doctor)
+        for service in Service.objects.all():
+            self.services_by_name.setdefault(self.key(service.name), service)
+
+    def remember_doctor(self, doctor):
+        self.doctors_by_email.setdefault(self.key(doctor.email), doctor)
+        # Names are a natural key only while they are unambiguous
+        name = self.key(doctor.full_name)
+        if name in self.doctors_by_name and self.doctors_by_name[name] != doctor:
+            self.doctors_by_name[name] = None
+        else:
+            self.doctors_by_name[name] = doctor
+
+    def error(self, position, message):
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append(f'{position}: {message}')
+
+    def run(self, records):
+        """Import (position, record) pairs and return the report"""
+        started = perf_counter()
+        try:
+            if self.atomic:
+                with transaction.atomic():
+                    self.import_batches(records, started)
+                    if self.dry_run or self.report['invalid'] or self.report['conflicts']:
+                        self.report['rolled_back'] = True
+                        transaction.set_rollback(True)
+            else:
+                self.import_batches(records, started)
+        finally:
+            self.report['elapsed'] = perf_counter() - started
+        return self.report
+
+    def import_batches(self, records, started):
+        self.load_maps()
+        batch = []
+        for position, record in records:
+            batch.append((position, record))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+                self.report_progress(started)
+        if batch:
+            self.import_batch(batch)
+            self.report_progress(started)
+
+    def report_progress(self, started):
+        if self.progress:
+            self.progress(self.report, perf_counter() - started)
+
+    def import_batch(self, batch):
+        self.report['rows'] += len(batch)
+        grouped = {model: [] for model in IMPORT_MODELS}
+        for position, record in batch:
+            try:
+                model, fields, fixture_pk = normalize_record(record)
+            except ValidationError as error:
+                self.report['invalid'] += 1
+                self.error(position, ' '.join(error.messages))
+                continue
+            if model not in grouped:
+                # Shifts are generated and users managed separately
+                self.report['ignored'] += 1
+                continue
+            values = {}
+            for name in IMPORT_FIELDS[model]:
+                value = fields.get(name)
+                if value == '' and name in NULLABLE_FIELDS:
+                    value = None
+                if value is not None:
+                    values[name] = value
+            grouped[model].append((position, values, fixture_pk))
+
+        with transaction.atomic():
+            # Appointments of a batch may use its doctors and services
+            self.import_doctors(grouped['doctor'])
+            self.import_services(grouped['service'])
+            self.import_appointments(grouped['appointment'])
+
+    def validate(self, position, instance, exclude=()):
+        try:
+            instance.full_clean(exclude=list(exclude), validate_unique=False, validate_constraints=False)
+        except ValidationError as error:
+            self.report['invalid'] += 1
+            messages = error.message_dict if hasattr(error, 'error_dict') else {'record': error.messages}
+            self.error(position, '; '.join(f"{field}: {' '.join(texts)}" for field, texts in messages.items()))
+            return False
+        return True
+
+    def import_doctors(self, rows):
+        new = []
+        for position, values, fixture_pk in rows:
+            existing = self.doctors_by_email.get(self.key(values.get('email', '')))
+            if existing is not None:
+                self.report['existing']['doctor'] += 1
+                doctor = existing
+            else:
+                doctor = Doctor(**values)
+                if not self.validate(position, doctor):
+                    continue
+                new.append(doctor)
+                self.remember_doctor(doctor)
+            if fixture_pk is not None:
+                self.fixture_objects['doctor'][fixture_pk] = doctor
+        Doctor.objects.bulk_create(new)
+        self.report['created']['doctor'] += len(new)
+
+    def import_services(self, rows):
+        new = []
+        for position, values, fixture_pk in rows:
+            existing = self.services_by_name.get(self.key(values.get('name', '')))
+            if existing is not None:
+                self.report['existing']['service'] += 1
+                service = existing
+            else:
+                service = Service(**values)
+                if not self.validate(position, service):
+                    continue
+                new.append(service)
+                self.services_by_name[self.key(service.name)] = service
+            if fixture_pk is not None:
+                self.fixture_objects['service'][fixture_pk] = service
+        Service.objects.bulk_create(new)
+        self.report['created']['service'] += len(new)
+
+    def resolve_doctor(self, values):
+        reference = values.get('doctor_email') or values.get('doctor') or values.get('doctor_name')
+        if reference is None:
+            raise ValidationError('A doctor, doctor_email or doctor_name is required')
+        if isinstance(reference, int) and not isinstance(reference, bool):
+            doctor = self.fixture_objects['doctor'].get(reference)
+        elif '@' in str(reference):
+            doctor = self.doctors_by_email.get(self.key(reference))
+        else:
+            doctor = self.doctors_by_name.get(self.key(reference))
+        if doctor is None:
+            raise ValidationError(f'Unknown or ambiguous doctor {reference!r}')
+        return doctor
+
+    def resolve_service(self, values):
+        reference = values.get('service', values.get('service_name'))
+        if reference is None:
+            return None
+        if isinstance(reference, int) and not isinstance(reference, bool):
+            service = self.fixture_objects['service'].get(reference)
+        else:
+            service = self.services_by_name.get(self.key(reference))
+        if service is None:
+            raise ValidationError(f'Unknown service {reference!r}')
+        return service
+
+    def build_appointment(self, values):
+        doctor = self.resolve_doctor(values)
+        service = self.resolve_service(values)
+        if service is None and not values.get('custom_service_name'):
+            raise ValidationError('Either a service or a custom_service_name is required')
+
+        start_datetime = values.get('start_datetime')
+        parsed = parse_datetime(str(start_datetime)) if start_datetime else None
+        if parsed is None:
+            raise ValidationError(f'Invalid start_datetime {start_datetime!r}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+
+        price = values.get('price', service.price if service else None)
+        duration_minutes = values.get('duration_minutes', service.duration_minutes if service else None)
+        try:
+            price = Decimal(str(price)) if price is not None else None
+            duration_minutes = int(duration_minutes) if duration_minutes is not None else None
+        except (InvalidOperation, ValueError):
+            raise ValidationError('Invalid price or duration_minutes')
+        if price is None or not duration_minutes:
+            raise ValidationError('Custom services need a price and duration_minutes')
+
+        appointment = Appointment(
+            patient_first_name=values.get('patient_first_name', ''),
+            patient_last_name=values.get('patient_last_name', ''),
+            patient_phone_number=values.get('patient_phone_number', ''),
+            doctor=doctor,
+            service=service,
+            custom_service_name=values.get('custom_service_name'),
+            price=price,
+            duration_minutes=duration_minutes,
+            start_datetime=parsed,
+            end_datetime=parsed + timedelta(minutes=duration_minutes),
+        )
+        appointment.populate_derived_fields()
+        return appointment
+
+    def import_appointments(self, rows):
+        candidates = {}
+        for position, values, fixture_pk in rows:
+            try:
+                appointment = self.build_appointment(values)
+            except ValidationError as error:
+                self.report['invalid'] += 1
+                self.error(position, ' '.join(error.messages))
+                continue
+            if not self.validate(position, appointment, exclude=['doctor', 'service']):
+                continue
+            candidates[position] = appointment
+        if not candidates:
+            return
+
+        by_doctor = {}
+        for position, appointment in candidates.items():
+            by_doctor.setdefault(appointment.doctor_id, []).append(
+                (position, appointment.start_datetime, appointment.end_datetime)
+            )
+        lock_doctors(by_doctor)
+        existing = load_doctor_bookings(
+            {doctor_id: [(start, end) for position, start, end in rows] for doctor_id, rows in by_doctor.items()}
+        )
+        for doctor_id, doctor_rows in by_doctor.items():
+            for position, other in find_interval_conflicts(existing[doctor_id], doctor_rows).items():
+                self.report['conflicts'] += 1
+                self.error(position, 'conflicts with an existing appointment' if other is None else f'conflicts with {other}')
+                del candidates[position]
+
+        created = Appointment.objects.bulk_create(list(candidates.values()))
+        self.report['created']['appointment'] += len(created)
+        if created:
+            appointments_bulk_changed.send(sender=Appointment, created=created, updated=[], deleted=[])
@@ -0,0 +1,597 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import tracemalloc
+from contextlib import closing
+from datetime import datetime, time, timedelta
+from time import monotonic, perf_counter
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from ..models import Doctor, Service, Shift
+from .benchmark import PERCENTILES, percentile
+from .database import get_sqlite_pragmas
+from .events import get_broker, hub, make_event
+
+# Database setups compared by the concurrency benchmark. None means the
+# project settings.
+DATABASE_PROFILES = {
+    # SQLite as Django opens it: rollback journal, full sync, deferred
+    # transactions and a new connection per request
+    'default': {'pragmas': {'journal_mode': 'delete', 'synchronous': 'full'}, 'transaction_mode': None, 'conn_max_age': 0},
+    'tuned': {'pragmas': None, 'transaction_mode': None, 'conn_max_age': None},
+    'tuned_immediate': {'pragmas': None, 'transaction_mode': 'IMMEDIATE', 'conn_max_age': None},
+}
+
+DEFAULT_PROCESSES = 2
+DEFAULT_THREADS = 4
+DEFAULT_DURATION = 5.0
+DEFAULT_WRITE_SHARE = 0.2
+
+# Weeks, starting next Monday, that readers list and writers book into
+LOAD_WEEKS = 4
+
+
+def configure_database(profile, pragmas):
+    """Point this process's default connection settings at a profile, pragmas being the project's"""
+    profile = DATABASE_PROFILES[profile]
+    settings_dict = connections['default'].settings_dict
+    settings.CLINIC_SQLITE_PRAGMAS = pragmas if profile['pragmas'] is None else profile['pragmas']
+    settings_dict.setdefault('OPTIONS', {})['transaction_mode'] = profile['transaction_mode']
+    if profile['conn_max_age'] is not None:
+        settings_dict['CONN_MAX_AGE'] = profile['conn_max_age']
+
+
+def load_thread(plan, deadline, seed, samples):
+    """Mixed reads and writes through the API until the deadline"""
+    generator = random.Random(seed)
+    client = APIClient()
+    client.force_authenticate(User(username='load', is_staff=True))
+    try:
+        while monotonic() < deadline:
+            week_start = generator.choice(plan['weeks'])
+            if generator.random() < plan['write_share']:
+                kind = 'write'
+                start = timezone.make_aware(datetime.combine(
+                    week_start + timedelta(days=generator.randrange(5)), time(8)
+                )) + timedelta(minutes=15 * generator.randrange(46))
+                request = lambda: client.post('/api/appointments/', {
+                    'patient_first_name': 'Load',
+                    'patient_last_name': f'Test {seed}',
+                    'patient_phone_number': '070 000 000',
+                    'doctor_id': generator.choice(plan['doctors']),
+                    'service_id': plan['service'],
+                    'price': plan['price'],
+                    'duration_minutes': 30,
+                    'start_datetime': start.isoformat(),
+                }, format='json')
+            else:
+                kind = 'read'
+                # One day of the schedule, as the dashboard lists it
+                day = (week_start + timedelta(days=generator.randrange(6))).isoformat()
+                request = lambda: client.get('/api/appointments/', {'start_date': day, 'end_date': day})
+            started = perf_counter()
+            try:
+                status = request().status_code
+            except OperationalError as error:
+                status = 'locked' if 'locked' in str(error) else 'error'
+            samples.append((kind, status, perf_counter() - started))
+    finally:
+        connection.close()
+
+
+def load_process(profile, plan, threads, deadline, seed, queue):
+    """Worker process: configure the profile and run the load threads"""
+    configure_database(profile, plan['pragmas'])
+    # Measure the application, not the development aids
+    settings.DEBUG = False
+    settings.CLINIC_QUERY_BUDGETS = False
+    samples = []
+    workers = [
+        threading.Thread(target=load_thread, args=(plan, deadline, seed * 1000 + i, samples))
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    queue.put(samples)
+
+
+def summarize_load(samples, elapsed):
+    summary = {}
+    for kind in ('read', 'write'):
+        durations = sorted(duration for sample_kind, status, duration in samples if sample_kind == kind)
+        statuses = [status for sample_kind, status, duration in samples if sample_kind == kind]
+        summary[kind] = {
+            'requests': len(durations),
+            'per_second': round(len(durations) / elapsed, 1),
+            'ok': sum(1 for status in statuses if status in (200, 201)),
+            'conflicts': statuses.count(400),
+            'locked': statuses.count('locked'),
+            'errors': sum(1 for status in statuses if status not in (200, 201, 400, 'locked')),
+        }
+        for percent in PERCENTILES:
+            summary[kind][f'p{percent}_ms'] = round(percentile(durations, percent) * 1000, 3) if durations else None
+    return summary
+
+
+class ConcurrencyBenchmark:
+    """
+    Mixed API readers and writers across processes and threads against a
+    copy of the SQLite database, once per database profile, reporting
+    throughput, latency and "database is locked" failures of each
+    """
+    def __init__(self, profiles=None, processes=DEFAULT_PROCESSES, threads=DEFAULT_THREADS,
+                 duration=DEFAULT_DURATION, write_share=DEFAULT_WRITE_SHARE, in_place=False, progress=None):
+        self.profiles = profiles or list(DATABASE_PROFILES)
+        self.processes = processes
+        self.threads = threads
+        self.duration = duration
+        self.write_share = write_share
+        self.in_place = in_place
+        self.progress = progress
+
+    def plan(self):
+        doctors = list(Doctor.objects.values_list('id', flat=True)[:50])
+        service = Service.objects.order_by('id').first()
+        if not doctors or service is None:
+            raise ValueError('The benchmark needs at least one doctor and service, generate a dataset first')
+        today = timezone.localdate()
+        next_monday = today + timedelta(days=7 - today.weekday())
+        return {
+            'doctors': doctors,
+            'service': service.id,
+            'price': str(service.price),
+            'weeks': [next_monday + timedelta(weeks=week) for week in range(LOAD_WEEKS)],
+            'write_share': self.write_share,
+            'pragmas': get_sqlite_pragmas(),
+        }
+
+    def run(self):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            raise ValueError('The concurrency benchmark needs a file SQLite database')
+        plan = self.plan()
+        settings_dict = connections['default'].settings_dict
+        original = {
+            'NAME': settings_dict['NAME'],
+            'CONN_MAX_AGE': settings_dict['CONN_MAX_AGE'],
+            'OPTIONS': dict(settings_dict.get('OPTIONS', {})),
+        }
+        directory = None if self.in_place else tempfile.mkdtemp(prefix='clinic-load-')
+        results = {}
+        try:
+            for profile in self.profiles:
+                connections.close_all()
+                if directory:
+                    copy = os.path.join(directory, f'{profile}.sqlite3')
+                    with closing(sqlite3.connect(original['NAME'])) as source, closing(sqlite3.connect(copy)) as target:
+                        source.backup(target)
+                    settings_dict['NAME'] = copy
+                results[profile] = self.run_profile(profile, plan)
+                if self.progress:
+                    self.progress(profile, results[profile])
+        finally:
+            connections.close_all()
+            settings_dict.update(original)
+            settings.CLINIC_SQLITE_PRAGMAS = plan['pragmas']
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+        return {
+            'processes': self.processes,
+            'threads': self.threads,
+            'duration': self.duration,
+            'write_share': self.write_share,
+            'profiles': results,
+        }
+
+    def run_profile(self, profile, plan):
+        # Open one connection with the profile first, as the journal mode is
+        # stored in the database file
+        configure_database(profile, plan['pragmas'])
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        started = monotonic()
+        deadline = started + self.duration
+        workers = [
+            context.Process(target=load_process, args=(profile, plan, self.threads, deadline, seed, queue))
+            for seed in range(self.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        samples = []
+        for worker in workers:
+            samples.extend(queue.get())
+        for worker in workers:
+            worker.join()
+        elapsed = monotonic() - started
+        summary = summarize_load(samples, elapsed)
+        summary['journal_mode'] = journal_mode
+        summary['transaction_mode'] = DATABASE_PROFILES[profile]['transaction_mode']
+        return summary
+
+
+# Endpoint pairs compared by the ASGI benchmark: the DRF view, which ASGI
+# runs in a thread, and its native async version
+ASGI_SCENARIOS = {
+    'calendar_week': ('/api/calendar/', '/api/async/calendar/'),
+    'future_week': ('/api/appointments/future/', '/api/async/appointments/future/'),
+    'shift_week': ('/api/shifts/', '/api/async/shifts/'),
+}
+
+DEFAULT_CLIENTS = 50
+DEFAULT_ASGI_DURATION = 3.0
+
+# Cache alias the ASGI benchmark points the calendar cache at, so every
+# request builds its week
+UNCACHED_ALIAS = 'clinic-benchmark-uncached'
+
+
+def asgi_scope(path, params, headers):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': urlencode(params).encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), *headers],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+
+
+async def asgi_get(application, path, params, headers):
+    """Send a GET straight to an ASGI application, returning the response status"""
+    scope = asgi_scope(path, params, headers)
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects, Django cancels this wait once it has responded
+        await asyncio.Future()
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+def summarize_asgi(durations, statuses, elapsed):
+    durations = sorted(durations)
+    summary = {
+        'requests': len(durations),
+        'per_second': round(len(durations) / elapsed, 1),
+        'ok': statuses.count(200),
+        'errors': sum(1 for status in statuses if status != 200),
+    }
+    for percent in PERCENTILES:
+        summary[f'p{percent}_ms'] = round(percentile(durations, percent) * 1000, 3) if durations else None
+    return summary
+
+
+class AsgiBenchmark:
+    """
+    Many concurrent clients against the ASGI application of this process,
+    per scenario once through the sync DRF endpoint and once through its
+    async version. Requests go straight to the ASGI callable, so the numbers
+    leave out a server's HTTP parsing but include Django's handler,
+    middleware and JWT authentication. The calendar cache is bypassed
+    unless cached is set.
+    """
+    def __init__(self, scenarios=None, clients=DEFAULT_CLIENTS, duration=DEFAULT_ASGI_DURATION,
+                 cached=False, progress=None):
+        self.scenarios = scenarios or list(ASGI_SCENARIOS)
+        self.clients = clients
+        self.duration = duration
+        self.cached = cached
+        self.progress = progress
+
+    def plan(self):
+        year = timezone.now().year
+        weeks = sorted(set(Shift.objects.filter(year=year).values_list('week_of_year', flat=True)))
+        if not weeks:
+            raise ValueError(f'There are no shifts in {year}, generate a dataset first')
+        return [{'week': week, 'year': year} for week in weeks]
+
+    def run(self):
+        weeks = self.plan()
+        overrides = {'DEBUG': False, 'CLINIC_QUERY_BUDGETS': False}
+        if not self.cached:
+            overrides['CACHES'] = {
+                **settings.CACHES, UNCACHED_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+            }
+            overrides['CLINIC_CALENDAR_CACHE'] = UNCACHED_ALIAS
+        # A real user, as the async views load it from the token
+        user = User.objects.create(username=f'asgi-benchmark-{os.getpid()}', is_staff=True)
+        headers = [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())]
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        results = {}
+        try:
+            with override_settings(**overrides):
+                application = ASGIHandler()
+                for scenario in self.scenarios:
+                    results[scenario] = {
+                        mode: asyncio.run(self.run_clients(application, path, weeks, headers))
+                        for mode, path in zip(('sync', 'async'), ASGI_SCENARIOS[scenario])
+                    }
+                    if self.progress:
+                        self.progress(scenario, results[scenario])
+        finally:
+            request_logger.setLevel(level)
+            user.delete()
+        return {
+            'clients': self.clients,
+            'duration': self.duration,
+            'cached': self.cached,
+            'scenarios': results,
+        }
+
+    async def run_clients(self, application, path, weeks, headers):
+        if self.cached:
+            # Untimed pass so both endpoints start from a warm cache
+            for params in weeks:
+                await asgi_get(application, path, params, headers)
+        durations, statuses = [], []
+        started = monotonic()
+        deadline = started + self.duration
+
+        async def client(offset):
+            i = offset
+            while monotonic() < deadline:
+                request_started = perf_counter()
+                statuses.append(await asgi_get(application, path, weeks[i % len(weeks)], headers))
+                durations.append(perf_counter() - request_started)
+                i += 1
+
+        await asyncio.gather(*(client(offset) for offset in range(self.clients)))
+        return summarize_asgi(durations, statuses, monotonic() - started)
+
+
+class EventStreamClient:
+    """
+    One Server-Sent Events connection to an ASGI application, parsing the
+    messages it receives until close is called. read_delay makes it a slow
+    reader, sleeping after every chunk before it takes the next.
+    """
+    def __init__(self, application, path, params, headers, read_delay=0):
+        self.application = application
+        self.scope = asgi_scope(path, params, headers)
+        self.read_delay = read_delay
+        self.status = None
+        self.headers = {}
+        self.events = []
+        self.comments = 0
+        self.latencies = []
+        self.buffer = ''
+        self.connected = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.started = None
+        self.connect_time = None
+
+    async def run(self):
+        received = False
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await self.closed.wait()
+            return {'type': 'http.disconnect'}
+
+        self.started = perf_counter()
+        try:
+            await self.application(self.scope, receive, self.send)
+        finally:
+            # Error responses end without a stream
+            self.connected.set()
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.headers = {name.decode().lower(): value.decode() for name, value in message['headers']}
+            return
+        if not self.connected.is_set():
+            self.connect_time = perf_counter() - self.started
+            self.connected.set()
+        self.buffer += message.get('body', b'').decode()
+        while '\n\n' in self.buffer:
+            block, self.buffer = self.buffer.split('\n\n', 1)
+            self.parse(block)
+        if self.read_delay:
+            await asyncio.sleep(self.read_delay)
+
+    def parse(self, block):
+        event = {}
+        for line in block.split('\n'):
+            name, _, value = line.partition(':')
+            if not name:
+                self.comments += 1
+            elif name in ('event', 'data', 'id'):
+                event[name] = value.strip()
+        if 'data' not in event:
+            return
+        event['data'] = json.loads(event['data'])
+        if 'sent' in event['data']:
+            self.latencies.append(perf_counter() - event['data']['sent'])
+        self.events.append(event)
+
+    async def wait_for_events(self, count, timeout):
+        """Whether count events arrived within timeout seconds"""
+        deadline = monotonic() + timeout
+        while len(self.events) < count:
+            if monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    def close(self):
+        self.closed.set()
+
+
+DEFAULT_IDLE_STREAMS = 300
+DEFAULT_ACTIVE_STREAMS = 100
+DEFAULT_SLOW_STREAMS = 5
+DEFAULT_STREAM_EVENTS = 200
+DEFAULT_EVENT_RATE = 100.0
+
+# Seconds a slow client sleeps after every chunk it reads
+SLOW_READ_DELAY = 1.0
+
+# Weeks the active and the idle streams follow
+ACTIVE_WEEK = (10, 2000)
+IDLE_WEEK = (11, 2000)
+
+# Extra idle streams opened with memory tracing on
+MEMORY_SAMPLE = 20
+
+
+class SseBenchmark:
+    """
+    Many open Server-Sent Events streams on the ASGI application of this
+    process: idle ones following a week nothing happens in, active ones
+    following the week events are published for, and slow ones that read
+    one chunk a second. Events are published through the configured broker
+    from another thread, as commits of sync views do, at a fixed rate.
+    Reports how long connecting takes, the memory held per open stream,
+    how long events take from publishing to the client and how many slow
+    clients were dropped.
+    """
+    def __init__(self, idle=DEFAULT_IDLE_STREAMS, active=DEFAULT_ACTIVE_STREAMS, slow=DEFAULT_SLOW_STREAMS,
+                 events=DEFAULT_STREAM_EVENTS, rate=DEFAULT_EVENT_RATE, progress=None):
+        self.idle = idle
+        self.active = active
+        self.slow = slow
+        self.events = events
+        self.rate = rate
+        self.progress = progress
+
+    def run(self):
+        user = User.objects.create(username=f'sse-benchmark-{os.getpid()}', is_staff=True)
+        headers = [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())]
+        try:
+            with override_settings(DEBUG=False, CLINIC_QUERY_BUDGETS=False):
+                return asyncio.run(self.run_streams(ASGIHandler(), headers))
+        finally:
+            user.delete()
+
+    async def run_streams(self, application, headers):
+        def params(week):
+            return {'week': week[0], 'year': week[1]}
+
+        clients = (
+            [EventStreamClient(application, '/api/async/events/', params(IDLE_WEEK), headers) for _ in range(self.idle)]
+            + [EventStreamClient(application, '/api/async/events/', params(ACTIVE_WEEK), headers) for _ in range(self.active)]
+            + [EventStreamClient(application, '/api/async/events/', params(ACTIVE_WEEK), headers, SLOW_READ_DELAY)
+               for _ in range(self.slow)]
+        )
+        idle, active, slow = clients[:self.idle], clients[self.idle:self.idle + self.active], clients[self.idle + self.active:]
+        stats = dict(hub.stats)
+
+        # Untimed stream first, so lazy imports and caches are not counted
+        await self.open_and_close(EventStreamClient(application, '/api/async/events/', params(IDLE_WEEK), headers))
+
+        started = perf_counter()
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        await asyncio.gather(*(client.connected.wait() for client in clients))
+        connect_elapsed = perf_counter() - started
+        connect_times = sorted(client.connect_time for client in clients if client.connect_time is not None)
+        if self.progress:
+            self.progress(f'{len(clients)} streams open after {connect_elapsed:.2f}s')
+
+        # Memory is traced on extra idle streams only, as tracing slows connecting down
+        sample = [
+            EventStreamClient(application, '/api/async/events/', params(IDLE_WEEK), headers) for _ in range(MEMORY_SAMPLE)
+        ]
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            tasks += [asyncio.create_task(client.run()) for client in sample]
+            await asyncio.gather(*(client.connected.wait() for client in sample))
+            memory = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        clients += sample
+        idle += sample
+
+        broker = get_broker()
+
+        def publish():
+            for i in range(self.events):
+                event = make_event('appointment', 'upsert', [i], [ACTIVE_WEEK], [1])
+                broker.publish({**event, 'sent': perf_counter()})
+                sleep_until = started_publishing + (i + 1) / self.rate
+                delay = sleep_until - perf_counter()
+                if delay > 0:
+                    threading.Event().wait(delay)
+
+        started_publishing = perf_counter()
+        publisher = threading.Thread(target=publish)
+        publisher.start()
+        await asyncio.gather(*(
+            client.wait_for_events(self.events, self.events / self.rate + 5) for client in active
+        ))
+        publisher.join()
+        # Give the slow readers a moment to be cut off
+        await asyncio.sleep(SLOW_READ_DELAY)
+        for client in clients:
+            client.close()
+        await asyncio.gather(*tasks)
+
+        latencies = sorted(latency for client in active for latency in client.latencies)
+        results = {
+            'streams': {'idle': self.idle, 'active': self.active, 'slow': self.slow},
+            'events': self.events,
+            'rate': self.rate,
+            'connect_seconds': round(connect_elapsed, 3),
+            'connects_per_second': round(len(connect_times) / connect_elapsed, 1),
+            'errors': sum(1 for client in clients if client.status != 200),
+            'memory_per_stream_kb': round(memory / MEMORY_SAMPLE / 1024, 1),
+            'expected_deliveries': self.events * self.active,
+            'delivered': sum(len(client.events) for client in active),
+            'idle_delivered': sum(len(client.events) for client in idle),
+            'slow_dropped': sum(1 for client in slow if client.events and client.events[-1].get('event') == 'dropped'),
+            'hub': {name: hub.stats[name] - stats[name] for name in stats},
+        }
+        for percent in PERCENTILES:
+            results[f'connect_p{percent}_ms'] = round(percentile(connect_times, percent) * 1000, 3) if connect_times else None
+            results[f'latency_p{percent}_ms'] = round(percentile(latencies, percent) * 1000, 3) if latencies else None
+        return results
+
+    async def open_and_close(self, client):
+        task = asyncio.create_task(client.run())
+        await client.connected.wait()
+        client.close()
+        await task
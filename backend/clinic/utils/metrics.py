@@ -0,0 +1,147 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+from django.conf import settings
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Quantiles reported over the recent requests of each route
+QUANTILES = (0.5, 0.9, 0.99)
+
+DEFAULT_RING_SIZE = 512
+
+# Methods recorded under their own name. Clients can send any method, so
+# the rest share one label instead of each adding a series.
+KNOWN_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+OTHER_METHOD = 'other'
+
+
+def method_label(method):
+    return method if method in KNOWN_METHODS else OTHER_METHOD
+
+
+class RouteMetrics:
+    """Counters of one (route, method) pair, plus a ring buffer of recent requests"""
+    __slots__ = ('statuses', 'buckets', 'count', 'duration', 'queries', 'db_time', 'recent')
+
+    def __init__(self, ring_size):
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        # (duration, queries, db_time) of the latest requests
+        self.recent = deque(maxlen=ring_size)
+
+
+class MetricsRegistry:
+    """
+    Process-local request metrics. Recording is a dict lookup and a few
+    additions under a lock, the expensive work happens when scraping.
+    """
+    def __init__(self, ring_size=None):
+        self.ring_size = ring_size
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, method, status_code, duration, queries, db_time):
+        status = f'{status_code // 100}xx'
+        bucket = bisect_left(LATENCY_BUCKETS, duration)
+        with self.lock:
+            metrics = self.routes.get((route, method))
+            if metrics is None:
+                ring_size = self.ring_size or getattr(settings, 'CLINIC_METRICS_RING_SIZE', DEFAULT_RING_SIZE)
+                metrics = self.routes[(route, method)] = RouteMetrics(ring_size)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.buckets[bucket] += 1
+            metrics.count += 1
+            metrics.duration += duration
+            metrics.queries += queries
+            metrics.db_time += db_time
+            metrics.recent.append((duration, queries, db_time))
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    def snapshot(self):
+        """Copies of the per-route metrics, safe to read without the lock"""
+        with self.lock:
+            return {
+                key: {
+                    'statuses': dict(metrics.statuses),
+                    'buckets': list(metrics.buckets),
+                    'count': metrics.count,
+                    'duration': metrics.duration,
+                    'queries': metrics.queries,
+                    'db_time': metrics.db_time,
+                    'recent': list(metrics.recent),
+                }
+                for key, metrics in self.routes.items()
+            }
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        metric('clinic_http_requests_total', 'counter', 'Requests by route, method and status class.')
+        for (route, method), data in snapshot:
+            for status, count in sorted(data['statuses'].items()):
+                lines.append(f'clinic_http_requests_total{{{labels(route, method)},status="{status}"}} {count}')
+
+        metric('clinic_http_request_duration_seconds', 'histogram', 'Request latency.')
+        for (route, method), data in snapshot:
+            cumulative = 0
+            for bound, count in zip([*LATENCY_BUCKETS, '+Inf'], data['buckets']):
+                cumulative += count
+                lines.append(
+                    f'clinic_http_request_duration_seconds_bucket{{{labels(route, method)},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'clinic_http_request_duration_seconds_sum{{{labels(route, method)}}} {data["duration"]:.6f}')
+            lines.append(f'clinic_http_request_duration_seconds_count{{{labels(route, method)}}} {data["count"]}')
+
+        metric('clinic_http_request_db_queries_total', 'counter', 'Database queries run by requests.')
+        for (route, method), data in snapshot:
+            lines.append(f'clinic_http_request_db_queries_total{{{labels(route, method)}}} {data["queries"]}')
+
+        metric('clinic_http_request_db_seconds_total', 'counter', 'Time requests spent in database queries.')
+        for (route, method), data in snapshot:
+            lines.append(f'clinic_http_request_db_seconds_total{{{labels(route, method)}}} {data["db_time"]:.6f}')
+
+        for index, (name, help_text) in enumerate([
+            ('clinic_http_recent_request_duration_seconds', 'Latency of the latest requests.'),
+            ('clinic_http_recent_request_db_queries', 'Database queries of the latest requests.'),
+            ('clinic_http_recent_request_db_seconds', 'Database time of the latest requests.'),
+        ]):
+            metric(name, 'summary', help_text)
+            for (route, method), data in snapshot:
+                values = sorted(sample[index] for sample in data['recent'])
+                for quantile in QUANTILES:
+                    value = values[min(len(values) - 1, int(quantile * len(values)))]
+                    lines.append(f'{name}{{{labels(route, method)},quantile="{quantile}"}} {format_value(value)}')
+                lines.append(f'{name}_sum{{{labels(route, method)}}} {format_value(sum(values))}')
+                lines.append(f'{name}_count{{{labels(route, method)}}} {len(values)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(route, method):
+    return f'route="{escape_label(route)}",method="{escape_label(method)}"'
+
+
+def format_value(value):
+    return str(value) if isinstance(value, int) else f'{value:.6f}'
+
+
+registry = MetricsRegistry()
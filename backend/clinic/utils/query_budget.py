@@ -0,0 +1,100 @@
+import re
+import traceback
+from django.conf import settings
+
+# Identical-shape queries a request may repeat before it is flagged as N+1
+DEFAULT_REPEAT_THRESHOLD = 5
+
+# Call site frames kept in a violation's stack
+STACK_DEPTH = 8
+
+_whitespace = re.compile(r'\s+')
+_strings = re.compile(r"'(?:[^']|'')*'")
+_numbers = re.compile(r'\b\d+(?:\.\d+)?\b')
+_lists = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+def fingerprint(sql):
+    """
+    The shape of a query: literals and parameters become ?, and IN lists
+    of any length look the same
+    """
+    sql = _strings.sub('?', sql)
+    sql = _numbers.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _lists.sub('(...)', sql)
+    return _whitespace.sub(' ', sql).strip()
+
+
+def query_budget(queries):
+    """Declare the most queries a view or viewset action may run per request"""
+    def decorator(func):
+        func.query_budget = queries
+        return func
+    return decorator
+
+
+def get_query_budget(view_func, method):
+    """
+    Budget of the handler a request is routed to: a query_budget on the
+    handler itself, else the view class's query_budgets entry for the action
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, 'query_budget', None)
+    action = (getattr(view_func, 'actions', None) or {}).get(method.lower(), method.lower())
+    budget = getattr(getattr(cls, action, None), 'query_budget', None)
+    if budget is None:
+        budget = getattr(cls, 'query_budgets', {}).get(action)
+    return budget
+
+
+def call_site():
+    """The project frames of the current stack, innermost last"""
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and not frame.filename.endswith(('query_budget.py', 'middleware.py'))
+    ]
+    return ''.join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+
+class QueryInspector:
+    """Queries of one request grouped by fingerprint"""
+    def __init__(self, repeat_threshold=None):
+        self.repeat_threshold = repeat_threshold or getattr(
+            settings, 'CLINIC_QUERY_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD
+        )
+        self.budget = None
+        self.count = 0
+        self.counts = {}
+        self.stacks = {}
+        self.budget_stack = None
+
+    def record(self, sql):
+        self.count += 1
+        shape = fingerprint(sql)
+        count = self.counts[shape] = self.counts.get(shape, 0) + 1
+        if count == self.repeat_threshold:
+            self.stacks[shape] = call_site()
+        if self.budget is not None and self.count == self.budget + 1:
+            self.budget_stack = call_site()
+
+    def violations(self):
+        """Budget overruns and repeated queries, as dicts with a message and a stack"""
+        violations = []
+        if self.budget is not None and self.count > self.budget:
+            violations.append({
+                'kind': 'budget',
+                'message': f'{self.count} queries, over the budget of {self.budget}',
+                'stack': self.budget_stack,
+            })
+        for shape, count in self.counts.items():
+            if count >= self.repeat_threshold:
+                violations.append({
+                    'kind': 'repeated',
+                    'message': f'{count} queries of the same shape: {shape[:300]}',
+                    'stack': self.stacks[shape],
+                })
+        return violations
@@ -0,0 +1,56 @@
+import re
+import unicodedata
+from django.db.models import Q
+
+# Sorts after every other character, so [prefix, prefix + PREFIX_END)
+# covers all strings starting with prefix
+PREFIX_END = '\U0010ffff'
+
+# Shortest digit string treated as a phone number search
+MIN_PHONE_DIGITS = 3
+
+
+def normalize_name(value):
+    """Lowercase, accent-fold and collapse whitespace in a name"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())
+
+
+def normalize_phone(value):
+    """Keep only the digits of a phone number"""
+    return re.sub(r'\D', '', value or '')
+
+
+def prefix_filter(field_name, prefix):
+    """
+    Match values of an indexed column starting with prefix using a range,
+    which every backend can answer from a plain B-tree index
+    """
+    return Q(**{f'{field_name}__gte': prefix, f'{field_name}__lt': prefix + PREFIX_END})
+
+
+def patient_search_filter(query):
+    """
+    Build an indexed filter for a patient search box query.
+
+    Queries without letters and with enough digits match phone number
+    prefixes. Otherwise the first word matches a first or last name prefix,
+    and a second word the other name.
+    """
+    if not re.search(r'[^\W\d_]', query):
+        digits = normalize_phone(query)
+        if len(digits) >= MIN_PHONE_DIGITS:
+            return prefix_filter('patient_phone_digits', digits)
+
+    words = normalize_name(query).split()
+    if not words:
+        return Q()
+    if len(words) == 1:
+        return prefix_filter('patient_first_name_search', words[0]) | prefix_filter('patient_last_name_search', words[0])
+
+    first, rest = words[0], ' '.join(words[1:])
+    return (
+        (prefix_filter('patient_first_name_search', first) & prefix_filter('patient_last_name_search', rest)) |
+        (prefix_filter('patient_last_name_search', first) & prefix_filter('patient_first_name_search', rest))
+    )
@@ -1,8 +1,60 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from ..models import Doctor, Shift
+from ..signals import shifts_bulk_changed
 from decimal import Decimal
 
+# Rotation codes, one byte per doctor and week in a RotationPlan
+FIRST = 1
+SECOND = 2
+SATURDAY = 4
+
+# Monday rotations count weeks from, so any run of weeks is planned the same
+# way as the whole year around it
+ROTATION_EPOCH = date(2001, 1, 1)
+
+
+class RotationPlan:
+    """
+    Doctor assignments over a horizon of weeks, held as one byte per week and
+    doctor: FIRST or SECOND for the Monday to Friday shifts, plus SATURDAY
+    when the doctor also works that Saturday's first shift
+    """
+    def __init__(self, weeks, doctor_ids, cells):
+        self.weeks = weeks
+        self.doctor_ids = doctor_ids
+        self.cells = cells
+    
+    def code(self, week_index, doctor_index):
+        return self.cells[week_index * len(self.doctor_ids) + doctor_index]
+    
+    def assignments(self):
+        """Yield (week_of_year, year, day_of_week, shift_type, doctor_id) for every assignment"""
+        doctor_count = len(self.doctor_ids)
+        for week_index, (week_of_year, year) in enumerate(self.weeks):
+            row = self.cells[week_index * doctor_count:(week_index + 1) * doctor_count]
+            for doctor_id, code in zip(self.doctor_ids, row):
+                for shift_type, bit in (('first', FIRST), ('second', SECOND)):
+                    if code & bit:
+                        for day_of_week in range(5):
+                            yield week_of_year, year, day_of_week, shift_type, doctor_id
+                if code & SATURDAY:
+                    yield week_of_year, year, 5, 'first', doctor_id
+    
+    def load(self):
+        """{doctor_id: {'first': n, 'second': n, 'saturday': n}} weeks worked over the horizon"""
+        load = {doctor_id: {'first': 0, 'second': 0, 'saturday': 0} for doctor_id in self.doctor_ids}
+        doctor_count = len(self.doctor_ids)
+        for index, code in enumerate(self.cells):
+            counts = load[self.doctor_ids[index % doctor_count]]
+            counts['first'] += bool(code & FIRST)
+            counts['second'] += bool(code & SECOND)
+            counts['saturday'] += bool(code & SATURDAY)
+        return load
+
+
 class ShiftRotationManager:
     """Manages automatic rotation of doctors between shifts"""
     
@@ -11,6 +63,9 @@ class ShiftRotationManager:
         'second': {'start': '13:00', 'end': '20:00'},
     }
     
+    # Rows per statement for bulk writes, below SQLite's variable limit
+    BULK_BATCH_SIZE = 500
+    
     @classmethod
     def get_week_start_date(cls, week_of_year, year=None):
         """Get the start date (Monday) of a given week"""
@@ -35,112 +90,279 @@ class ShiftRotationManager:
         """Get the week number for a given date"""
         return date.isocalendar()[1]
     
+    @classmethod
+    def get_week_and_year(cls, date):
+        """
+        Get the (week_of_year, year) of the week containing a date, numbered
+        the same way as get_week_start_date. Days before the first Monday of
+        a year belong to the last week of the previous year.
+        """
+        monday = date - timedelta(days=date.weekday())
+        first_monday = cls.get_week_start_date(1, monday.year)
+        return (monday - first_monday).days // 7 + 1, monday.year
+    
+    @classmethod
+    def get_weeks_in_year(cls, year):
+        """Get the number of weeks (Mondays) in a year"""
+        return cls.get_week_and_year(datetime(year, 12, 31).date())[0]
+    
+    @classmethod
+    def iter_weeks(cls, start_week, start_year, end_week, end_year):
+        """Yield (week_of_year, year) pairs from start to end inclusive, across years"""
+        current = cls.get_week_start_date(start_week, start_year)
+        end = cls.get_week_start_date(end_week, end_year)
+        while current <= end:
+            yield cls.get_week_and_year(current)
+            current += timedelta(weeks=1)
+    
+    @classmethod
+    def weeks_filter(cls, weeks, prefix=''):
+        """Build a Q matching shifts in any of the given (week_of_year, year) pairs"""
+        weeks_by_year = {}
+        for week_of_year, year in weeks:
+            weeks_by_year.setdefault(year, set()).add(week_of_year)
+        
+        query = Q(pk__in=[])
+        for year, week_numbers in weeks_by_year.items():
+            query |= Q(**{f'{prefix}year': year, f'{prefix}week_of_year__in': sorted(week_numbers)})
+        return query
+    
+    @classmethod
+    def get_week_shift_keys(cls):
+        """Get the (day_of_week, shift_type) pairs worked in a week"""
+        keys = []
+        # Monday to Friday have two shifts, Saturday only the first one
+        for day_of_week in range(6):
+            shift_types = ['first', 'second'] if day_of_week < 5 else ['first']
+            for shift_type in shift_types:
+                keys.append((day_of_week, shift_type))
+        return keys
+    
     @classmethod
     def create_or_update_shifts_for_week(cls, week_of_year, year=None):
         """Create or update shifts for a specific week"""
         if year is None:
             year = timezone.now().year
-            
-        week_start = cls.get_week_start_date(week_of_year, year)
-        doctors = Doctor.objects.all()
         
-        if not doctors.exists():
-            return []
+        return list(cls.generate_shifts([(week_of_year, year)])['shifts'])
+    
+    @classmethod
+    def generate_shifts(cls, weeks):
+        """
+        Create or update the shifts of the given (week_of_year, year) pairs.
         
-        shifts_created = []
+        Doctors are loaded once, missing shifts are inserted with one bulk
+        insert and the doctor assignments are written as a single insert and
+        delete diff against the existing rows, all inside one transaction.
+        Existing shifts keep their start and end times.
         
-        # Create shifts for each day of the week (Monday to Saturday)
-        for day_of_week in range(6):  # 0=Monday to 5=Saturday
-            current_date = week_start + timedelta(days=day_of_week)
+        Returns a report with the generated shifts and how many shifts were
+        created, updated (doctors changed) and left unchanged.
+        """
+        report = {
+            'shifts': Shift.objects.none(),
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'doctors_added': 0,
+            'doctors_removed': 0,
+        }
+        weeks = sorted(set(weeks), key=lambda week: (week[1], week[0]))
+        
+        with transaction.atomic():
+            doctors = list(Doctor.objects.all())
+            if not doctors or not weeks:
+                return report
             
-            # For Saturday, only create one shift (first)
-            shift_types = ['first', 'second'] if day_of_week < 5 else ['first']
+            week_filter = cls.weeks_filter(weeks)
+            shifts = {
+                (shift.year, shift.week_of_year, shift.day_of_week, shift.shift_type): shift
+                for shift in Shift.objects.filter(week_filter)
+            }
             
-            for shift_type in shift_types:
-                shift, created = Shift.objects.get_or_create(
-                    week_of_year=week_of_year,
-                    day_of_week=day_of_week,
-                    shift_type=shift_type,
-                    defaults={
-                        'start_time': cls.DEFAULT_SHIFT_TIMES[shift_type]['start'],
-                        'end_time': cls.DEFAULT_SHIFT_TIMES[shift_type]['end'],
-                    }
+            new_shifts = []
+            for week_of_year, year in weeks:
+                for day_of_week, shift_type in cls.get_week_shift_keys():
+                    if (year, week_of_year, day_of_week, shift_type) not in shifts:
+                        new_shifts.append(Shift(
+                            year=year,
+                            week_of_year=week_of_year,
+                            day_of_week=day_of_week,
+                            shift_type=shift_type,
+                            start_time=cls.DEFAULT_SHIFT_TIMES[shift_type]['start'],
+                            end_time=cls.DEFAULT_SHIFT_TIMES[shift_type]['end'],
+                        ))
+            
+            if new_shifts:
+                Shift.objects.bulk_create(new_shifts)
+                if any(shift.pk is None for shift in new_shifts):
+                    # Backends that cannot return ids from bulk inserts
+                    new_shifts = list(Shift.objects.filter(week_filter).exclude(
+                        id__in=[shift.pk for shift in shifts.values()]
+                    ))
+                for shift in new_shifts:
+                    shifts[(shift.year, shift.week_of_year, shift.day_of_week, shift.shift_type)] = shift
+            new_shift_ids = {shift.pk for shift in new_shifts}
+            
+            # Desired assignments according to the rotation
+            plan = cls.plan_rotation(weeks, [doctor.pk for doctor in doctors])
+            desired = {
+                (shifts[(year, week_of_year, day_of_week, shift_type)].pk, doctor_id)
+                for week_of_year, year, day_of_week, shift_type, doctor_id in plan.assignments()
+            }
+            
+            # Existing assignments, diffed against the desired ones
+            Assignment = Shift.doctors.through
+            existing = {
+                (shift_id, doctor_id): assignment_id
+                for assignment_id, shift_id, doctor_id in Assignment.objects.filter(
+                    cls.weeks_filter(weeks, prefix='shift__')
+                ).values_list('id', 'shift_id', 'doctor_id')
+            }
+            to_add = desired - existing.keys()
+            to_remove = [existing[key] for key in existing.keys() - desired]
+            
+            if to_remove:
+                for i in range(0, len(to_remove), cls.BULK_BATCH_SIZE):
+                    Assignment.objects.filter(id__in=to_remove[i:i + cls.BULK_BATCH_SIZE]).delete()
+            if to_add:
+                Assignment.objects.bulk_create(
+                    [Assignment(shift_id=shift_id, doctor_id=doctor_id) for shift_id, doctor_id in sorted(to_add)],
+                    batch_size=cls.BULK_BATCH_SIZE
                 )
-                
-                # Assign doctors based on rotation logic
-                cls._assign_doctors_to_shift(shift, week_of_year, day_of_week, shift_type)
-                shifts_created.append(shift)
-        
-        return shifts_created
-    
-    @classmethod
-    def _assign_doctors_to_shift(cls, shift, week_of_year, day_of_week, shift_type):
-        """Assign doctors to a shift based on rotation logic"""
-        doctors = list(Doctor.objects.all())
-        if not doctors:
-            return
-        
-        # Clear existing assignments
-        shift.doctors.clear()
-        
-        # Simple rotation logic: alternate between first and second shifts
-        # A doctor who was on first shift in week N should be on second shift in week N + 1
-        for i, doctor in enumerate(doctors):
-            # Determine if this doctor should be on this shift based on rotation
-            should_assign = cls._should_assign_doctor_to_shift(
-                doctor, week_of_year, day_of_week, shift_type
-            )
             
-            if should_assign:
-                shift.doctors.add(doctor)
+            changed_shift_ids = {shift_id for shift_id, doctor_id in to_add}
+            changed_shift_ids.update(shift_id for shift_id, doctor_id in existing.keys() - desired)
+            if new_shifts or to_add or to_remove:
+                shifts_bulk_changed.send(sender=Shift, weeks=weeks, shift_ids=sorted(changed_shift_ids | new_shift_ids))
+        
+        changed_shift_ids -= new_shift_ids
+        
+        report['shifts'] = Shift.objects.filter(week_filter).prefetch_related(
+            'doctors'
+        ).order_by('year', 'week_of_year', 'day_of_week', 'shift_type')
+        report['created'] = len(new_shift_ids)
+        report['updated'] = len(changed_shift_ids)
+        report['unchanged'] = len(shifts) - len(new_shift_ids) - len(changed_shift_ids)
+        report['doctors_added'] = len(to_add)
+        report['doctors_removed'] = len(to_remove)
+        return report
     
     @classmethod
-    def _should_assign_doctor_to_shift(cls, doctor, week_of_year, day_of_week, shift_type):
-        """Determine if a doctor should be assigned to a specific shift based on rotation"""
-        # Simple rotation: alternate between first and second shifts
-        # For now, assign all doctors to all shifts (can be refined later)
-        return True
+    def get_rotation_week(cls, week_of_year, year):
+        """Weeks from ROTATION_EPOCH to the given week, the position in the rotation"""
+        return (cls.get_week_start_date(week_of_year, year) - ROTATION_EPOCH).days // 7
+    
+    @classmethod
+    def plan_rotation(cls, weeks, doctor_ids, saturday_doctors=None):
+        """
+        Plan the given (week_of_year, year) pairs for the doctors in memory.
+        
+        Doctors in id order are split into two halves that swap between the
+        first and the second shift every week, so a doctor on first shifts in
+        week N is on second shifts in week N+1 and any two weeks in a row
+        hold five of each. Saturday's first shift goes round the doctors in
+        turns of saturday_doctors (by default half of them, rounded up), so
+        Saturdays worked differ by at most one over a run of weeks. A lone
+        doctor works every shift.
+        
+        The plan only depends on a week's position in the rotation, so
+        planning one week gives what planning the whole year gives for it.
+        New doctors, having the highest ids, leave the others' weekday shifts
+        alone and only move Saturday turns.
+        """
+        doctor_ids = sorted(doctor_ids)
+        doctor_count = len(doctor_ids)
+        cells = bytearray(len(weeks) * doctor_count)
+        if not doctor_count:
+            return RotationPlan(weeks, doctor_ids, cells)
+        if saturday_doctors is None:
+            saturday_doctors = (doctor_count + 1) // 2
+        saturday_doctors = min(max(saturday_doctors, 1), doctor_count)
+        
+        for week_index, (week_of_year, year) in enumerate(weeks):
+            rotation_week = cls.get_rotation_week(week_of_year, year)
+            row = week_index * doctor_count
+            if doctor_count == 1:
+                cells[row] = FIRST | SECOND | SATURDAY
+                continue
+            for doctor_index in range(doctor_count):
+                cells[row + doctor_index] = FIRST if (doctor_index + rotation_week) % 2 == 0 else SECOND
+            turn = rotation_week * saturday_doctors
+            for offset in range(saturday_doctors):
+                cells[row + (turn + offset) % doctor_count] |= SATURDAY
+        return RotationPlan(weeks, doctor_ids, cells)
     
     @classmethod
     def rotate_shifts_for_next_week(cls, current_week=None, year=None):
         """Rotate doctors for the next week based on current assignments"""
         if current_week is None:
-            current_week = cls.get_week_of_year(timezone.now().date())
-        
-        next_week = current_week + 1
-        if next_week > 52:
-            next_week = 1
-            if year:
-                year += 1
+            current_week, year = cls.get_week_and_year(timezone.localdate())
+        if year is None:
+            year = timezone.now().year
         
-        return cls.create_or_update_shifts_for_week(next_week, year)
+        next_week_start = cls.get_week_start_date(current_week, year) + timedelta(weeks=1)
+        next_week, next_year = cls.get_week_and_year(next_week_start)
+        return cls.create_or_update_shifts_for_week(next_week, next_year)
     
     @classmethod
     def get_shift_schedule_for_week(cls, week_of_year, year=None):
         """Get the complete shift schedule for a week"""
+        # Doctors are prefetched so the whole week costs two queries
+        return cls.build_shift_schedule(cls.get_week_shifts(week_of_year, year))
+    
+    @classmethod
+    async def aget_shift_schedule_for_week(cls, week_of_year, year=None):
+        """Async get_shift_schedule_for_week"""
+        return cls.build_shift_schedule([shift async for shift in cls.get_week_shifts(week_of_year, year)])
+    
+    @classmethod
+    def get_week_shifts(cls, week_of_year, year=None):
         if year is None:
             year = timezone.now().year
-            
-        shifts = Shift.objects.filter(week_of_year=week_of_year)
+        return Shift.objects.filter(year=year, week_of_year=week_of_year).prefetch_related('doctors')
+    
+    @classmethod
+    def get_shift_schedule_for_range(cls, start_date, end_date):
+        """
+        Get the shift schedule of every date from start_date to end_date, as
+        {date: {shift_type: shift}}, with the same two queries for any span
+        """
+        weeks = cls.iter_weeks(*cls.get_week_and_year(start_date), *cls.get_week_and_year(end_date))
+        shifts = Shift.objects.filter(cls.weeks_filter(weeks)).prefetch_related('doctors')
         
+        schedule = {}
+        for shift in shifts:
+            day = cls.get_week_start_date(shift.week_of_year, shift.year) + timedelta(days=shift.day_of_week)
+            if start_date <= day <= end_date:
+                schedule.setdefault(day, {})[shift.shift_type] = cls.shift_schedule_entry(shift)
+        return schedule
+    
+    @classmethod
+    def build_shift_schedule(cls, shifts):
+        """Group shifts with prefetched doctors by day name and shift type"""
         schedule = {}
         for shift in shifts:
             day_name = dict(Shift.DAYS_OF_WEEK)[shift.day_of_week]
             if day_name not in schedule:
                 schedule[day_name] = {}
             
-            schedule[day_name][shift.shift_type] = {
-                'id': shift.id,
-                'start_time': shift.start_time.strftime('%H:%M'),
-                'end_time': shift.end_time.strftime('%H:%M'),
-                'doctors': [
-                    {
-                        'id': doctor.id,
-                        'full_name': doctor.full_name,
-                        'profile_picture_url': doctor.profile_picture_url
-                    }
-                    for doctor in shift.doctors.all()
-                ]
-            }
+            schedule[day_name][shift.shift_type] = cls.shift_schedule_entry(shift)
         
-        return schedule 
\ No newline at end of file
+        return schedule
+    
+    @classmethod
+    def shift_schedule_entry(cls, shift):
+        return {
+            'id': shift.id,
+            'start_time': shift.start_time.strftime('%H:%M'),
+            'end_time': shift.end_time.strftime('%H:%M'),
+            'doctors': [
+                {
+                    'id': doctor.id,
+                    'full_name': doctor.full_name,
+                    'profile_picture_url': doctor.profile_picture_url
+                }
+                for doctor in shift.doctors.all()
+            ]
+        }
@@ -1,9 +1,13 @@
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import Q
+from rest_framework.views import APIView
+from django.db.models import Count, Max, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import datetime, timedelta
 from calendar import monthcalendar
 from .models import Doctor, Service, Shift, Appointment
@@ -12,7 +16,20 @@ from .serializers import (
     AppointmentSerializer, CalendarAppointmentSerializer
 )
 from .utils.shift_rotation import ShiftRotationManager
+from .utils.calendar import build_range_calendar
+from .utils.calendar_cache import get_cached_week, get_cache_stats
+from .utils.changes import ChangesExpired, changes_since, latest_seq, parse_feed_params
+from .utils.daily_stats import daily_report, monthly_report
+from .utils.search import patient_search_filter
+from .utils.audit import DEFAULT_FINDING_LIMIT, MAX_FINDING_LIMIT, audit_report
+from .utils.availability import AvailabilityMap, format_minute, find_earliest_slots
+from .utils.booking import bulk_write_appointments
+from .utils.fast_serializers import appointment_values, serialize_appointments
+from .utils.export import EXPORT_FORMATS, export_queryset, iter_export
+from .utils.metrics import registry as metrics_registry
+from .utils.query_budget import query_budget
 from .permissions import IsAdminOrDoctor
+from .pagination import AppointmentPagination, ShiftPagination
 
 # Create your views here.
 
@@ -23,6 +40,10 @@ class DoctorViewSet(viewsets.ModelViewSet):
     queryset = Doctor.objects.all()
     serializer_class = DoctorSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Most queries per request, counting the JWT user lookup
+    query_budgets = {
+        'list': 2, 'retrieve': 2, 'create': 4, 'update': 5, 'partial_update': 5, 'destroy': 18,
+    }
 
     def get_queryset(self):
         """Filter doctors based on user permissions"""
@@ -40,6 +61,9 @@ class ServiceViewSet(viewsets.ModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budgets = {
+        'list': 2, 'retrieve': 2, 'create': 3, 'update': 4, 'partial_update': 4, 'destroy': 15,
+    }
 
     def get_queryset(self):
         """Filter services based on user permissions"""
@@ -83,17 +107,25 @@ class ShiftViewSet(viewsets.ModelViewSet):
     queryset = Shift.objects.all()
     serializer_class = ShiftSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ShiftPagination
+    query_budgets = {
+        'list': 3, 'retrieve': 3, 'create': 4, 'update': 5, 'partial_update': 5, 'destroy': 5,
+    }
+    
+    # Upper bound for a single generate_range request (two years)
+    MAX_GENERATED_WEEKS = 106
 
     def get_queryset(self):
         """Filter shifts based on week parameter and user permissions"""
         queryset = Shift.objects.all()
         
-        # Filter by week if provided
+        # Filter by week (of the given or current year) if provided
         week = self.request.query_params.get('week')
         if week:
             try:
                 week = int(week)
-                queryset = queryset.filter(week_of_year=week)
+                year = int(self.request.query_params.get('year') or timezone.now().year)
+                queryset = queryset.filter(year=year, week_of_year=week)
             except ValueError:
                 return Response(
                     {"error": "Invalid week parameter"}, 
@@ -109,7 +141,14 @@ class ShiftViewSet(viewsets.ModelViewSet):
         
         return queryset.prefetch_related('doctors')
 
+    def paginate_queryset(self, queryset):
+        """A single week is bounded, so it is returned unpaginated"""
+        if self.request.query_params.get('week'):
+            return None
+        return super().paginate_queryset(queryset)
+
     @action(detail=True, methods=['post'])
+    @query_budget(7)
     def doctors(self, request, pk=None):
         """Add doctors to a shift"""
         if not request.user.is_staff:
@@ -138,6 +177,7 @@ class ShiftViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['delete'], url_path='doctors/(?P<doctor_id>[^/.]+)')
+    @query_budget(7)
     def remove_doctor(self, request, pk=None, doctor_id=None):
         """Remove a doctor from a shift"""
         if not request.user.is_staff:
@@ -163,6 +203,7 @@ class ShiftViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=False, methods=['post'])
+    @query_budget(12)
     def generate_week(self, request):
         """Generate shifts for a specific week"""
         if not request.user.is_staff:
@@ -182,12 +223,15 @@ class ShiftViewSet(viewsets.ModelViewSet):
         
         try:
             week = int(week)
-            if year:
-                year = int(year)
+            year = int(year) if year else timezone.now().year
             
-            shifts = ShiftRotationManager.create_or_update_shifts_for_week(week, year)
+            report = ShiftRotationManager.generate_shifts([(week, year)])
+            shifts = list(report['shifts'])
             return Response({
                 "message": f"Generated {len(shifts)} shifts for week {week}",
+                "created": report['created'],
+                "updated": report['updated'],
+                "unchanged": report['unchanged'],
                 "shifts": ShiftSerializer(shifts, many=True).data
             })
         except Exception as e:
@@ -196,6 +240,68 @@ class ShiftViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['post'])
+    @query_budget(10)
+    def generate_range(self, request):
+        """Generate shifts for every week from (start_week, start_year) to (end_week, end_year)"""
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Only administrators can generate shifts"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        required = ['start_week', 'start_year', 'end_week', 'end_year']
+        missing = [name for name in required if not request.data.get(name)]
+        if missing:
+            return Response(
+                {"error": f"{', '.join(missing)} parameter(s) required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start_week, start_year, end_week, end_year = [int(request.data.get(name)) for name in required]
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "Invalid week or year parameter"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        for week, year in [(start_week, start_year), (end_week, end_year)]:
+            if not 1 <= week <= ShiftRotationManager.get_weeks_in_year(year):
+                return Response(
+                    {"error": f"Year {year} has no week {week}"}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        weeks = list(ShiftRotationManager.iter_weeks(start_week, start_year, end_week, end_year))
+        if not weeks:
+            return Response(
+                {"error": "The end week must not be before the start week"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(weeks) > self.MAX_GENERATED_WEEKS:
+            return Response(
+                {"error": f"At most {self.MAX_GENERATED_WEEKS} weeks can be generated at once"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            report = ShiftRotationManager.generate_shifts(weeks)
+            return Response({
+                "message": f"Generated shifts for {len(weeks)} weeks",
+                "weeks": len(weeks),
+                "created": report['created'],
+                "updated": report['updated'],
+                "unchanged": report['unchanged'],
+                "doctors_added": report['doctors_added'],
+                "doctors_removed": report['doctors_removed'],
+            })
+        except Exception as e:
+            return Response(
+                {"error": f"Error generating shifts: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
 class AppointmentViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing appointments
@@ -203,18 +309,33 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AppointmentPagination
+    query_budgets = {
+        'list': 2, 'retrieve': 2, 'create': 12, 'update': 17, 'partial_update': 17, 'destroy': 7,
+    }
+    
+    # Longest start_date/end_date span that is returned unpaginated
+    MAX_UNPAGINATED_DAYS = 92
+    # Most appointments accepted by one bulk request
+    MAX_BULK_ITEMS = 500
+    BULK_MODES = ('atomic', 'best_effort')
 
     def get_queryset(self):
         """Filter appointments based on query parameters and user permissions"""
         queryset = Appointment.objects.select_related('doctor', 'service')
         
-        # Filter by patient name (partial search)
+        # Filter by patient name or phone prefix, most recent first
         patient_name = self.request.query_params.get('patient_name')
         if patient_name:
-            queryset = queryset.filter(
-                Q(patient_first_name__icontains=patient_name) |
-                Q(patient_last_name__icontains=patient_name)
-            )
+            queryset = queryset.filter(patient_search_filter(patient_name)).order_by('-start_datetime', '-id')
+            self.keyset_ordering = ('-start_datetime', '-id')
+        
+        # Filter by clinic-local date range
+        start_date, end_date = self.get_date_range()
+        if start_date:
+            queryset = queryset.filter(start_date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(start_date__lte=end_date)
         
         # Filter by user permissions
         user = self.request.user
@@ -225,7 +346,126 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         return queryset
 
+    def get_date_range(self):
+        """Get the start_date and end_date query parameters as dates"""
+        dates = []
+        for name in ['start_date', 'end_date']:
+            value = self.request.query_params.get(name)
+            try:
+                dates.append(datetime.strptime(value, '%Y-%m-%d').date() if value else None)
+            except ValueError:
+                raise ValidationError({name: "Dates must use the YYYY-MM-DD format"})
+        return dates
+
+    def list(self, request, *args, **kwargs):
+        """List appointments, serialized straight from .values() rows"""
+        queryset = appointment_values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serialize_appointments(page))
+        return Response(serialize_appointments(queryset))
+
+    def paginate_queryset(self, queryset):
+        """Explicit, bounded date ranges are returned unpaginated"""
+        start_date, end_date = self.get_date_range()
+        if start_date and end_date and 0 <= (end_date - start_date).days < self.MAX_UNPAGINATED_DAYS:
+            return None
+        return super().paginate_queryset(queryset)
+
     @action(detail=False, methods=['get'])
+    @query_budget(2)
+    def patients(self, request):
+        """Search distinct patients by name or phone, ranked by their most recent appointment"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"error": "q parameter is required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not request.user.is_staff:
+            return Response([])
+        
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response(
+                {"error": "Invalid limit parameter"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        patients = Appointment.objects.filter(patient_search_filter(query)).values(
+            'patient_first_name', 'patient_last_name', 'patient_phone_number'
+        ).annotate(
+            appointment_count=Count('id'),
+            last_appointment=Max('start_datetime'),
+        ).order_by('-last_appointment')[:limit]
+        
+        return Response([
+            {
+                'patient_first_name': patient['patient_first_name'],
+                'patient_last_name': patient['patient_last_name'],
+                'patient_full_name': f"{patient['patient_first_name']} {patient['patient_last_name']}",
+                'patient_phone_number': patient['patient_phone_number'],
+                'appointment_count': patient['appointment_count'],
+                'last_appointment': timezone.localtime(patient['last_appointment']).isoformat(),
+            }
+            for patient in patients
+        ])
+
+    @action(detail=False, methods=['get'])
+    @query_budget(3)
+    def export(self, request):
+        """
+        Stream the appointments of a date range as CSV or NDJSON.
+
+        Takes start_date and end_date, optional doctor and service ids and
+        export_format ('csv' by default). Rows are fetched in chunks, so
+        memory use stays flat whatever the size of the range.
+        """
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Only staff members can export appointments"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        start_date, end_date = self.get_date_range()
+        if not start_date or not end_date:
+            return Response(
+                {"error": "start_date and end_date parameters are required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Not `format`, which DRF reserves for picking a renderer
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        filters = {}
+        for name in ['doctor', 'service']:
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    filters[f'{name}_id'] = int(value)
+                except ValueError:
+                    return Response(
+                        {"error": f"Invalid {name} parameter"}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+        
+        queryset = export_queryset(start_date, end_date, **filters)
+        response = StreamingHttpResponse(
+            iter_export(queryset, export_format), content_type=EXPORT_FORMATS[export_format]
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="appointments-{start_date}-{end_date}.{export_format}"'
+        )
+        return response
+
+    @action(detail=False, methods=['get'])
+    @query_budget(2)
     def future(self, request):
         """Get future appointments in a calendar-friendly structure"""
         week = request.query_params.get('week')
@@ -238,30 +478,9 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         try:
             week = int(week)
-            year = timezone.now().year
-            
-            # Get the start date of the week
-            week_start = ShiftRotationManager.get_week_start_date(week, year)
-            week_end = week_start + timedelta(days=6)
-            
-            # Get appointments for the week
-            appointments = Appointment.objects.filter(
-                start_datetime__date__range=[week_start, week_end]
-            ).select_related('doctor', 'service')
-            
-            # Group by day
-            calendar_data = {}
-            for day in range(7):
-                current_date = week_start + timedelta(days=day)
-                day_appointments = appointments.filter(
-                    start_datetime__date=current_date
-                )
-                calendar_data[current_date.strftime('%Y-%m-%d')] = {
-                    'date': current_date.strftime('%Y-%m-%d'),
-                    'day_name': current_date.strftime('%A'),
-                    'appointments': AppointmentSerializer(day_appointments, many=True).data
-                }
+            year = int(request.query_params.get('year') or timezone.now().year)
             
+            calendar_data = get_cached_week('future', week, year)
             return Response(calendar_data)
         except ValueError:
             return Response(
@@ -274,32 +493,59 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['post'])
+    @query_budget(19)
+    def bulk(self, request):
+        """
+        Create or update many appointments in one request.
+
+        Items with an id replace that appointment. In atomic mode (the
+        default) nothing is saved unless every item is valid and free of
+        conflicts, in best_effort mode the valid items are saved.
+        """
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Only staff members can bulk edit appointments"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        items = request.data.get('appointments') if isinstance(request.data, dict) else None
+        mode = request.data.get('mode', 'atomic') if isinstance(request.data, dict) else None
+        
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"error": "appointments must be a non-empty list"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > self.MAX_BULK_ITEMS:
+            return Response(
+                {"error": f"At most {self.MAX_BULK_ITEMS} appointments can be sent at once"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if mode not in self.BULK_MODES:
+            return Response(
+                {"error": f"mode must be one of: {', '.join(self.BULK_MODES)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results, written = bulk_write_appointments(items, atomic=mode == 'atomic')
+        response = {
+            'mode': mode,
+            'created': sum(result['status'] == 'created' for result in results),
+            'updated': sum(result['status'] == 'updated' for result in results),
+            'failed': sum(result['status'] == 'error' for result in results),
+            'results': results,
+        }
+        if mode == 'atomic' and not written:
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+        return Response(response)
+
     def create(self, request, *args, **kwargs):
         """Create a new appointment with validation"""
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            # Additional validation for appointment conflicts
-            start_datetime = serializer.validated_data.get('start_datetime')
-            doctor = serializer.validated_data.get('doctor')
-            duration_minutes = serializer.validated_data.get('duration_minutes', 0)
-            
-            if start_datetime and doctor and duration_minutes:
-                end_datetime = start_datetime + timedelta(minutes=duration_minutes)
-                
-                # Check for conflicts
-                conflicting_appointments = Appointment.objects.filter(
-                    doctor=doctor,
-                    start_datetime__lt=end_datetime,
-                    end_datetime__gt=start_datetime
-                )
-                
-                if conflicting_appointments.exists():
-                    return Response(
-                        {"error": "This appointment conflicts with an existing appointment"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            appointment = serializer.save()
+            # The conflict check runs once, under the doctor's lock, while saving
+            serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -310,28 +556,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         
         if serializer.is_valid():
-            # Additional validation for appointment conflicts
-            start_datetime = serializer.validated_data.get('start_datetime', instance.start_datetime)
-            doctor = serializer.validated_data.get('doctor', instance.doctor)
-            duration_minutes = serializer.validated_data.get('duration_minutes', instance.duration_minutes)
-            
-            if start_datetime and doctor and duration_minutes:
-                end_datetime = start_datetime + timedelta(minutes=duration_minutes)
-                
-                # Check for conflicts (excluding current appointment)
-                conflicting_appointments = Appointment.objects.filter(
-                    doctor=doctor,
-                    start_datetime__lt=end_datetime,
-                    end_datetime__gt=start_datetime
-                ).exclude(id=instance.id)
-                
-                if conflicting_appointments.exists():
-                    return Response(
-                        {"error": "This appointment conflicts with an existing appointment"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            appointment = serializer.save()
+            serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -340,9 +565,13 @@ class CalendarViewSet(viewsets.ViewSet):
     API endpoint for calendar view
     """
     permission_classes = [permissions.IsAuthenticated]
+    
+    # Longest span a single range request may cover
+    MAX_RANGE_DAYS = 92
 
+    @query_budget(4)
     def list(self, request):
-        """Get calendar data for a specific week"""
+        """Get calendar data for a specific week (of the given or current year)"""
         week = request.query_params.get('week')
         
         if not week:
@@ -353,37 +582,9 @@ class CalendarViewSet(viewsets.ViewSet):
         
         try:
             week = int(week)
-            year = timezone.now().year
-            
-            # Get the start date of the week
-            week_start = ShiftRotationManager.get_week_start_date(week, year)
-            week_end = week_start + timedelta(days=6)
-            
-            # Get appointments for the week
-            appointments = Appointment.objects.filter(
-                start_datetime__date__range=[week_start, week_end]
-            ).select_related('doctor', 'service')
-            
-            # Get shift schedule for the week
-            shift_schedule = ShiftRotationManager.get_shift_schedule_for_week(week, year)
-            
-            # Group appointments by day
-            calendar_data = {}
-            for day in range(7):
-                current_date = week_start + timedelta(days=day)
-                day_name = current_date.strftime('%A')
-                
-                day_appointments = appointments.filter(
-                    start_datetime__date=current_date
-                )
-                
-                calendar_data[day_name] = {
-                    'date': current_date.strftime('%Y-%m-%d'),
-                    'day_name': day_name,
-                    'shifts': shift_schedule.get(day_name, {}),
-                    'appointments': CalendarAppointmentSerializer(day_appointments, many=True).data
-                }
+            year = int(request.query_params.get('year') or timezone.now().year)
             
+            calendar_data = get_cached_week('week', week, year)
             return Response(calendar_data)
         except ValueError:
             return Response(
@@ -395,3 +596,424 @@ class CalendarViewSet(viewsets.ViewSet):
                 {"error": f"Error fetching calendar data: {str(e)}"}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+    @action(detail=False, methods=['get'])
+    @query_budget(4)
+    def range(self, request):
+        """
+        Get calendar data for every day from start_date to end_date, keyed by
+        date. With compact=true each day lists its appointment count and
+        booked minutes per doctor instead of the appointments.
+        """
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        if not start_date or not end_date:
+            return Response(
+                {"error": "start_date and end_date parameters are required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if end_date < start_date or (end_date - start_date).days >= self.MAX_RANGE_DAYS:
+            return Response(
+                {"error": f"end_date must be within {self.MAX_RANGE_DAYS} days after start_date"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        compact = request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
+        return Response({
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'compact': compact,
+            'days': build_range_calendar(start_date, end_date, compact),
+        })
+
+    @action(detail=False, methods=['get'])
+    @query_budget(1)
+    def cache_stats(self, request):
+        """Get the calendar cache hit and miss counters of this process"""
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Only administrators can view cache statistics"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response(get_cache_stats())
+
+
+class AvailabilityViewSet(viewsets.ViewSet):
+    """
+    API endpoint for free appointment slots
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    # Longest date range a single availability request may cover
+    MAX_DAYS = 31
+    DEFAULT_STEP_MINUTES = 15
+    
+    # Earliest slot search horizon and result limits
+    DEFAULT_SEARCH_DAYS = 90
+    MAX_SEARCH_DAYS = 366
+    DEFAULT_SLOT_LIMIT = 5
+    MAX_SLOT_LIMIT = 50
+
+    def parse_duration(self, request):
+        """Get the slot length from the service or duration parameter"""
+        service_id = request.query_params.get('service')
+        if service_id:
+            return get_object_or_404(Service, pk=int(service_id)).duration_minutes
+        duration = int(request.query_params.get('duration', 0))
+        if duration < 1:
+            raise ValueError("service or a positive duration parameter is required")
+        return duration
+
+    def parse_doctor_ids(self, request):
+        doctor = request.query_params.get('doctor')
+        if not doctor:
+            return None
+        return [int(doctor_id) for doctor_id in doctor.split(',')]
+
+    def parse_time_of_day(self, value):
+        """Parse an HH:MM parameter into minutes of the day"""
+        if not value:
+            return None
+        parsed = datetime.strptime(value, '%H:%M')
+        return parsed.hour * 60 + parsed.minute
+
+    @query_budget(5)
+    def list(self, request):
+        """Get the free slots of many doctors over a date range"""
+        start_date = request.query_params.get('start_date')
+        if not start_date:
+            return Response(
+                {"error": "start_date parameter is required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            end_date = request.query_params.get('end_date')
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else start_date
+            step = int(request.query_params.get('step', self.DEFAULT_STEP_MINUTES))
+            duration = self.parse_duration(request)
+            doctor_ids = self.parse_doctor_ids(request)
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if end_date < start_date or (end_date - start_date).days >= self.MAX_DAYS:
+            return Response(
+                {"error": f"end_date must be within {self.MAX_DAYS} days after start_date"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if step < 1:
+            return Response(
+                {"error": "step must be a positive number of minutes"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        availability = AvailabilityMap.load(start_date, end_date, doctor_ids)
+        doctors = Doctor.objects.filter(id__in=availability.doctors_on_shift()).order_by('id')
+        
+        doctors_data = []
+        for doctor in doctors:
+            days = {}
+            for day in availability.dates():
+                days[day.strftime('%Y-%m-%d')] = [
+                    {'start_time': format_minute(start), 'end_time': format_minute(end)}
+                    for start, end in availability.free_slots(doctor.id, day, duration, step)
+                ]
+            doctors_data.append({
+                'id': doctor.id,
+                'full_name': doctor.full_name,
+                'days': days,
+            })
+        
+        return Response({
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'duration_minutes': duration,
+            'step_minutes': step,
+            'doctors': doctors_data,
+        })
+
+    @action(detail=False, methods=['get'])
+    @query_budget(13)
+    def earliest(self, request):
+        """Find the first free slots for a service or duration with any (or the given) doctors"""
+        try:
+            duration = self.parse_duration(request)
+            doctor_ids = self.parse_doctor_ids(request)
+            step = int(request.query_params.get('step', self.DEFAULT_STEP_MINUTES))
+            limit = int(request.query_params.get('limit', self.DEFAULT_SLOT_LIMIT))
+            day_start = self.parse_time_of_day(request.query_params.get('from_time'))
+            day_end = self.parse_time_of_day(request.query_params.get('to_time'))
+            
+            after = timezone.now()
+            after_param = request.query_params.get('after')
+            if after_param:
+                after = parse_datetime(after_param)
+                if after is None:
+                    after = datetime.strptime(after_param, '%Y-%m-%d')
+                if timezone.is_naive(after):
+                    after = timezone.make_aware(after)
+            
+            until = request.query_params.get('until')
+            if until:
+                until = datetime.strptime(until, '%Y-%m-%d').date()
+            else:
+                until = timezone.localtime(after).date() + timedelta(days=self.DEFAULT_SEARCH_DAYS)
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if (until - timezone.localtime(after).date()).days > self.MAX_SEARCH_DAYS:
+            return Response(
+                {"error": f"until must be within {self.MAX_SEARCH_DAYS} days after the search start"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if step < 1 or not 1 <= limit <= self.MAX_SLOT_LIMIT:
+            return Response(
+                {"error": f"step must be positive and limit between 1 and {self.MAX_SLOT_LIMIT}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        slots = find_earliest_slots(
+            duration, after, until, limit=limit, doctor_ids=doctor_ids,
+            day_start=day_start, day_end=day_end, step=step
+        )
+        doctor_names = dict(
+            Doctor.objects.filter(id__in={doctor_id for doctor_id, start, end in slots}).values_list('id', 'full_name')
+        )
+        
+        return Response({
+            'duration_minutes': duration,
+            'slots': [
+                {
+                    'doctor_id': doctor_id,
+                    'doctor_name': doctor_names.get(doctor_id),
+                    'start_datetime': timezone.localtime(start).isoformat(),
+                    'end_datetime': timezone.localtime(end).isoformat(),
+                }
+                for doctor_id, start, end in slots
+            ],
+        })
+
+class StatsViewSet(viewsets.ViewSet):
+    """
+    API endpoint for dashboard statistics, read from the daily doctor rollup
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Longest span a single daily statistics request may cover
+    MAX_DAYS = 366
+
+    def forbidden(self):
+        return Response(
+            {"error": "Only administrators can view statistics"}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    def parse_doctor_ids(self, request):
+        doctor = request.query_params.get('doctor')
+        if not doctor:
+            return None
+        return [int(doctor_id) for doctor_id in doctor.split(',')]
+
+    @query_budget(2)
+    def list(self, request):
+        """
+        Get appointment counts, booked minutes and revenue per doctor per day
+        from start_date to end_date, each with its per-service breakdown
+        """
+        if not request.user.is_staff:
+            return self.forbidden()
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        if not start_date or not end_date:
+            return Response(
+                {"error": "start_date and end_date parameters are required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            doctor_ids = self.parse_doctor_ids(request)
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if end_date < start_date or (end_date - start_date).days >= self.MAX_DAYS:
+            return Response(
+                {"error": f"end_date must be within {self.MAX_DAYS} days after start_date"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response({
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'days': daily_report(start_date, end_date, doctor_ids),
+        })
+
+    @action(detail=False, methods=['get'])
+    @query_budget(1)
+    def revenue(self, request):
+        """Get appointments, booked minutes and revenue by doctor by month of a year (default: current)"""
+        if not request.user.is_staff:
+            return self.forbidden()
+        try:
+            year = int(request.query_params.get('year') or timezone.localdate().year)
+            doctor_ids = self.parse_doctor_ids(request)
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= year <= 9999:
+            return Response(
+                {"error": "Invalid year parameter"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(monthly_report(year, doctor_ids))
+
+    @action(detail=False, methods=['get'])
+    @query_budget(4)
+    def totals(self, request):
+        """Get how many appointments, doctors, services and shifts there are, for the dashboard"""
+        if not request.user.is_staff:
+            return self.forbidden()
+        return Response({
+            'appointments': Appointment.objects.count(),
+            'doctors': Doctor.objects.count(),
+            'services': Service.objects.count(),
+            'shifts': Shift.objects.count(),
+        })
+
+
+class AuditViewSet(viewsets.ViewSet):
+    """
+    API endpoint auditing appointments against shifts
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Longest span a single audit request may cover
+    MAX_DAYS = 366
+
+    @query_budget(3)
+    def list(self, request):
+        """
+        Find the appointments from start_date to end_date that are outside
+        their doctor's shifts or overlap another of the doctor's appointments,
+        and the shifts with fewer doctors than required. Returns the counts
+        and the first limit findings; doctor limits the audit to those ids.
+        """
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Only administrators can audit appointments"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        start_date = request.query_params.get('start_date')
+        end_date = request.query_params.get('end_date')
+        if not start_date or not end_date:
+            return Response(
+                {"error": "start_date and end_date parameters are required"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            doctor = request.query_params.get('doctor')
+            doctor_ids = [int(doctor_id) for doctor_id in doctor.split(',')] if doctor else None
+            limit = int(request.query_params.get('limit') or DEFAULT_FINDING_LIMIT)
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if end_date < start_date or (end_date - start_date).days >= self.MAX_DAYS:
+            return Response(
+                {"error": f"end_date must be within {self.MAX_DAYS} days after start_date"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 <= limit <= MAX_FINDING_LIMIT:
+            return Response(
+                {"error": f"limit must be between 0 and {MAX_FINDING_LIMIT}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return Response(audit_report(start_date, end_date, doctor_ids, limit))
+
+
+class ChangeFeedViewSet(viewsets.ViewSet):
+    """
+    API endpoint for the appointment and shift change feed
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @query_budget(6)
+    def list(self, request):
+        """
+        Get the appointments and shifts changed after the since cursor, as
+        they are now, and the ids of the deleted ones. Without since only the
+        current cursor is returned. Long polls (wait) go to the async endpoint.
+        """
+        if not request.user.is_staff:
+            return Response(
+                {"error": "Only administrators can view changes"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            since, limit, wait = parse_feed_params(request.query_params)
+        except ValueError as e:
+            return Response(
+                {"error": f"Invalid parameter: {str(e)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Under WSGI a long poll would hold a worker for the whole wait
+        if wait > 0:
+            return Response(
+                {"error": "wait is only supported by /api/async/changes/"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if since is None:
+            return Response({'cursor': latest_seq()})
+        try:
+            return Response(changes_since(since, limit))
+        except ChangesExpired as e:
+            # The client has to reload everything and start over from a new cursor
+            return Response(
+                {"error": str(e), "oldest": e.oldest}, 
+                status=status.HTTP_410_GONE
+            )
+
+
+class MetricsView(APIView):
+    """
+    Per-route request metrics of this process in the Prometheus text format
+    """
+    permission_classes = [permissions.IsAdminUser]
+    swagger_schema = None
+
+    @query_budget(2)
+    def get(self, request):
+        return HttpResponse(
+            metrics_registry.render_prometheus(), 
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -39,6 +39,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings include the rest of the stack
+    'backend.clinic.middleware.MetricsMiddleware',
+    'backend.clinic.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -57,13 +60,35 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # DATABASE
 # ------------------------------------------------------------------------------
 
+# 'IMMEDIATE' makes every transaction take SQLite's write lock when it begins,
+# so concurrent writers queue on busy_timeout instead of one failing with
+# "database is locked" when it upgrades a read lock. None keeps SQLite's
+# deferred transactions.
+CLINIC_SQLITE_TRANSACTION_MODE = None
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open across requests of a worker thread
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': CLINIC_SQLITE_TRANSACTION_MODE,
+        },
+        # A file test database, so concurrency tests get real SQLite locking
+        # (the in-memory shared-cache one fails instead of waiting)
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Pragmas set on every new SQLite connection are
+# backend.clinic.utils.database.DEFAULT_SQLITE_PRAGMAS. Set
+# CLINIC_SQLITE_PRAGMAS to a dict to replace them, {} to keep SQLite's
+# defaults.
+
 # ------------------------------------------------------------------------------
 # PASSWORD VALIDATION
 # ------------------------------------------------------------------------------
@@ -124,6 +149,50 @@ TEMPLATES = [
     },
 ]
 
+# ------------------------------------------------------------------------------
+# CACHES
+# ------------------------------------------------------------------------------
+
+# The calendar cache is invalidated by model signals of the process that
+# made the change. With several worker processes, point it at a shared
+# backend (file or Redis) so every worker sees the invalidations.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'calendar': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'clinic-calendar',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+CLINIC_CALENDAR_CACHE = 'calendar'
+CLINIC_CALENDAR_CACHE_TIMEOUT = 60 * 60
+
+# Long polls of the change feed wake up when this cache announces a new
+# change. Like the calendar cache it only reaches other worker processes on
+# a shared backend; otherwise they see the change when their wait ends.
+CLINIC_CHANGES_CACHE = 'default'
+# Change log entries older than this are dropped, after which clients
+# polling from an older cursor have to reload. The log is compacted each
+# time this many more changes were logged, or by compact_changes.
+CLINIC_CHANGE_LOG_RETENTION_DAYS = 7
+CLINIC_CHANGE_LOG_COMPACT_EVERY = 10_000
+
+# Live updates at /api/async/events/ (ASGI only). The local broker reaches
+# the clients of this process; with several processes use
+# {'BACKEND': 'backend.clinic.utils.events.RedisBroker',
+#  'OPTIONS': {'url': 'redis://localhost:6379/0'}}.
+CLINIC_EVENT_BROKER = {'BACKEND': 'backend.clinic.utils.events.LocalBroker'}
+# Events a client may fall behind by before it is disconnected, and the
+# seconds between keep-alive comments on idle streams
+CLINIC_EVENTS_MAX_QUEUED = 100
+CLINIC_EVENTS_HEARTBEAT = 15
+
+# Doctors a shift needs before the audit reports it as understaffed
+CLINIC_MIN_SHIFT_DOCTORS = 1
+
 # ------------------------------------------------------------------------------
 # REST FRAMEWORK
 # ------------------------------------------------------------------------------
@@ -134,6 +203,19 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Default page size of the keyset-paginated appointment and shift lists
+CLINIC_API_PAGE_SIZE = 50
+
+# Per-route request metrics served at /api/_metrics/, and how many recent
+# requests per route their quantiles cover
+CLINIC_METRICS_ENABLED = True
+CLINIC_METRICS_RING_SIZE = 512
+
+# Log requests that run more queries than their view's query budget, or the
+# same query shape this many times (N+1 detection). Meant for development.
+CLINIC_QUERY_BUDGETS = DEBUG
+CLINIC_QUERY_REPEAT_THRESHOLD = 5
+
 # ------------------------------------------------------------------------------
 # CORS HEADERS
 # ------------------------------------------------------------------------------